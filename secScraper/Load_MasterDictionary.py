@@ -1,7 +1,22 @@
 """Routine to load MasterDictionary class"""
 # BDM : 201510
 
+import os
 import time
+import numpy as np
+
+# Categories of the SentimentTable bitmask, in the order of the % columns of the Loughran-McDonald output
+_table_categories = ['positive', 'negative', 'uncertainty', 'litigious', 'weak_modal', 'moderate_modal',
+                     'strong_modal', 'constraining']
+_modal_numbers = {'strong_modal': 1, 'moderate_modal': 2, 'weak_modal': 3}
+# Columns of the binary cache, in the order of the csv. Category columns hold the year the word was added (or removed,
+# if negative) hence the int16.
+_cache_columns = [('sequence_number', np.int32), ('word_count', np.int64), ('word_proportion', np.float64),
+                  ('average_proportion', np.float64), ('std_dev_prop', np.float64), ('doc_count', np.int32),
+                  ('negative', np.int16), ('positive', np.int16), ('uncertainty', np.int16),
+                  ('litigious', np.int16), ('constraining', np.int16), ('superfluous', np.int16),
+                  ('interesting', np.int16), ('modal_number', np.int8), ('irregular_verb', np.int16),
+                  ('harvard_iv', np.int16), ('syllables', np.int8), ('source', 'U'), ('stopword', bool)]
 
 
 def load_masterdictionary(file_path, print_flag=False, f_log=None, get_other=False):
@@ -68,6 +83,202 @@ def create_sentimentdictionaries(_master_dictionary, _sentiment_categories):
     return _sentiment_dictionary
 
 
+class SentimentTable:
+    """
+    Compact, array based version of the master dictionary used by the sentiment scanner. Words are kept in a sorted
+    array of utf-8 bytes and a word's id is its position in that array. Its categories are packed in a bitmask (see
+    _table_categories for the bit order) and its syllable count and length are kept in parallel numpy arrays. Words
+    the scanner would never count (digits, single characters) are flagged as not countable.
+    """
+    def __init__(self, words, flags, syllables, countable=None):
+        self.words = words
+        self.flags = np.asarray(flags, dtype=np.uint16)
+        self.syllables = np.asarray(syllables, dtype=np.uint16)
+        self.lengths = np.char.str_len(np.char.decode(words, 'utf-8')).astype(np.uint16)  # Characters, not bytes
+        self.countable = np.ones(len(words), dtype=bool) if countable is None else np.asarray(countable, dtype=bool)
+        assert len(self.words) == len(self.flags) == len(self.syllables) == len(self.countable)
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, tokens):
+        """
+        Find the id of many tokens at once with a binary search in the sorted words.
+
+        :param tokens: list of str
+        :return: numpy array of int64, -1 for the tokens that are not in the table or not countable
+        """
+        if len(tokens) == 0 or len(self.words) == 0:
+            return np.full(len(tokens), -1, dtype=np.int64)
+        encoded = np.array([token.encode() for token in tokens])
+        ids = np.searchsorted(self.words, encoded)
+        ids[ids == len(self.words)] = 0
+        found = (self.words[ids] == encoded) & self.countable[ids]
+        return np.where(found, ids, -1)
+
+    @classmethod
+    def from_master_dictionary(cls, _master_dictionary):
+        """
+        Build the table from the dictionary returned by load_masterdictionary.
+
+        :param _master_dictionary: dict {word: MasterDictionary}
+        :return: SentimentTable
+        """
+        words = sorted(word for word in _master_dictionary if not word.isdigit() and len(word) > 1)
+        flags = [sum(1 << bit for bit, category in enumerate(_table_categories)
+                     if getattr(_master_dictionary[word], category)) for word in words]
+        syllables = [_master_dictionary[word].syllables for word in words]
+        words = np.array([word.encode() for word in words]) if len(words) else np.array([], dtype='S1')
+        return cls(words, flags, syllables)
+
+    @classmethod
+    def from_cache(cls, cache):
+        """
+        Build the table on top of the memory mapped columns of a MasterDictionaryCache. Only the small per word
+        arrays (flags, syllables) are created, the words stay in the shared mapping.
+
+        :param cache: MasterDictionaryCache
+        :return: SentimentTable
+        """
+        c = cache.columns
+        flags = np.zeros(len(cache), dtype=np.uint16)
+        for bit, category in enumerate(_table_categories):
+            if category.endswith('_modal'):
+                is_set = c['modal_number'] == _modal_numbers[category]
+            else:
+                is_set = c[category] != 0
+            flags |= is_set.astype(np.uint16) << bit
+        decoded = np.char.decode(cache.words)
+        countable = (np.char.str_len(cache.words) > 1) & ~np.char.isdigit(decoded)
+        return cls(cache.words, flags, c['syllables'], countable)
+
+
+class MasterDictionaryCache:
+    """
+    Read-only view of the master dictionary on top of memory mapped numpy columns, as written by
+    save_masterdictionary_cache. It offers the same lookup API as the dict returned by load_masterdictionary but the
+    data lives in the page cache and is shared by all the processes that open it. Only the path is pickled when it is
+    sent to a worker.
+    """
+    def __init__(self, path_cache):
+        self.path_cache = path_cache
+        self._open()
+
+    def _open(self):
+        self.words = np.load(os.path.join(self.path_cache, 'words.npy'), mmap_mode='r')
+        self.columns = {name: np.load(os.path.join(self.path_cache, name + '.npy'), mmap_mode='r')
+                        for name, _ in _cache_columns}
+        self._sentiment_table = None
+
+    def __getstate__(self):
+        return {'path_cache': self.path_cache}
+
+    def __setstate__(self, state):
+        self.path_cache = state['path_cache']
+        self._open()
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return (word.decode() for word in self.words)
+
+    def _find(self, word):
+        """
+        Binary search of a word in the sorted string table.
+
+        :param word: str
+        :return: row of the word, -1 if it is not in the dictionary
+        """
+        encoded = word.encode()
+        idx = int(np.searchsorted(self.words, encoded))
+        if idx < len(self.words) and self.words[idx] == encoded:
+            return idx
+        return -1
+
+    def __contains__(self, word):
+        return self._find(word) >= 0
+
+    def __getitem__(self, word):
+        idx = self._find(word)
+        if idx < 0:
+            raise KeyError(word)
+        return self._entry(idx)
+
+    def _entry(self, idx):
+        """
+        Rebuild the MasterDictionary entry of a row, so that callers get the exact same object as with the csv.
+
+        :param idx: row in the columns
+        :return: MasterDictionary
+        """
+        cols = [self.words[idx].decode()] + [str(self.columns[name][idx]) for name, _ in _cache_columns
+                                             if name != 'stopword']
+        return MasterDictionary(cols, [cols[0]] if self.columns['stopword'][idx] else [])
+
+    def get(self, word, default=None):
+        idx = self._find(word)
+        return self._entry(idx) if idx >= 0 else default
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        return ((word.decode(), self._entry(idx)) for idx, word in enumerate(self.words))
+
+    @property
+    def sentiment_table(self):
+        """
+        Array based table used by the sentiment scanner, built once per process.
+
+        :return: SentimentTable
+        """
+        if self._sentiment_table is None:
+            self._sentiment_table = SentimentTable.from_cache(self)
+        return self._sentiment_table
+
+
+def save_masterdictionary_cache(_master_dictionary, path_cache):
+    """
+    Convert the master dictionary to a folder of numpy columns that can be memory mapped: a sorted string table for the
+    words and one typed column per attribute, in the order of the csv.
+
+    :param _master_dictionary: dict {word: MasterDictionary}, as returned by load_masterdictionary
+    :param path_cache: folder where the columns are written
+    :return: void
+    """
+    os.makedirs(path_cache, exist_ok=True)
+    words = sorted(_master_dictionary)
+    for name, dtype in _cache_columns:
+        column = np.array([getattr(_master_dictionary[word], name) for word in words], dtype=dtype)
+        np.save(os.path.join(path_cache, name + '.npy'), column)
+    # words.npy last: it marks the cache as complete
+    np.save(os.path.join(path_cache, 'words.npy'), np.array([word.encode() for word in words]))
+
+
+def load_masterdictionary_cache(file_path, path_cache, print_flag=False):
+    """
+    Load the master dictionary from its binary cache, converting the csv first if the cache is missing or older than
+    the csv.
+
+    :param file_path: path of the Loughran-McDonald csv
+    :param path_cache: folder holding the binary cache
+    :param print_flag: print some info
+    :return: MasterDictionaryCache
+    """
+    path_words = os.path.join(path_cache, 'words.npy')
+    names = ['words'] + [name for name, _ in _cache_columns]
+    if not all(os.path.isfile(os.path.join(path_cache, name + '.npy')) for name in names) \
+            or os.path.getmtime(path_words) < os.path.getmtime(file_path):
+        if print_flag:
+            print('[INFO] Converting the Master Dictionary to a binary cache in', path_cache)
+        save_masterdictionary_cache(load_masterdictionary(file_path, print_flag), path_cache)
+    cache = MasterDictionaryCache(path_cache)
+    if print_flag:
+        print('[INFO] {:,} words memory mapped from {}'.format(len(cache), path_cache))
+    return cache
+
+
 class MasterDictionary:
     def __init__(self, cols, _stopwords):
         self.word = cols[0].upper()
@@ -0,0 +1,193 @@
+"""
+Columnar cache of the CRSP stock price file.
+
+The csv (~30M lines) is split into byte ranges that are parsed in parallel, each one by the C parser of pandas. The
+complete lines are written once to a folder of numpy columns, sorted by ticker then date:
+tickers.npy (sorted table of the tickers), ticker.npy (int32 code in that table), date.npy (int32, ex: 20160815),
+price.npy and market_cap.npy (float64). The dates of the incomplete lines are kept in incomplete_date.npy, so that the
+statistics can be split by time range like the ones of the csv loader. Later runs memory map the columns; the time
+range and penny stock filters are masks over them. The cache is rebuilt when the csv is more recent than the cache.
+"""
+
+import os
+import io
+import csv
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+
+_columns = ['ticker', 'date', 'price', 'market_cap']
+
+
+def read_header(path_csv):
+    """
+    Read the header of the CRSP file.
+
+    :param path_csv: path to the csv
+    :return: list of column names and size of the header in bytes
+    """
+    with open(path_csv, 'rb') as f:
+        line = f.readline()
+    return line.decode().strip().split(','), len(line)
+
+
+def line_chunks(path_csv, nb_chunks, offset=0):
+    """
+    Split a file into byte ranges that start and end on line boundaries.
+
+    :param path_csv: path to the file
+    :param nb_chunks: number of ranges wanted. Small files get fewer.
+    :param offset: where the first range starts, ex: after the header
+    :return: list of (start, stop)
+    """
+    size = os.path.getsize(path_csv)
+    bounds = [offset]
+    with open(path_csv, 'rb') as f:
+        for idx in range(1, nb_chunks):
+            f.seek(max(offset + (size - offset)*idx//nb_chunks, bounds[-1]))
+            f.readline()  # Move to the start of the next line
+            position = min(f.tell(), size)
+            if position > bounds[-1]:
+                bounds.append(position)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_chunk(task):
+    """
+    Parse a byte range of the CRSP file. The lines without a ticker, a price or a number of shares are dropped.
+
+    :param task: (path_csv, header, start, stop)
+    :return: dict with the sorted tickers of the chunk, the columns of the complete lines (ticker as a code in the
+    chunk's tickers), the number of lines and the dates of the incomplete lines (0 if the date is missing too)
+    """
+    path_csv, header, start, stop = task
+    with open(path_csv, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    usecols = ['date', 'TICKER', 'ASK', 'SHROUT']
+    df = pd.read_csv(io.BytesIO(data), header=None, names=header, usecols=usecols, dtype=str,
+                     keep_default_na=False, quoting=csv.QUOTE_NONE)
+    complete = ((df['TICKER'] != '') & (df['ASK'] != '') & (df['SHROUT'] != '')).values
+    incomplete_date = pd.to_numeric(df['date'][~complete], errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+    df = df[complete]
+    tickers, codes = np.unique(df['TICKER'].to_numpy(dtype=str), return_inverse=True)
+    price = df['ASK'].to_numpy(dtype=np.float64)
+    return {
+        'tickers': tickers,
+        'ticker': codes.astype(np.int32),
+        'date': df['date'].to_numpy(dtype=np.int32),
+        'price': price,
+        'market_cap': 1000*price*df['SHROUT'].to_numpy(dtype=np.float64),
+        'nb_lines': len(complete),
+        'incomplete_date': incomplete_date
+    }
+
+
+def convert_crsp(path_csv, path_cache, nb_processes=None):
+    """
+    Parse the CRSP file in parallel and write its columnar cache.
+
+    :param path_csv: path to the csv
+    :param path_cache: folder where the columns are written
+    :param nb_processes: number of processes. Defaults to the number of CPUs.
+    :return: void
+    """
+    nb_processes = nb_processes if nb_processes else mp.cpu_count()
+    header, header_size = read_header(path_csv)
+    tasks = [(path_csv, header, start, stop) for start, stop in line_chunks(path_csv, 4*nb_processes, header_size)]
+    with mp.Pool(nb_processes) as p:
+        chunks = p.map(parse_chunk, tasks)  # In file order
+
+    # Codes of the chunks -> codes in the table of all the tickers
+    tickers = np.unique(np.concatenate([chunk['tickers'] for chunk in chunks] + [np.array([], dtype=str)]))
+    columns = {
+        'ticker': np.concatenate([np.searchsorted(tickers, chunk['tickers']).astype(np.int32)[chunk['ticker']]
+                                  for chunk in chunks] + [np.array([], dtype=np.int32)]),
+        'date': np.concatenate([chunk['date'] for chunk in chunks] + [np.array([], dtype=np.int32)]),
+        'price': np.concatenate([chunk['price'] for chunk in chunks] + [np.array([])]),
+        'market_cap': np.concatenate([chunk['market_cap'] for chunk in chunks] + [np.array([])])
+    }
+    incomplete_date = np.concatenate([chunk['incomplete_date'] for chunk in chunks] + [np.array([], dtype=np.int32)])
+    order = np.lexsort((columns['date'], columns['ticker']))  # Stable: duplicates stay in file order
+
+    os.makedirs(path_cache, exist_ok=True)
+    np.save(os.path.join(path_cache, 'tickers.npy'), np.char.encode(tickers))
+    np.save(os.path.join(path_cache, 'stats.npy'),
+            np.array([sum(chunk['nb_lines'] for chunk in chunks), len(incomplete_date)]))
+    np.save(os.path.join(path_cache, 'incomplete_date.npy'), incomplete_date)
+    for name in _columns[::-1]:  # date.npy last: it marks the cache as complete
+        np.save(os.path.join(path_cache, name + '.npy'), columns[name][order])
+
+
+def load_crsp_cache(path_csv, path_cache, nb_processes=None, verbose=True):
+    """
+    Memory map the columnar cache of the CRSP file, converting the csv first if the cache is missing or older than
+    the csv.
+
+    :param path_csv: path to the csv
+    :param path_cache: folder holding the cache
+    :param nb_processes: number of processes used for the conversion
+    :param verbose: print some info
+    :return: dict of read only arrays: tickers (bytes), ticker, date, price, market_cap, stats, incomplete_date
+    """
+    names = _columns + ['tickers', 'stats', 'incomplete_date']
+    path_date = os.path.join(path_cache, 'date.npy')
+    if not all(os.path.isfile(os.path.join(path_cache, name + '.npy')) for name in names) \
+            or os.path.getmtime(path_date) < os.path.getmtime(path_csv):
+        if verbose:
+            print('[INFO] Converting {} to a columnar cache in {}'.format(path_csv, path_cache))
+        convert_crsp(path_csv, path_cache, nb_processes)
+    columns = {name: np.load(os.path.join(path_cache, name + '.npy'), mmap_mode='r') for name in names}
+    if verbose:
+        print('[INFO] {:,} prices of {:,} tickers memory mapped from {}'
+              .format(len(columns['date']), len(columns['tickers']), path_cache))
+    return columns
+
+
+def _in_range(dates, time_range):
+    """
+    Find the dates that belong to the time range, with the same qtr rule as pre_processing.load_stock_data.
+
+    :param dates: int array, ex: 20160815
+    :param time_range: [first qtr, last qtr], ex: s['time_range']
+    :return: bool array
+    """
+    qtr = 10*(dates // 10000) + (dates // 100 % 100) // 3 + 1
+    start, finish = time_range[0], time_range[-1]
+    return (qtr >= 10*start[0] + start[1]) & (qtr <= 10*finish[0] + finish[1])
+
+
+def filter_prices(columns, time_range, penny_limit=0):
+    """
+    Keep the prices in the time range, drop the tickers that were ever below the penny limit in the time range and
+    the duplicated (ticker, date) - the last line of the file wins.
+
+    :param columns: dict of arrays, see load_crsp_cache
+    :param time_range: [first qtr, last qtr], ex: s['time_range']
+    :param penny_limit: market cap below which a ticker is a penny stock
+    :return: dict of arrays ticker, date, price, market_cap, still sorted by ticker then date, and dict of statistics.
+    As in the csv loader, a line out of the time range is not counted as incomplete.
+    """
+    dates = np.asarray(columns['date'])
+    in_range = _in_range(dates, time_range)
+    incomplete_in_range = _in_range(np.asarray(columns['incomplete_date']), time_range)
+
+    codes = np.asarray(columns['ticker'])
+    market_cap = np.asarray(columns['market_cap'])
+    penny = np.zeros(len(columns['tickers']), dtype=bool)
+    penny[codes[in_range & (market_cap < penny_limit)]] = True
+    keep = in_range & ~penny[codes]
+    keep[:-1] &= (codes[:-1] != codes[1:]) | (dates[:-1] != dates[1:])  # Not followed by the same (ticker, date)
+
+    stats = {
+        'nb_lines': int(columns['stats'][0]),
+        'nb_incomplete': int(incomplete_in_range.sum()),
+        'nb_out_of_range': int((~in_range).sum() + (~incomplete_in_range).sum()),
+        'nb_penny': int(penny.sum()),
+        'nb_tickers': len(np.unique(codes[keep]))
+    }
+    return {name: np.asarray(columns[name])[keep] for name in _columns}, stats
+
@@ -0,0 +1,108 @@
+"""
+Spark version of the processing stage.
+
+The settings and the sentiment dictionary are broadcast once, instead of travelling with every CIK. The CIKs are
+spread over the partitions by estimated cost (see scheduler.estimate_cost), and each partition sets up the processing
+context once and writes its scores to its own file, in the journal format (see journal.py). Only the status codes and
+the timings go back to the driver; post-processing reads the scores back lazily with iter_results.
+"""
+
+import os
+import glob
+import heapq
+from secScraper import journal
+from secScraper import processing
+from secScraper import scheduler
+
+
+def partition_ciks(cik_path, s, nb_partitions):
+    """
+    Spread the CIKs over partitions of about the same total cost. Each CIK goes to the partition with the lowest cost
+    so far, most expensive CIK first.
+
+    :param cik_path: dictionary {cik: list of paths}
+    :param s: Settings dictionary
+    :param nb_partitions: number of partitions
+    :return: list of nb_partitions lists of CIK
+    """
+    order, costs = scheduler.lpt_order(cik_path, s)
+    partitions = [[] for _ in range(nb_partitions)]
+    loads = [(0, idx) for idx in range(nb_partitions)]
+    for cik in order:
+        load, idx = heapq.heappop(loads)
+        partitions[idx].append(cik)
+        heapq.heappush(loads, (load + costs[cik], idx))
+    return partitions
+
+
+def output_folder(s):
+    """
+    Folder that holds the partitioned scores. There is one per settings hash, so runs with other settings do not get
+    mixed up.
+
+    :param s: Settings dictionary
+    :return: str
+    """
+    return os.path.join(s['path_partitioned_scores'], journal.settings_hash(s))
+
+
+def process_partition(idx, records, s_broadcast, lm_broadcast):
+    """
+    Process all the CIKs of a partition and write their scores to the partition's file. The file is written next to
+    its final location then moved, so that a retried task never leaves duplicated or partial records behind.
+
+    :param idx: index of the partition
+    :param records: iterable of (cik, paths)
+    :param s_broadcast: broadcast of the settings dictionary. Anything with a value attribute.
+    :param lm_broadcast: broadcast of the sentiment analysis dictionary
+    :return: generator of (cik, status code, timings)
+    """
+    s = s_broadcast.value
+    processing.init_worker(s, lm_broadcast.value)  # Once per partition, not once per CIK
+    path = os.path.join(output_folder(s), 'part-{:05d}.bin'.format(idx))
+    path_temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(path_temp, 'wb') as f:
+        for cik, paths in records:
+            value = processing.process_cik((cik, paths))
+            journal.append_result(f, value)
+            yield value[0], value[2], value[3]
+    os.replace(path_temp, path)
+
+
+def run_spark(sc, cik_path, s, lm_dictionary, nb_partitions=None):
+    """
+    Process all the CIKs on a Spark cluster (or a local Spark session).
+
+    :param sc: SparkContext
+    :param cik_path: dictionary {cik: list of paths}
+    :param s: Settings dictionary. A plain dict, the read only version cannot be pickled.
+    :param lm_dictionary: Sentiment analysis dictionary
+    :param nb_partitions: number of partitions. Defaults to 4 per core of the cluster.
+    :return: list of (cik, status code, timings), one per CIK
+    """
+    nb_partitions = nb_partitions if nb_partitions else 4*sc.defaultParallelism
+    folder = output_folder(s)
+    os.makedirs(folder, exist_ok=True)
+    for path in glob.glob(os.path.join(folder, 'part-*')):  # Left by a previous run
+        os.remove(path)
+
+    s_broadcast = sc.broadcast(s)
+    lm_broadcast = sc.broadcast(lm_dictionary)
+    partitions = partition_ciks(cik_path, s, nb_partitions)
+    keyed = [(idx, (cik, cik_path[cik])) for idx, partition in enumerate(partitions) for cik in partition]
+    rdd = sc.parallelize(keyed, nb_partitions).partitionBy(nb_partitions, lambda idx: idx).values()
+    summary = rdd.mapPartitionsWithIndex(
+        lambda idx, records: process_partition(idx, records, s_broadcast, lm_broadcast)).collect()
+    print("[INFO] Scores written to {} partitions in {}".format(nb_partitions, folder))
+    return summary
+
+
+def iter_results(s):
+    """
+    Lazily read back the scores written by run_spark.
+
+    :param s: Settings dictionary
+    :return: generator of (cik, quarterly_results, status code)
+    """
+    for path in sorted(glob.glob(os.path.join(output_folder(s), 'part-*.bin'))):
+        yield from journal.iter_records(path)
@@ -0,0 +1,234 @@
+"""
+Incremental quarterly update: score the filings of one new qtr without rebuilding the whole history.
+
+The scores of the previous run are reloaded from its result journal (see journal.py). Only the CIK that filed during
+the new qtr are processed, and only with the two reports of the new pair (new qtr and lag qtr before), so each CIK
+goes through a single comparison. The quintiles and the portfolios are then extended by the new qtr only - unless
+the update drops CIK that were scored in earlier qtr (see dropped_ciks), in which case the post-processing of the whole
+time_range is rebuilt from the merged scores, as a full rebuild would.
+Note: with s['tf_idf_scope'] == 'window', the IDF of the new pair is fitted on its two reports instead of the whole
+window of the CIK. Use 'pair' for scores identical to a full rebuild.
+"""
+
+import os
+from secScraper import post_processing
+
+
+_failed_codes = [1, 4, 5, 6]  # Status codes that discard the whole CIK, see process_cik and pipeline.killed_code
+
+
+def parse_qtr(text):
+    """
+    Read a qtr given on the command line.
+
+    :param text: str, ex: '2019Q1'
+    :return: tuple (year, qtr), ex: (2019, 1)
+    """
+    year, qtr = text.upper().split('Q')
+    qtr = (int(year), int(qtr))
+    if not 1 <= qtr[1] <= 4:
+        raise ValueError('[ERROR] Invalid qtr {}'.format(text))
+    return qtr
+
+
+def lagged_qtr(qtr, lag):
+    """
+    Find the qtr that was lag qtr before a given one.
+
+    :param qtr: tuple (year, qtr)
+    :param lag: number of qtr
+    :return: tuple (year, qtr)
+    """
+    idx = 4*qtr[0] + qtr[1] - 1 - lag
+    return idx // 4, idx % 4 + 1
+
+
+def previous_settings(s):
+    """
+    Settings of the run that the update builds on: the same ones, with a time_range ending one qtr earlier.
+
+    :param s: Settings dictionary of the update
+    :return: dict
+    """
+    s_previous = {**s}
+    s_previous['time_range'] = [s['time_range'][0], lagged_qtr(s['time_range'][1], 1)]
+    s_previous['list_qtr'] = s['list_qtr'][:-1]
+    return s_previous
+
+
+def update_journal_settings(s):
+    """
+    Settings under which the results of the new pairs are journaled while the update runs. They are kept apart from
+    the journal of the full results, so that an interrupted update can be resumed.
+
+    :param s: Settings dictionary of the update
+    :return: dict
+    """
+    return {**s, 'path_journal': os.path.join(s['path_journal'], 'update')} if s.get('path_journal') else {**s}
+
+
+def _path_qtr(path):
+    split_path = path.split('/')
+    return int(split_path[-3]), int(split_path[-2][3])  # Ex: (2016, 3)
+
+
+def new_filings(cik_path, qtr, s):
+    """
+    Find the CIK that filed during qtr and keep only the reports needed for the new pair.
+
+    :param cik_path: dictionary {cik: list of paths}
+    :param qtr: new qtr
+    :param s: Settings dictionary
+    :return: dictionary {cik: paths of the reports filed during qtr and lag qtr before}
+    """
+    previous_qtr = lagged_qtr(qtr, s['lag'])
+    result = dict()
+    for cik, paths in cik_path.items():
+        path_qtr = {path: _path_qtr(path) for path in paths}
+        if qtr in path_qtr.values():
+            result[cik] = [path for path in paths if path_qtr[path] in [qtr, previous_qtr]]
+    print("[INFO] {:,}/{:,} CIK filed during {}".format(len(result), len(cik_path), qtr))
+    return result
+
+
+def merge_new_scores(previous_results, new_results, qtr, reviewed_ciks=None):
+    """
+    Add the scores of the new qtr to the ones of the previous run. The CIK are discarded as they would be in a full
+    rebuild: a CIK discarded by the previous run stays discarded, a CIK whose new pair fails is discarded with the new
+    status code and a CIK rejected by the review of the publications is removed.
+
+    :param previous_results: dict {cik: (quarterly_results, status code)}, as returned by journal.load_journal
+    :param new_results: dict {cik: (quarterly_results, status code)} for the CIK that filed during qtr
+    :param qtr: new qtr
+    :param reviewed_ciks: CIK kept by pre_processing.review_cik_publications over the new time_range. None to skip.
+    :return: dict {cik: (quarterly_results, status code)} with all the results
+    """
+    merged = dict(previous_results)
+    if reviewed_ciks is not None:
+        reviewed_ciks = set(reviewed_ciks)
+        merged = {cik: v for cik, v in merged.items() if cik in reviewed_ciks}
+    for cik, (quarterly_results, code) in new_results.items():
+        previous, previous_code = merged.get(cik, ({}, None))
+        if previous_code in _failed_codes:
+            continue
+        if code in _failed_codes:
+            merged[cik] = ({}, code)
+        elif qtr in quarterly_results and quarterly_results[qtr] != 0:
+            merged[cik] = ({**previous, qtr: quarterly_results[qtr]}, 0)
+        elif cik not in merged:
+            merged[cik] = (quarterly_results, code)
+    return merged
+
+
+def dropped_ciks(previous_results, merged_results, qtr):
+    """
+    Find the CIK that had scores before qtr in the previous run but were dropped by merge_new_scores. Their rows in
+    the quintiles and the portfolios of the earlier qtr are out of date, and since each portfolio is bought with the
+    value of the previous one, so is every qtr after the first one they appear in.
+
+    :param previous_results: dict {cik: (quarterly_results, status code)}, as returned by journal.load_journal
+    :param merged_results: dict {cik: (quarterly_results, status code)}, as returned by merge_new_scores
+    :param qtr: new qtr
+    :return: sorted list of CIK
+    """
+    return sorted(cik for cik, (quarterly_results, _) in previous_results.items()
+                  if any(q < qtr for q in quarterly_results) and merged_results.get(cik, ({}, None))[0] == {})
+
+
+def update_metric_scores(metric_scores, cik_scores, qtr, lookup, stock_data, s):
+    """
+    Add the new qtr to metric_scores and make its quintiles. The other qtr are left untouched.
+
+    :param metric_scores: quintiled metric_scores of the previous run, organized as [m][qtr][bin][cik][section]
+    :param cik_scores: all the scores, including the ones of the new qtr
+    :param qtr: new qtr
+    :param lookup: {cik: ticker}
+    :param stock_data: stock prices
+    :param s: Settings dictionary
+    :return: metric_scores, updated in place
+    """
+    qtr_data = {m: {cik: {} for cik in cik_scores} for m in s['metrics']}
+    for cik in cik_scores:
+        if qtr not in cik_scores[cik]:
+            continue
+        # Same rule as create_metric_scores: a CIK is dropped from the first qtr without a price onward
+        if not all(post_processing.get_share_price(cik, q, lookup, stock_data)[2]
+                   for q in cik_scores[cik] if q <= qtr):
+            continue
+        sections = [section for section in cik_scores[cik][qtr] if section != '0' and section != 'total']
+        for section in sections:
+            for m in s['metrics']:
+                qtr_data[m][cik][section] = cik_scores[cik][qtr][section][m]
+                qtr_data[m][cik]['total'] = cik_scores[cik][qtr]['total'][m]
+    for m in s['metrics']:
+        metric_scores[m][qtr] = post_processing.make_quintiles(qtr_data[m], s)
+    return metric_scores
+
+
+def extend_portfolio(pf_values, metric_scores, qtr, lookup, stock_data, s):
+    """
+    Roll the portfolios of the previous qtr into the new qtr: sell them at the new prices, then buy the new quintiles.
+    Same steps as post_processing.build_portfolio, for a single qtr.
+
+    :param pf_values: pf_values of the previous run
+    :param metric_scores: metric_scores that already contain the new qtr, see update_metric_scores
+    :param qtr: new qtr
+    :param lookup: {cik: ticker}
+    :param stock_data: stock prices
+    :param s: Settings dictionary
+    :return: pf_values, updated in place
+    """
+    previous_qtr = lagged_qtr(qtr, 1)
+    for m in s['metrics']:
+        pf_values[m][qtr] = {
+            'incoming_compo': {},
+            'incoming_value': {l: 0 for l in s['bin_labels']},
+            'new_value': {l: 0 for l in s['bin_labels']},
+            'new_compo': {l: {cik: [] for cik in metric_scores[m][qtr][l]} for l in s['bin_labels']}
+        }
+        for l in s['bin_labels']:
+            incoming = {cik: list(v) for cik, v in pf_values[m][previous_qtr]['new_compo'][l].items()}
+            pf, quintile_funds = post_processing.sell_all_pf(qtr, incoming, lookup, stock_data)
+            pf_values[m][qtr]['incoming_compo'][l] = pf
+            pf_values[m][qtr]['incoming_value'][l] = quintile_funds
+            pf_values[m][qtr]['new_value'][l] = quintile_funds*(1-s['tax_rate'])
+            post_processing.buy_all_pf(qtr, pf_values[m][qtr]['new_value'][l], pf_values[m][qtr]['new_compo'][l],
+                                       lookup, stock_data, s['pf_balancing'])
+    return pf_values
+
+
+def metric_scores_rows(metric_scores, qtr):
+    """
+    Rows of the metric_scores table for the new qtr, without the IDX.
+
+    :param metric_scores: metric_scores
+    :param qtr: new qtr
+    :return: list of [metric, qtr, bin, cik, section, score]
+    """
+    rows = []
+    for m in metric_scores:
+        for l in metric_scores[m][qtr]:
+            for cik in metric_scores[m][qtr][l]:
+                for section, v in metric_scores[m][qtr][l][cik].items():
+                    rows.append([m, qtr, l, cik, section, v])
+    return rows
+
+
+def pf_values_rows(pf_values, qtr):
+    """
+    Rows of the pf_values_compo and pf_values_value tables for the new qtr, without the IDX.
+
+    :param pf_values: pf_values
+    :param qtr: new qtr
+    :return: list of [metric, qtr, stage, bin, cik, *line] and list of [metric, qtr, stage, bin, value]
+    """
+    rows_compo, rows_value = [], []
+    for m in pf_values:
+        for section in ['incoming_compo', 'new_compo']:
+            for l in pf_values[m][qtr][section]:
+                for cik, v in pf_values[m][qtr][section][l].items():
+                    rows_compo.append([m, qtr, section, l, cik, *v])
+        for section in ['incoming_value', 'new_value']:
+            for l in pf_values[m][qtr][section]:
+                rows_value.append([m, qtr, section, l, pf_values[m][qtr][section][l]])
+    return rows_compo, rows_value
@@ -0,0 +1,186 @@
+"""
+Append-only journal of the process_cik results, so that a run that dies hours in can be resumed.
+
+Each result is written as soon as it comes back from the pool: an 8 bytes length followed by the pickled
+(cik, quarterly_results, status code). A crash can only leave an incomplete last record behind, which is dropped when
+the journal is reloaded. There is one journal per settings hash, so results computed with other settings, another
+version of the parser or another master dictionary are never mixed in.
+"""
+
+import os
+import pickle
+import struct
+import hashlib
+from secScraper import parser
+
+
+# Settings that change the content of the results. Paths, number of processes, etc. do not.
+_hashed_settings = ['metrics', 'differentiation_mode', 'lag', 'time_range', 'report_type', 'tokenizer', 'stop_words',
+                    'lemmatize', 'edit_distance_sample', 'minhash_num_perm', 'tf_idf_scope', 'stream_reports',
+                    'sections_to_parse_10k', 'sections_to_parse_10q', 'common_quarterly_sections',
+                    'common_yearly_sections']
+_header = struct.Struct('<Q')
+_file_digests = dict()  # (path, size, mtime) -> digest, so that each file is only read once per process
+
+
+def _file_digest(path):
+    """
+    Digest of the content of a file. The content is used rather than the path and the modification time so that the
+    same file gives the same digest on every machine, ex: for the shards.
+
+    :param path: path to the file
+    :return: str, or None if there is no such file
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_digests:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
+def settings_hash(s):
+    """
+    Fingerprint of what the results depend on: the settings, parser.grammar_version and the master dictionary.
+
+    :param s: Settings dictionary
+    :return: str, 16 hex characters
+    """
+    fingerprint = repr([(key, s.get(key)) for key in _hashed_settings]
+                       + [('grammar_version', parser.grammar_version),
+                          ('master_dictionary', _file_digest(s.get('path_master_dictionary')))])
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+
+def journal_path(s, hashed=None):
+    """
+    Path of the journal for these settings.
+
+    :param s: Settings dictionary
+    :param hashed: (optional) settings hash to use instead of the one of s, ex: coming from a shard manifest
+    :return: str, or None if the journal is disabled
+    """
+    if not s.get('path_journal'):
+        return None
+    return os.path.join(s['path_journal'], 'journal_{}.bin'.format(hashed if hashed else settings_hash(s)))
+
+
+def _records(path):
+    """
+    Read the complete records of a journal file one at a time, without loading the whole file.
+
+    :param path: path to the journal file
+    :return: generator of ((cik, quarterly_results, status code), size in bytes of the records read so far)
+    """
+    valid_size = 0
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_header.size)
+            if len(header) < _header.size:
+                break
+            length = _header.unpack(header)[0]
+            payload = f.read(length)
+            if len(payload) < length:  # Incomplete record, the run died while writing it
+                break
+            valid_size += _header.size + length
+            yield pickle.loads(payload), valid_size
+
+
+def iter_records(path):
+    """
+    Lazily read the complete records of a journal file.
+
+    :param path: path to the journal file
+    :return: generator of (cik, quarterly_results, status code)
+    """
+    for record, _ in _records(path):
+        yield record
+
+
+def load_journal(s):
+    """
+    Reload all the complete records of the journal.
+
+    :param s: Settings dictionary
+    :return: dict {cik: (quarterly_results, status code)} and the size in bytes of the complete records
+    """
+    path = journal_path(s)
+    results = dict()
+    valid_size = 0
+    if path is None or not os.path.isfile(path):
+        return results, valid_size
+    for (cik, quarterly_results, status), valid_size in _records(path):
+        results[cik] = (quarterly_results, status)
+    return results, valid_size
+
+
+def open_journal(s, resume=False):
+    """
+    Open the journal for writing.
+
+    :param s: Settings dictionary
+    :param resume: Keep the records already in the journal. Otherwise the journal starts empty.
+    :return: file object (None if the journal is disabled) and dict {cik: (quarterly_results, status code)} of the
+    records already there
+    """
+    path = journal_path(s)
+    if path is None:
+        return None, dict()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if resume:
+        results, valid_size = load_journal(s)
+        f = open(path, 'ab')
+        f.truncate(valid_size)  # Drop an incomplete last record, if any
+        print("[INFO] Resuming from {}: {:,} CIK already processed".format(path, len(results)))
+    else:
+        results = dict()
+        f = open(path, 'wb')
+    return f, results
+
+
+def append_result(f, value):
+    """
+    Write a process_cik result to the journal and make sure it reached the disk.
+
+    :param f: file object returned by open_journal. Nothing happens if it is None.
+    :param value: (cik, quarterly_results, status code, ...) as returned by process_cik
+    :return: void
+    """
+    if f is None:
+        return
+    payload = pickle.dumps(tuple(value[:3]), protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(_header.pack(len(payload)) + payload)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def write_journal(s, results):
+    """
+    Replace the journal with a given set of results, ex: after merging the scores of an incremental update.
+
+    :param s: Settings dictionary
+    :param results: dict {cik: (quarterly_results, status code)}
+    :return: void
+    """
+    f, _ = open_journal(s)
+    if f is None:
+        return
+    write_records(f, results)
+    f.close()
+
+
+def write_records(f, results):
+    """
+    Append a set of results to a journal file.
+
+    :param f: file object opened in binary mode
+    :param results: dict {cik: (quarterly_results, status code)}
+    :return: void
+    """
+    for cik, (quarterly_results, status) in results.items():
+        append_result(f, (cik, quarterly_results, status))
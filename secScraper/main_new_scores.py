@@ -45,6 +45,7 @@ import argparse
 import psycopg2
 import ast
 import copy
+import gc
 
 # Spark
 # import findspark
@@ -60,14 +61,27 @@ import pyspark
 if display.run_from_ipython():
     nb_processes_requested = mp.cpu_count()  # From IPython, fixed setting
     # nb_processes_requested = 1 # From IPython, fixed setting
+    resume_run = False
+    update_qtr = None
+    shard = None
 else:
     ap = argparse.ArgumentParser()
-    ap.add_argument("-p", "--processes", type=int, default=mp.cpu_count(), help="Number of processes launched to process the reports.")
+    ap.add_argument("-p", "--processes", type=int, default=mp.cpu_count(), help="Number of processes launched to process the reports. 0 runs on Spark.")
+    ap.add_argument("--resume", action="store_true", help="Skip the CIK already in the result journal of a previous run with the same settings.")
+    ap.add_argument("--shard", type=str, default=None, help="Only process the i-th of N cost balanced subsets of the CIK (ex: 2/4), see sharding.py.")
+    ap.add_argument("--update", type=str, default=None, help="Incremental update: only score the filings of this new qtr (ex: 2019Q1), on top of the previous run.")
     args = vars(ap.parse_args())
     nb_processes_requested = args["processes"]
-    if not 1 <= nb_processes_requested <= mp.cpu_count():
-        raise ValueError('[ERROR] Number of processes requested is incorrect.                         \n{} CPUs are available on this machine, please select a number of processes between 1 and {}'
-                         .format(mp.cpu_count()))
+    resume_run = args["resume"]
+    update_qtr = incremental.parse_qtr(args["update"]) if args["update"] else None
+    shard = sharding.parse_shard(args["shard"]) if args["shard"] else None
+    if not 0 <= nb_processes_requested <= mp.cpu_count():
+        raise ValueError('[ERROR] Number of processes requested is incorrect.                         \n{} CPUs are available on this machine, please select a number of processes between 0 (Spark) and {}'
+                         .format(mp.cpu_count(), mp.cpu_count()))
+if nb_processes_requested > 1:
+    # No collection in the parent until the workers are done: each one would touch the object headers and spread
+    # copy-on-write holes across the pages the forked workers share. Enabled again in the workers, see init_worker.
+    gc.disable()
 
 
 # ## Settings dictionary
@@ -79,20 +93,38 @@ home = os.path.expanduser("~")
 _s = {
     'path_stage_1_data': os.path.join(home, 'Desktop/filtered_text_data/nd_data/'),
     'path_stock_database': os.path.join(home, 'Desktop/Insight project/Database/Ticker_stock_price.csv'),
+    'path_stock_cache': os.path.join(home, 'Desktop/Insight project/Database/Ticker_stock_price/'),  # None: parse the csv
     'path_filtered_stock_data': os.path.join(home, 'Desktop/Insight project/Database/filtered_stock_data.csv'),
     'path_stock_indexes': os.path.join(home, 'Desktop/Insight project/Database/Indexes/'),
     'path_filtered_index_data': os.path.join(home, 'Desktop/Insight project/Database/Indexes/filtered_index_data.csv'),
     'path_lookup': os.path.join(home, 'Desktop/Insight project/Database/lookup.csv'),
     'path_filtered_lookup': os.path.join(home, 'Desktop/Insight project/Database/filtered_lookup.csv'),
     'path_master_dictionary': os.path.join(home, 'Desktop/Insight project/Database/LoughranMcDonald_MasterDictionary_2018.csv'),
+    'path_master_dictionary_cache': os.path.join(home, 'Desktop/Insight project/Database/LoughranMcDonald_MasterDictionary_2018/'),
     'path_dump_crsp': os.path.join(home, 'Desktop/Insight project/Database/dump_crsp_merged.txt'),
     'path_output_folder': os.path.join(home, 'Desktop/Insight project/Outputs'),
     'path_dump_cik_scores': os.path.join(home, 'Desktop/Insight project/Outputs/dump_cik_scores.csv'),
     'path_dump_pf_values': os.path.join(home, 'Desktop/Insight project/Outputs/dump_pf_values.csv'),
     'path_dump_master_dict': os.path.join(home, 'Desktop/Insight project/Outputs/dump_master_dict.csv'),
+    'path_sketch_store': os.path.join(home, 'Desktop/Insight project/Outputs/sketches/'),
+    'path_section_index': os.path.join(home, 'Desktop/Insight project/Outputs/section_index/'),
+    'path_journal': os.path.join(home, 'Desktop/Insight project/Outputs/journal/'),
+    'path_partitioned_scores': os.path.join(home, 'Desktop/Insight project/Outputs/partitioned_scores/'),
+    'path_shards': os.path.join(home, 'Desktop/Insight project/Outputs/shards/'),
+    'path_manifest': os.path.join(home, 'Desktop/Insight project/Outputs/manifest.sqlite'),  # None: glob the stage 1 data
     'metrics': ['diff_jaccard', 'diff_sk_cosine_tf_idf', 'diff_gfg_editDistDP'],
+    'parse_mode': 'mmap',  # 'mmap' decodes the sections only when they are compared, 'text' reads the whole file
+    'tokenizer': 'fast',  # 'fast' precompiled regex, 'normal' nltk word_tokenize (slower), 'regex' [\w']+
     'stop_words': False,
     'lemmatize': False,
+    'edit_distance_sample': None,  # Cap on the number of words used by diff_gfg_editDistDP. None: full sections
+    'minhash_num_perm': 128,  # Signature size for diff_minhash_jaccard. Standard error <= 1/(2*sqrt(num_perm))
+    'tf_idf_scope': 'window',  # 'pair' refits TF-IDF for each pair, 'window' fits it once on all the reports of a CIK
+    'pipeline_queue_size': 32,  # Tasks/results waiting between the stages of the pipeline. None: multiprocessing.Pool
+    'worker_max_rss_mb': 4096,  # A pipeline worker above that after a CIK is replaced by a fresh one. None: no limit
+    'worker_max_tasks': None,  # Number of CIK after which a pipeline worker is replaced. None: no limit
+    'manifest_threads': 16,  # Qtr folders scanned at the same time when the manifest is refreshed
+    'stream_reports': False,  # True keeps only lag + 1 parsed reports per worker. The IDF is then fitted per pair
     'differentiation_mode': 'quarterly',
     'pf_balancing': 'unbalanced',
     'time_range': [(2012, 1), (2018, 4)],
@@ -109,6 +141,8 @@ _s = {
 # In[5]:
 
 
+if update_qtr is not None:  # The previous run ended the qtr before
+    _s['time_range'][1] = update_qtr
 _s['pf_init_value'] = 100.0  # In points
 _s['epsilon'] = 0.001  # Rounding error
 # Calculated settings
@@ -187,7 +221,11 @@ postgres.settings_to_postgres(connector, s)
 # In[ ]:
 
 
-lm_dictionary = Load_MasterDictionary.load_masterdictionary(s['path_master_dictionary'], True)
+# Memory mapped binary version of the csv, created on the first run. Workers share the mapping.
+lm_dictionary = Load_MasterDictionary.load_masterdictionary_cache(s['path_master_dictionary'],
+                                                                  s['path_master_dictionary_cache'], True)
+# Token ids and lemmas of the dictionary words are computed once here. The workers inherit them when they are forked.
+tokenization.seed_vocabulary(lm_dictionary.keys(), s['lemmatize'])
 
 
 # ### Find all the unique CIK from the SEC filings
@@ -222,7 +260,7 @@ print("cik_path: {:,} CIK | lookup: {:,} CIK"
 
 
 # Load all stock prices
-stock_data = postgres.retrieve_all_stock_data(connector, 'stock_data')
+stock_data = postgres.retrieve_price_store(connector, 'stock_data')
 
 
 # In[ ]:
@@ -239,7 +277,7 @@ print("lookup: {:,} tickers | stock_data: {:,} tickers"
 # In[ ]:
 
 
-index_data = postgres.retrieve_all_stock_data(connector, 'index_data')
+index_data = postgres.retrieve_price_store(connector, 'index_data')
 print("[INFO] Loaded the following index data:", list(index_data.keys()))
 
 
@@ -267,6 +305,9 @@ print("cik_path: {:,} CIK | lookup: {:,} CIK"
 
 assert cik_path.keys() == lookup.keys()
 assert len(set(lookup.values())) == len(set(stock_data.keys()))
+# Price and market cap of every ticker on the first trading day of every qtr, for all the backtest lookups
+entry_prices = prices.entry_price_matrix(stock_data, lookup.values(), s['list_qtr'])
+print("[INFO] Entry prices found for {:,}/{:,} (ticker, qtr)".format(entry_prices.found.sum(), entry_prices.found.size))
 
 
 # At that point, we have a {CIK: ticker} for which the stock is known, which will enable comparison and all down the road.
@@ -345,25 +386,81 @@ nb_cik_to_process = len(cik_path.keys())
 #cik_path = {k: cik_path[k] for k in cik_path.keys() if k in list(cik_path.keys())[:nb_cik_to_process]}
 cik_path = {k: cik_path[k] for k in cik_path.keys() if k in list(cik_path.keys())}
 
+if update_qtr is not None:
+    # Only the CIK that filed during the new qtr are processed, with the two reports of the new pair
+    previous_results = journal.load_journal(incremental.previous_settings(s))[0]
+    print("[INFO] Incremental update of {}: {:,} CIK scored by the previous run".format(update_qtr, len(previous_results)))
+    reviewed_ciks = list(cik_path)  # The CIK that the review now rejects are removed from the previous results
+    cik_path = incremental.new_filings(cik_path, update_qtr, s)
+if shard is not None:
+    # Every machine computes the same split, each one only keeps its share
+    cik_path = {k: cik_path[k] for k in sharding.shard_ciks(cik_path, s, shard)}
+    print("[INFO] Shard {}/{}: {:,} CIK".format(*shard, len(cik_path)))
 # print(list(cik_path.keys()).index(10456))  # Find BAX
 cik_scores = {k: 0 for k in cik_path.keys()}  # Organized by ticker
-data_to_process = ([k, v, {**s}, lm_dictionary] for k, v in cik_path.items())
+# Longest processing time first: the mega-filers must not be the last ones to start
+cik_order, cik_costs = scheduler.lpt_order(cik_path, s, manifest.file_sizes(s) if s.get('path_manifest') else None)
+# Every result is journaled as it comes back. With --resume, the CIK already journaled are reloaded, not processed
+s_journal = incremental.update_journal_settings(s) if update_qtr is not None else s
+if shard is not None:
+    s_journal = sharding.journal_settings(s_journal, shard)
+journal_file, journaled_results = journal.open_journal(s_journal, resume=resume_run)
+cik_order = [k for k in cik_order if k not in journaled_results]
+nb_cik_to_process = len(cik_order)
+# The settings and lm_dictionary are loaded once per worker by processing.init_worker, tasks only carry their paths
+data_to_process = ((k, cik_path[k]) for k in cik_order)
 assert cik_path.keys() == cik_scores.keys()
 #print(data_to_process)
 #result = process_cik(data_to_process[0])
 #cik_perf[result[0]] = result[1]
 #print(cik_perf)
 #assert 0
-processing_stats = [0, 0, 0, 0, 0, 0]
+processing_stats = [0, 0, 0, 0, 0, 0, 0]  # Last one: CIK that kept killing their workers, see pipeline.killed_code
+for k, (quarterly_results, code) in journaled_results.items():
+    if k not in cik_scores:
+        continue  # Not part of this run
+    if quarterly_results == {}:
+        del cik_scores[k]
+    else:
+        cik_scores[k] = quarterly_results
+    processing_stats[code] += 1
+processing_timings = dict()  # Time spent on each representation and metric, summed over all the CIK
+schedule_records = []  # (cik, pid, start, stop) of each task
+time_start_processing = time.time()
 #qtr_metric_result = {key: [] for key in s['list_qtr']}
-if nb_processes_requested > 1:
-    with mp.Pool(processes=nb_processes_requested) as p:
+if nb_processes_requested > 1 and s.get('pipeline_queue_size'):
+    # Bounded queues from the discovery to the journal: workers pull tasks as they free up, results are journaled on arrival
+    gc.freeze()  # Everything allocated so far moves to the permanent generation, shared with the forked workers
+    print("[INFO] Starting a pipeline of {} workers".format(nb_processes_requested))
+    pipeline_events = pipeline.pipeline_monitor()  # Memory peak of each CIK, recycled and dead workers
+    results_stream = pipeline.run_pipeline(data_to_process, {**s}, lm_dictionary, nb_processes_requested,
+                                           s['pipeline_queue_size'], pipeline_events)
+    with tqdm(total=nb_cik_to_process) as pbar:
+        for i, (value, record) in enumerate(results_stream):
+            pbar.update()
+            schedule_records.append(record)
+            if value[1] == {}:
+                # The parsing failed
+                del cik_scores[value[0]]
+            else:
+                cik_scores[value[0]] = value[1]
+            processing_stats[value[2]] += 1
+            processing.merge_timings(processing_timings, value[3])
+            journal.append_result(journal_file, value)
+    pipeline_events.print_report()
+
+elif nb_processes_requested > 1:
+    # Nothing allocated so far will be collected: the forked workers can share these pages without copying them
+    gc.freeze()
+    with mp.Pool(processes=nb_processes_requested, initializer=processing.init_worker,
+                 initargs=({**s}, lm_dictionary)) as p:
     #with mp.Pool(processes=min(mp.cpu_count(), 1)) as p:
         print("[INFO] Starting a pool of {} workers".format(nb_processes_requested))
 
         with tqdm(total=nb_cik_to_process) as pbar:
-            for i, value in tqdm(enumerate(p.imap_unordered(processing.process_cik, data_to_process))):
+            for i, (value, record) in tqdm(enumerate(p.imap_unordered(scheduler.timed_process_cik, data_to_process))):
                 pbar.update()
+                schedule_records.append(record)
                 #qtr = list_qtr[i]
                 # Each quarter gets a few metrics
                 if value[1] == {}:
@@ -372,13 +469,17 @@ if nb_processes_requested > 1:
                 else:
                     cik_scores[value[0]] = value[1]
                 processing_stats[value[2]] += 1
+                processing.merge_timings(processing_timings, value[3])
+                journal.append_result(journal_file, value)
 
 elif nb_processes_requested == 1:
     print("[INFO] Running on {} core (multiprocessing is off)".format(nb_processes_requested))
+    processing.init_worker({**s}, lm_dictionary)
     # print(list(data_to_process))
     with tqdm(total=nb_cik_to_process) as pbar:
-        for i, value in tqdm(enumerate(map(processing.process_cik, data_to_process))):
+        for i, (value, record) in tqdm(enumerate(map(scheduler.timed_process_cik, data_to_process))):
             pbar.update()
+            schedule_records.append(record)
             #qtr = list_qtr[i]
             # Each quarter gets a few metrics
             if value[1] == {}:
@@ -387,19 +488,23 @@ elif nb_processes_requested == 1:
             else:
                 cik_scores[value[0]] = value[1]
             processing_stats[value[2]] += 1
+            processing.merge_timings(processing_timings, value[3])
+            journal.append_result(journal_file, value)
 
 elif nb_processes_requested == 0:
     # Spark mode!!
     print("[INFO] Running with Spark")
     sc = pyspark.SparkContext(appName="model_calculations")
     print("[INFO] Context started")
-    spark_result = sc.parallelize(data_to_process).map(processing.process_cik)
-    spark_result = spark_result.take(nb_cik_to_process)
+    # Settings and lm_dictionary are broadcast once. The scores are written by the partitions, not collected.
+    spark_summary = distributed.run_spark(sc, {k: cik_path[k] for k in cik_order}, {**s}, lm_dictionary)
     sc.stop()
+    for _, _, timings in spark_summary:
+        processing.merge_timings(processing_timings, timings)
     
-    # Process the result
+    # Process the result, read back one partition file at a time
     with tqdm(total=nb_cik_to_process) as pbar:
-        for i, value in tqdm(enumerate(spark_result)):
+        for i, value in tqdm(enumerate(distributed.iter_results(s))):
             pbar.update()
             #qtr = list_qtr[i]
             # Each quarter gets a few metrics
@@ -409,11 +514,63 @@ elif nb_processes_requested == 0:
             else:
                 cik_scores[value[0]] = value[1]
             processing_stats[value[2]] += 1
+            journal.append_result(journal_file, value)
            
         #qtr_metric_result[value['0']['qtr']] = value
 
+if nb_processes_requested > 1:
+    # The workers are done, post-processing runs with a regular garbage collector
+    gc.unfreeze()
+    gc.enable()
+if journal_file is not None:
+    journal_file.close()
+if update_qtr is not None:
+    # The new pairs are added to the scores of the previous run, which become the journal of this one
+    new_results, _ = journal.load_journal(s_journal)
+    all_results = incremental.merge_new_scores(previous_results, new_results, update_qtr, reviewed_ciks)
+    journal.write_journal(s, all_results)
+    cik_scores = {k: v for k, (v, code) in all_results.items() if v != {}}
+    dropped = incremental.dropped_ciks(previous_results, all_results, update_qtr)
+    if len(dropped):
+        # Their rows are in the quintiles and portfolios of the earlier qtr, and the portfolios are chained from one
+        # qtr to the next: the post-processing of the whole time_range is rebuilt from the merged scores instead
+        print("[WARNING] {:,} CIK scored by the previous run were dropped by the update (ex: {}). "
+              "The quintiles and portfolios of every qtr are rebuilt.".format(len(dropped), dropped[:5]))
+        update_qtr = None
 print("[INFO] {} CIK were successfully processed - {}/{} CIK failed.".format(len(cik_scores), len(cik_path)-len(cik_scores), len(cik_path)))
 print("Detailed stats and error codes:", processing_stats)
+processing.print_timings(processing_timings)
+scheduler.print_schedule_report(schedule_records, max(nb_processes_requested, 1), time_start_processing, time.time())
+if shard is not None:
+    # Post-processing needs all the CIK: it runs after the shards are merged, see sharding.py
+    sharding.write_shard(s['path_shards'], s, shard, list(cik_path), journal.load_journal(s_journal)[0])
+    sys.exit(0)
+
+
+# ## Incremental update: only the new qtr goes through the quintiles, the portfolios and postgres
+# Unless CIK were dropped by the update, see above: then update_qtr is None and the full post-processing runs.
+
+# In[ ]:
+
+
+if update_qtr is not None:
+    s_previous = incremental.previous_settings(s)
+    path_metric_scores, path1, path2 = [os.path.join(s['path_output_folder'], name)
+                                        for name in ['ms.csv', 'pf_values1.csv', 'pf_values2.csv']]
+    metric_scores = postgres.retrieve_ms_values_data(connector, path_metric_scores, s_previous)
+    pf_values = postgres.retrieve_pf_values_data(connector, path1, path2, s_previous)
+    incremental.update_metric_scores(metric_scores, cik_scores, update_qtr, lookup, entry_prices, s)
+    incremental.extend_portfolio(pf_values, metric_scores, update_qtr, lookup, entry_prices, s)
+    post_processing.check_pf_value(pf_values, s)
+
+    postgres.append_cik_scores_to_postgres(connector, cik_scores, update_qtr, s)
+    postgres.append_csv_rows(connector, 'metric_scores', path_metric_scores,
+                             incremental.metric_scores_rows(metric_scores, update_qtr))
+    rows_compo, rows_value = incremental.pf_values_rows(pf_values, update_qtr)
+    postgres.append_csv_rows(connector, 'pf_values_compo', path1, rows_compo)
+    postgres.append_csv_rows(connector, 'pf_values_value', path2, rows_value)
+    print("[INFO] Incremental update of {} done".format(update_qtr))
+    sys.exit(0)
 
 
 # # Post-processing - Welcome to the gettho
@@ -423,7 +580,7 @@ print("Detailed stats and error codes:", processing_stats)
 # In[ ]:
 
 
-metric_scores = post_processing.create_metric_scores(cik_scores, lookup, stock_data, s)
+metric_scores = post_processing.create_metric_scores(cik_scores, lookup, entry_prices, s)
 
 
 # In[ ]:
@@ -478,7 +635,7 @@ for m in s['metrics']:
     for qtr in s['list_qtr'][s['lag']:]:
         for l in s['bin_labels']:
             for cik in metric_scores[m][qtr][l]:
-                _, _, flag_price_found = post_processing.get_share_price(cik, qtr, lookup, stock_data)
+                _, _, flag_price_found = post_processing.get_share_price(cik, qtr, lookup, entry_prices)
                 if not flag_price_found:
                     print("[WARNING] [{}] No stock data for {} during {}".format(m, cik, qtr))
                     pnf.append(cik)
@@ -506,7 +663,7 @@ pf_values = post_processing.initialize_portfolio(metric_scores, s)
 # In[ ]:
 
 
-pf_values = post_processing.build_portfolio(pf_values, lookup, stock_data, s)
+pf_values = post_processing.build_portfolio(pf_values, lookup, entry_prices, s)
 
 
 # In[ ]:
@@ -0,0 +1,177 @@
+"""
+Manifest of the stage 1 filings, kept in an SQLite file so that a run does not have to walk the whole data folder.
+
+The stage 1 data is organized as <path_stage_1_data>/<year>/QTR<n>/<published>_<type>_edgar_data_<cik>_<...>.txt
+The manifest holds one typed row per filing: the fields encoded in its path, and its size. It is refreshed at the
+start of every run: the year and qtr folders are listed, and only the qtr folders whose mtime changed since the last
+refresh are scanned again, several at a time. Adding or removing a filing changes the mtime of its folder, but a file
+rewritten in place does not: delete the manifest to force a full scan.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+
+_schema = [
+    'CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, mtime_ns INTEGER)',
+    'CREATE TABLE IF NOT EXISTS filings (path TEXT PRIMARY KEY, cik INTEGER, year INTEGER, qtr INTEGER, '
+    'published INTEGER, type TEXT, size INTEGER, folder TEXT)',
+    'CREATE INDEX IF NOT EXISTS filings_folder ON filings (folder)',
+    'CREATE INDEX IF NOT EXISTS filings_type ON filings (type, cik)'
+]
+
+
+def filing_fields(path):
+    """
+    Read the fields encoded in the path of a stage 1 file.
+
+    :param path: ex: .../2016/QTR3/20160815_10-Q_edgar_data_1000_0000001000-16-000010.txt
+    :return: cik, year, qtr, published (int, ex: 20160815), type_report
+    """
+    split_path = path.split('/')
+    split_name = split_path[-1].split('_')
+    datetime.strptime(split_name[0], '%Y%m%d')  # Raises on anything that is not a date
+    return int(split_name[4]), int(split_path[-3]), int(split_path[-2][3]), int(split_name[0]), split_name[1]
+
+
+def connect(s):
+    """
+    Open the manifest, creating it if needed.
+
+    :param s: Settings dictionary
+    :return: sqlite3 connection
+    """
+    folder = os.path.dirname(s['path_manifest'])
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(s['path_manifest'])
+    for statement in _schema:
+        connection.execute(statement)
+    return connection
+
+
+def _qtr_folders(root):
+    """
+    List the qtr folders of the stage 1 data and their mtime.
+
+    :param root: s['path_stage_1_data']
+    :return: dict {folder: mtime_ns}
+    """
+    folders = dict()
+    with os.scandir(root) as years:
+        for year in years:
+            if not (year.name.isdigit() and year.is_dir()):
+                continue
+            with os.scandir(year.path) as qtrs:
+                for qtr in qtrs:
+                    if qtr.name.startswith('QTR') and qtr.is_dir():
+                        folders[qtr.path] = qtr.stat().st_mtime_ns
+    return folders
+
+
+def _scan_folder(folder):
+    """
+    Read the filings of a qtr folder. os.scandir releases the GIL, so several folders can be scanned by threads.
+
+    :param folder: path to a qtr folder
+    :return: folder, list of rows of the filings table, number of files that could not be read
+    """
+    rows = []
+    nb_skipped = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not (entry.name.endswith('.txt') and entry.is_file()):
+                continue
+            try:
+                fields = filing_fields(entry.path)
+            except (IndexError, ValueError):
+                nb_skipped += 1
+                continue
+            rows.append((entry.path, *fields, entry.stat().st_size, folder))
+    return folder, rows, nb_skipped
+
+
+def refresh_manifest(s):
+    """
+    Bring the manifest up to date with the stage 1 data. Only the qtr folders that changed are scanned.
+
+    :param s: Settings dictionary
+    :return: void
+    """
+    connection = connect(s)
+    try:
+        known = dict(connection.execute('SELECT folder, mtime_ns FROM folders'))
+        found = _qtr_folders(s['path_stage_1_data'])  # mtime before the scan: a file added meanwhile is seen next time
+        stale = [folder for folder, mtime in found.items() if known.get(folder) != mtime]
+        removed = [folder for folder in known if folder not in found]
+        nb_skipped = 0
+        with ThreadPool(s.get('manifest_threads', 16)) as pool:
+            for folder, rows, skipped in pool.imap_unordered(_scan_folder, stale):
+                connection.execute('DELETE FROM filings WHERE folder = ?', (folder,))
+                connection.executemany('INSERT INTO filings VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                connection.execute('INSERT OR REPLACE INTO folders VALUES (?, ?)', (folder, found[folder]))
+                nb_skipped += skipped
+        for folder in removed:
+            connection.execute('DELETE FROM filings WHERE folder = ?', (folder,))
+            connection.execute('DELETE FROM folders WHERE folder = ?', (folder,))
+        connection.commit()
+        nb_filings = connection.execute('SELECT COUNT(*) FROM filings').fetchone()[0]
+    finally:
+        connection.close()
+    print("[INFO] Manifest refreshed: {}/{} qtr folders scanned, {} removed | {:,} filings"
+          .format(len(stale), len(found), len(removed), nb_filings))
+    if nb_skipped:
+        print("[WARNING] {} files do not follow the stage 1 naming and were ignored".format(nb_skipped))
+
+
+def _query(s, query, parameters=()):
+    connection = connect(s)
+    try:
+        return connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+
+
+def _type_filter(s):
+    return 'type IN ({})'.format(', '.join('?'*len(s['report_type']))), list(s['report_type'])
+
+
+def load_cik_path(s):
+    """
+    Paths of the filings of the considered types, organized by CIK.
+
+    :param s: Settings dictionary
+    :return: dictionary {cik: list of paths}
+    """
+    condition, parameters = _type_filter(s)
+    cik_path = dict()
+    for cik, path in _query(s, 'SELECT cik, path FROM filings WHERE {} ORDER BY cik, path'.format(condition),
+                            parameters):
+        cik_path.setdefault(cik, []).append(path)
+    return cik_path
+
+
+def filing_metadata(s):
+    """
+    Metadata of the filings of the considered types, as used by pre_processing.review_cik_publications.
+
+    :param s: Settings dictionary
+    :return: dictionary {path: (qtr, published date, type_report)}
+    """
+    condition, parameters = _type_filter(s)
+    rows = _query(s, 'SELECT path, year, qtr, published, type FROM filings WHERE {}'.format(condition), parameters)
+    return {path: ((year, qtr), datetime.strptime(str(published), '%Y%m%d').date(), type_report)
+            for path, year, qtr, published, type_report in rows}
+
+
+def file_sizes(s):
+    """
+    Size of the filings of the considered types, so that scheduler.estimate_cost does not stat every file again.
+
+    :param s: Settings dictionary
+    :return: dictionary {path: size in bytes}
+    """
+    condition, parameters = _type_filter(s)
+    return dict(_query(s, 'SELECT path, size FROM filings WHERE {}'.format(condition), parameters))
@@ -1,11 +1,13 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer, TfidfTransformer
 from sklearn.metrics.pairwise import linear_kernel
+import numpy as np
 import difflib
 import re
-import string
 import math
+from collections import Counter
 from tqdm import tqdm
 import nltk
+from secScraper import Load_MasterDictionary
 
 
 # tokenize = lambda string_of_text: string_of_text.lower().split(" ")
@@ -30,8 +32,17 @@ def diff_jaccard(str1, str2):
     """
     assert type(str1) == list and type(str2) == list
     assert type(str1[0]) == str and type(str2[0]) == str
-    a = set(str1) 
-    b = set(str2)
+    return set_jaccard(set(str1), set(str2))
+
+
+def set_jaccard(a, b):
+    """
+    Calculates the Jaccard similarity between two sets of tokens. Lets the caller build each set once and reuse it.
+
+    :param a: First set.
+    :param b: Second set.
+    :return: float in the [0, 1] interval
+    """
     c = a.intersection(b)
     return float(len(c)) / (len(a) + len(b) - len(c))
 
@@ -53,6 +64,78 @@ def diff_sk_cosine_tf_idf(str1, str2, stop_words):
     cosine_similarity = linear_kernel(x.reshape(1, -1), y.reshape(1, -1))  # Only works with norm='l2'
     return cosine_similarity[0][0]
 
+def sk_count_matrix(corpus, stop_words):
+    """
+    Build the term count matrix of a whole corpus of sections in one pass. The vocabulary is fitted once and shared by
+    all the rows, so each section is tokenized only once no matter how many pairs it is part of.
+
+    :param corpus: list of strings, one per section
+    :param stop_words: stop words to remove (list) or None
+    :return: sparse csr matrix, one row per section
+    """
+    sklearn_count = CountVectorizer(stop_words=stop_words)
+    return sklearn_count.fit_transform(corpus).tocsr()
+
+
+def sk_weight_matrix(counts, use_idf):
+    """
+    Turn a term count matrix into l2 normalized TF or TF-IDF rows. The IDF is fitted on the whole corpus.
+
+    :param counts: sparse matrix returned by sk_count_matrix
+    :param use_idf: Activate TF-IDF
+    :return: sparse csr matrix, one l2 normalized row per section
+    """
+    sklearn_weights = TfidfTransformer(norm='l2', use_idf=use_idf)
+    return sklearn_weights.fit_transform(counts).tocsr()
+
+
+def batch_sk_cosine(matrix, idx_current, idx_previous):
+    """
+    Calculates the cosine similarity of many (current, previous) pairs of rows at once. The rows are l2 normalized so
+    the cosine boils down to a row-wise dot product, done on the sparse representation.
+
+    :param matrix: sparse csr matrix returned by sk_weight_matrix
+    :param idx_current: list of row indexes for the current sections
+    :param idx_previous: list of row indexes for the previous sections, same length as idx_current
+    :return: numpy array of floats in the [0, 1] interval
+    """
+    assert len(idx_current) == len(idx_previous)
+    x = matrix[idx_current]
+    y = matrix[idx_previous]
+    return np.asarray(x.multiply(y).sum(axis=1)).ravel()
+
+
+def sk_analyzer(stop_words):
+    """
+    Tokenizer used by the sklearn vectorizers, lower case and stop words included. Counting its output gives the same
+    terms as the TF and TF-IDF metrics.
+
+    :param stop_words: stop words to remove (list) or None
+    :return: function str -> list of str
+    """
+    return CountVectorizer(stop_words=stop_words).build_analyzer()
+
+
+def counts_cosine(counts1, counts2, use_idf):
+    """
+    Calculates the Cosine TF or TF-IDF similarity of two sections from their term counts. The IDF is fitted on the pair
+    like diff_sk_cosine_tf_idf does: with smoothing, a term found in both sections weighs 1 and a term found in a
+    single one weighs 1 + ln(3/2). Only the shared terms contribute to the dot product.
+
+    :param counts1: Counter of the terms of the first section, see sk_analyzer
+    :param counts2: Counter of the terms of the second section
+    :param use_idf: Activate TF-IDF
+    :return: float in the [0, 1] interval
+    """
+    idf_single = math.log(3/2) + 1 if use_idf else 1
+    dot = sum(counts1[term]*counts2[term] for term in counts1.keys() & counts2.keys())
+    norm1 = math.sqrt(sum((c if term in counts2 else c*idf_single)**2 for term, c in counts1.items()))
+    norm2 = math.sqrt(sum((c if term in counts1 else c*idf_single)**2 for term, c in counts2.items()))
+    if norm1 == 0 or norm2 == 0:
+        return 0.
+    return dot/(norm1*norm2)
+
+
 def diff_cosine_tf(str1, str2):
     """
     Calculates the Cosine TF similarity between two strings.
@@ -101,46 +184,100 @@ def diff_minEdit(str1, str2):
     return similarity
 
 
+def encode_tokens(*token_lists):
+    """
+    Encode lists of tokens as lists of integers, using a vocabulary shared by all of them. Comparing integers is much
+    cheaper than comparing strings in the edit distance engine.
+
+    :param token_lists: lists of str
+    :return: list of lists of int, in the same order as the inputs
+    """
+    vocabulary = dict()
+    return [[vocabulary.setdefault(token, len(vocabulary)) for token in tokens] for tokens in token_lists]
+
+
+def edit_distance_ids(ids1, ids2, max_distance=None):
+    """
+    Word level Levenshtein distance between two sequences of integer token ids, using the bit-parallel algorithm of
+    Myers as formulated by Hyyro. Each column of the DP table is packed in a python int used as a bit vector, so the
+    time is O(n * m/64) machine operations and the memory is linear in the length of the sections.
+    Common prefixes and suffixes are stripped first - consecutive filings tend to share a lot of them.
+
+    :param ids1: First sequence of int
+    :param ids2: Second sequence of int
+    :param max_distance: (optional) early exit threshold. If the distance is guaranteed to be larger, stop and return
+    a lower bound that is itself larger than max_distance.
+    :return: int, number of insertions, deletions and substitutions to go from ids1 to ids2
+    """
+    # 1. Strip the common prefix and suffix
+    start = 0
+    stop1, stop2 = len(ids1), len(ids2)
+    while start < stop1 and start < stop2 and ids1[start] == ids2[start]:
+        start += 1
+    while stop1 > start and stop2 > start and ids1[stop1-1] == ids2[stop2-1]:
+        stop1 -= 1
+        stop2 -= 1
+    pattern, text = ids1[start:stop1], ids2[start:stop2]
+    if len(pattern) > len(text):  # Keep the bit vectors as short as possible
+        pattern, text = text, pattern
+    m, n = len(pattern), len(text)
+    if m == 0:
+        return n
+
+    # 2. Bit mask of the positions of each token in the pattern
+    peq = dict()
+    for idx, token in enumerate(pattern):
+        peq[token] = peq.get(token, 0) | (1 << idx)
+
+    # 3. Bit-parallel pass over the text, one column at a time
+    all_ones = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    pv = all_ones  # Positive vertical deltas
+    mv = 0  # Negative vertical deltas
+    score = m
+    for j, token in enumerate(text):
+        eq = peq.get(token, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & all_ones)
+        mh = pv & xh
+        if ph & last_bit:
+            score += 1
+        elif mh & last_bit:
+            score -= 1
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return score - (n - j - 1)  # Lower bound, already above the threshold
+        ph = ((ph << 1) | 1) & all_ones
+        mh = (mh << 1) & all_ones
+        pv = mh | (~(xv | ph) & all_ones)
+        mv = ph & xv
+    return score
+
+
 def diff_gfg_editDistDP(str1, str2):
-    # WARNING: O(m x n) complexity in RAM & time (if enough RAM...)
-    # str1 = tokenize(str1)
-    # str2 = tokenize(str2)
+    """
+    Calculates the edit distance similarity between two lists of tokens. This is word based. The tokens are encoded
+    as integers and handed to the bit-parallel engine, which gives the same result as the textbook O(m x n) DP table
+    but runs on full sections.
+
+    :param str1: First list of tokens.
+    :param str2: Second list of tokens.
+    :return: float in the [0, 1] interval
+    """
     assert type(str1) == list and type(str2) == list
     assert type(str1[0]) == str and type(str2[0]) == str
-    
-    m = len(str1)
-    n = len(str2)
-    # Create a table to store results of subproblems 
-    dp = [[0 for x in range(n+1)] for x in range(m+1)]
-  
-    # Fill d[][] in bottom up manner 
-    for i in range(m+1): 
-        for j in range(n+1): 
-  
-            # If first string is empty, only option is to 
-            # insert all characters of second string 
-            if i == 0: 
-                dp[i][j] = j    # Min. operations = j 
-  
-            # If second string is empty, only option is to 
-            # remove all characters of second string 
-            elif j == 0: 
-                dp[i][j] = i    # Min. operations = i 
-  
-            # If last characters are same, ignore last char 
-            # and recur for remaining string 
-            elif str1[i-1] == str2[j-1]: 
-                dp[i][j] = dp[i-1][j-1] 
-  
-            # If last character are different, consider all 
-            # possibilities and find minimum 
-            else: 
-                dp[i][j] = 1 + min(dp[i][j-1],        # Insert 
-                                   dp[i-1][j],        # Remove 
-                                   dp[i-1][j-1])    # Replace 
-  
-    # return dp[m][n]
-    return 1 - dp[m][n]/(m+n)
+    return diff_edit_distance_ids(*encode_tokens(str1, str2))
+
+
+def diff_edit_distance_ids(ids1, ids2):
+    """
+    Calculates the edit distance similarity between two sequences of token ids that share the same vocabulary.
+
+    :param ids1: First sequence of int
+    :param ids2: Second sequence of int
+    :return: float in the [0, 1] interval
+    """
+    return 1 - edit_distance_ids(ids1, ids2)/(len(ids1) + len(ids2))
 
 
 def diff_simple(str1, str2):
@@ -164,6 +301,42 @@ def diff_edit_distance(str1, str2):
     return nltk.edit_distance(str1, str2)/(len(str1)+len(str2))
 
 
+# sing_* metrics derived from the Loughran-McDonald categories: index of the corresponding % in the output data
+sentiment_metrics = {
+    'sing_positive': 3,
+    'sing_negative': 4,
+    'sing_uncertainty': 5,
+    'sing_litigious': 6,
+    'sing_modal_weak': 7,
+    'sing_modal_moderate': 8,
+    'sing_modal_strong': 9,
+    'sing_constraining': 10
+}
+_token_pattern = re.compile(r'\w+')  # Note that \w+ splits hyphenated words
+# Numbers as counted by Loughran and McDonald: runs of digits, where '.' and ',' followed by a digit are glued to the
+# run, that are not attached to any letter. Equivalent to their drop punctuation + regex passes, in a single pass.
+_number_pattern = re.compile(r'(?<![^\W_])(?:(?<![^\W_][.,])|(?![0-9]))\d(?:\d|[.,](?=[0-9]))*(?![^\W_]|[.,][0-9])')
+_sentiment_tables = dict()  # Cache of the SentimentTable built for each lm_dictionary
+
+
+def sentiment_table(lm_dictionary):
+    """
+    Get the array based version of a sentiment dictionary. It is built once per dictionary then cached.
+
+    :param lm_dictionary: Sentiment dictionary: a dict of MasterDictionary, a MasterDictionaryCache or already a
+    SentimentTable
+    :return: SentimentTable
+    """
+    if isinstance(lm_dictionary, Load_MasterDictionary.SentimentTable):
+        return lm_dictionary
+    if isinstance(lm_dictionary, Load_MasterDictionary.MasterDictionaryCache):
+        return lm_dictionary.sentiment_table
+    key = id(lm_dictionary)
+    if key not in _sentiment_tables:  # Keep a reference to the dict so that its id cannot be reused
+        _sentiment_tables[key] = (lm_dictionary, Load_MasterDictionary.SentimentTable.from_master_dictionary(lm_dictionary))
+    return _sentiment_tables[key][1]
+
+
 def composite_index(data):
     """
     Create a composite index based on the sentiment analysis based on Loughran and McDonald's
@@ -186,70 +359,77 @@ def composite_index(data):
     return result
 
 
-def sing_sentiment(text, lm_dictionary):
+def sentiment_scores(text, lm_dictionary):
     """
-    Run the Loughran and McDonald's sentiment analysis on a string.
+    Run the Loughran and McDonald's sentiment analysis on a string and derive all the sing_* metrics from that single
+    scan: the composite index and the proportion of words in each category.
 
     :param text: String to analyze.
     :param lm_dictionary: Sentiment dictionary
-    :return: Quite a few fields.
+    :return: dict {metric: score}
     """
-
     text_len = len(text)
     text = re.sub('(May|MAY)', ' ', text)  # drop all May month references ## lol
     text = text.upper()  # for this parse caps aren't informative so shift
     output_data = _get_data(text, lm_dictionary)
     output_data[0] = type(text)
     output_data[1] = text_len
-    result = composite_index(output_data)
 
-    return result
+    scores = {m: output_data[idx]/100 for m, idx in sentiment_metrics.items()}  # Back from % to [0, 1]
+    scores['sing_LoughranMcDonald'] = composite_index(output_data)
+    return scores
+
+
+def sing_sentiment(text, lm_dictionary):
+    """
+    Run the Loughran and McDonald's sentiment analysis on a string.
+
+    :param text: String to analyze.
+    :param lm_dictionary: Sentiment dictionary
+    :return: Quite a few fields.
+    """
+    return sentiment_scores(text, lm_dictionary)['sing_LoughranMcDonald']
 
 
 def _get_data(text, lm_dictionary):
     """
     Internal function to load the data and process it - comes from Loughran and McDonald's work with light
-    modifications to incorporate it in my script.
+    modifications to incorporate it in my script. The unique tokens are mapped to integer ids once and all the counts
+    are aggregated over these ids with numpy, instead of looking up each attribute of each token.
 
     :param text: string to analyze
     :param lm_dictionary: Sentiment dictionary
     :return:
     """
-    vdictionary = {}
+    table = sentiment_table(lm_dictionary)
     _odata = [0] * 17
-    total_syllables = 0
-    word_length = 0
-
-    tokens = re.findall(r'\w+', text)  # Note that \w+ splits hyphenated words
-    for token in tokens:
-        if not token.isdigit() and len(token) > 1 and token in lm_dictionary:
-            _odata[2] += 1  # word count
-            word_length += len(token)
-            if token not in vdictionary:
-                vdictionary[token] = 1
-            if lm_dictionary[token].positive: _odata[3] += 1
-            if lm_dictionary[token].negative: _odata[4] += 1
-            if lm_dictionary[token].uncertainty: _odata[5] += 1
-            if lm_dictionary[token].litigious: _odata[6] += 1
-            if lm_dictionary[token].weak_modal: _odata[7] += 1
-            if lm_dictionary[token].moderate_modal: _odata[8] += 1
-            if lm_dictionary[token].strong_modal: _odata[9] += 1
-            if lm_dictionary[token].constraining: _odata[10] += 1
-            total_syllables += lm_dictionary[token].syllables
-
-    _odata[11] = len(re.findall('[A-Z]', text))
-    _odata[12] = len(re.findall('[0-9]', text))
-    # drop punctuation within numbers for number count
-    text = re.sub(r'(?!=[0-9])(\.|,)(?=[0-9])', '', text)
-    text = text.translate(str.maketrans(string.punctuation, " " * len(string.punctuation)))
-    _odata[13] = len(re.findall(r'\b[-+\(]?[$€£]?[-+(]?\d+\)?\b', text))
-    _odata[14] = total_syllables / _odata[2]
-    _odata[15] = word_length / _odata[2]
-    _odata[16] = len(vdictionary)
-
-    # Convert counts to %
-    for i in range(3, 10 + 1):
-        _odata[i] = (_odata[i] / _odata[2]) * 100
-    # Vocabulary
+
+    # 1. Count the unique tokens then map them to their id in the table, -1 when they are not in it
+    token_counts = Counter(_token_pattern.findall(text))
+    ids = table.lookup(list(token_counts))
+    counts = np.fromiter(token_counts.values(), dtype=np.int64, count=len(token_counts))
+    unique_ids, counts = ids[ids >= 0], counts[ids >= 0]
+
+    # 2. Aggregate all the word level fields over the unique words
+    flags = table.flags[unique_ids]
+    _odata[2] = int(counts.sum())  # word count
+    for bit in range(len(Load_MasterDictionary._table_categories)):
+        _odata[3 + bit] = int(counts[(flags >> bit) & 1 == 1].sum())
+    total_syllables = int(np.dot(counts, table.syllables[unique_ids].astype(np.int64)))
+    word_length = int(np.dot(counts, table.lengths[unique_ids].astype(np.int64)))
+    _odata[16] = len(unique_ids)  # Vocabulary
+
+    # 3. Character classes come from a single histogram of the bytes
+    histogram = np.bincount(np.frombuffer(text.encode(), dtype=np.uint8), minlength=256)
+    _odata[11] = int(histogram[ord('A'):ord('Z')+1].sum())
+    _odata[12] = int(histogram[ord('0'):ord('9')+1].sum())
+    _odata[13] = len(_number_pattern.findall(text))
+
+    if _odata[2]:  # Nothing to average if no word of the dictionary was found
+        _odata[14] = total_syllables / _odata[2]
+        _odata[15] = word_length / _odata[2]
+        # Convert counts to %
+        for i in range(3, 10 + 1):
+            _odata[i] = (_odata[i] / _odata[2]) * 100
 
     return _odata
@@ -1,6 +1,143 @@
+import os
 import re
-import numpy as np
+import json
+import time
 import copy
+import mmap
+
+
+# Grammar of each report type: titles of the sections, in the order they appear in the report, and how the item
+# number shows up in the text.
+grammars = {
+    '10-Q': {
+        'titles': {
+            '_i_1': 'financial statements',
+            '_i_2': 'management s discussion and analysis of financial condition and results of operations',
+            '_i_3': 'quantitative and qualitative disclosures about market risk',
+            '_i_4': 'controls and procedures',
+            'ii_1': 'legal proceedings',
+            'ii_1a': 'risk factors',
+            'ii_2': 'unregistered sales of equity securities and use of proceeds',
+            'ii_3': 'defaults upon senior securities',
+            'ii_4': 'mine safety disclosures',
+            'ii_5': 'other information',
+            'ii_6': 'exhibits'
+        },
+        'item': lambda section: section[3:],  # Item numbers restart in part II
+        'sections_to_parse': 'sections_to_parse_10q',
+        'drop_stale_stops': True
+    },
+    '10-K': {
+        'titles': {
+            '1': 'business',
+            '1a': 'risk factors',
+            '1b': 'unresolved staff comments',
+            '2': 'properties',
+            '3': 'legal proceedings',
+            '4': 'submission of matters to a vote of security holders',
+            '5': 'market for registrant s common equity, related stockholder matters and issuer purchases of equity securities',
+            '6': 'selected financial data',
+            '7': 'management s discussion and analysis of financial condition and results of operations',
+            '7a': 'quantitative and qualitative disclosures about market risk',
+            '8': 'financial statements and supplementary data',
+            '9': 'changes in and disagreements with accountants on accounting and financial disclosure',
+            '9a': 'controls and procedures',
+            '9b': 'other information',
+            '10': 'directors executive officers and corporate governance',
+            '11': 'executive compensation',
+            '12': 'security ownership of certain beneficial owners and management and related stockholder matters',
+            '13': 'certain relationships and related transactions, and director independence',
+            '14': 'principal account(ant|ing) fees and services',
+            '15': 'exhibits financial statement schedules'
+        },
+        'item': lambda section: section,
+        'sections_to_parse': 'sections_to_parse_10k',
+        'drop_stale_stops': False
+    }
+}
+grammar_version = 1  # Increase when the grammars or the parsing rules change, to invalidate the section indexes
+_compiled_grammars = dict()  # Report type -> (compiled regex, {group name: section}). Filled once per process.
+
+
+def grammar_pattern(report_type, binary=False):
+    """
+    Compile the regex matching all the section titles of a report type: the shared 'item' prefix followed by a single
+    alternation with one named group per section. Compiled on the first call, then reused for all the reports parsed
+    by the process.
+
+    :param report_type: '10-K' or '10-Q'
+    :param binary: Compile a case insensitive bytes regex, to be used on memory mapped reports. Otherwise the regex
+    expects lower case str.
+    :return: compiled regex and dictionary {group name: section}
+    """
+    if (report_type, binary) not in _compiled_grammars:
+        grammar = grammars[report_type]
+        # Need to parse all potential sections in case they are present.
+        # Memory mapped reports keep their \r\n and \r, that reading the file in text mode turns into \n.
+        newline = r'(?:\r\n|[\n\r])' if binary else r'[\n\r]'
+        blank = r'[ \r\n]' if binary else r'[ \n]'
+        prefix = r'(?:{} ?| {{2,}})item '.format(newline)  # Is {3,} better? Shared by all the titles, tried once
+        suffix = r'(?![a-z0-9\[\]\(\)])[\.\- ]{}*'.format(blank)
+        pattern = []
+        group_names = dict()
+        for idx, section in enumerate(grammar['titles']):
+            # Because the item numbers are not unique, we NEED to include at least one word of the title
+            group_names['s{}'.format(idx)] = section  # Section names are not all valid group names
+            pattern.append(r'(?P<s{}>{}{}{})'.format(idx, grammar['item'](section), suffix,
+                                                     grammar['titles'][section].split()[0]))
+        pattern = r'{}(?:{})'.format(prefix, r'|'.join(pattern))
+        pattern = re.compile(pattern.encode(), re.IGNORECASE) if binary else re.compile(pattern)
+        _compiled_grammars[(report_type, binary)] = (pattern, group_names)
+    return _compiled_grammars[(report_type, binary)]
+
+
+def map_file(path):
+    """
+    Memory map a stage 1 report, read only. Nothing is read until the pages are accessed.
+
+    :param path: path to the file
+    :return: mmap object, or empty bytes for an empty file (they cannot be mapped)
+    """
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # Stays valid once the file is closed
+        except ValueError:
+            return b''
+
+
+class section_view():
+    """
+    Lazy view over a section of a memory mapped report. The text is only decoded when section_text is called, and is
+    not kept: the view itself only holds the mapping and two offsets.
+    """
+    __slots__ = ('buffer', 'start', 'stop')
+
+    def __init__(self, buffer, start, stop):
+        self.buffer = buffer
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def text(self):
+        """
+        Materialize the section, in lower case and with universal newlines like the text parsed in memory.
+
+        :return: str
+        """
+        text = self.buffer[self.start:self.stop].decode(errors='ignore')
+        return text.replace('\r\n', '\n').replace('\r', '\n').lower()
+
+
+def section_text(section):
+    """
+    Text of a section of a parsed report, whichever way it was parsed.
+
+    :param section: str or section_view
+    :return: str
+    """
+    return section.text() if isinstance(section, section_view) else section
 
 
 class stage_2_parser():
@@ -10,356 +147,141 @@ class stage_2_parser():
     
     def __init__(self, s):
         self.s = s
+        self.timings = dict()  # Report type -> [nb documents, seconds]
+        self.last_parse_time = 0  # Seconds spent on the last document
+        self.last_spans = dict()  # Section -> (start, stop) offsets of the text extracted from the last document
+        self.last_toc = False  # Was a table of content found and removed in the last document
     
     def parse(self, parsed_report, verbose=False):
         """
         Parse the text in a report. The text of each section will be placed in a different dict key.
+        If the input is a memory mapped file, the sections are section_view objects rather than str: only their
+        offsets are kept and section_text decodes them when needed.
+        The time spent on the document is kept in last_parse_time and accumulated in timings.
 
-        :param parsed_report: the text, as a giant str
+        :param parsed_report: the text, as a giant str, or the mmap returned by map_file
         :param verbose: Increase the amount of printing to the terminal
         :return: dict containing the parsed report with all the text by section. Metadata is in '0'
         """
-
+        start_time = time.perf_counter()
+        self.last_spans = dict()
+        self.last_toc = False
+        report_type = parsed_report['0']['type']
+        if report_type not in grammars:
+            raise ValueError('[ERROR] No stage 2 parser for report type {}!'.format(report_type))
+        grammar = grammars[report_type]
         text = parsed_report['input']
-        text = text.lower()
-        finds = []
-        if parsed_report['0']['type'] == '10-Q':
+        binary = not isinstance(text, str)  # Memory mapped report, see map_file
+        pattern, group_names = grammar_pattern(report_type, binary)
+        if not binary:
+            text = text.lower()
+        all_sections = list(grammar['titles'].keys())
+
+        # 1. Apply the regex, single left to right pass. The named group gives the section.
+        res = {section: [] for section in all_sections}  # Will contain all the parsed data
+        for m in pattern.finditer(text):  # All the magic happens here!
+            res[group_names[m.lastgroup]].append(m.span())
         
-            # 1. Setup the giant regex to use to parse all potential sections in the report
-            # 1.1. List of all possible titles
-            titles = {
-                '_i_1': 'financial statements',
-                '_i_2': 'management s discussion and analysis of financial condition and results of operations',
-                '_i_3': 'quantitative and qualitative disclosures about market risk',
-                '_i_4': 'controls and procedures',
-                'ii_1': 'legal proceedings',
-                'ii_1a': 'risk factors',
-                'ii_2': 'unregistered sales of equity securities and use of proceeds',
-                'ii_3': 'defaults upon senior securities',
-                'ii_4': 'mine safety disclosures',
-                'ii_5': 'other information',
-                'ii_6': 'exhibits'
-            }
-            all_sections_10q = list(titles.keys())
-
-            # 1.2. Create the regex
-            pattern = []
-            for key in titles:
-                # Need to parse all potential sections in case they are present.
-                prefix = r'([\n\r] ?| {2,})'  # Is {3,} better?
-                suffix = r'(?![a-z0-9\[\]\(\)])[\.\- ][ \n]*'
-                # Because the item numbers are not unique, we NEED to include at least one word of the title
-                regex = r'{}item {}{}{}'.format(prefix, key[3:], suffix, titles[key].split()[0])
-                # print(regex)
-                pattern.append(regex)
-            pattern = r'|'.join(pattern)
-            pattern = re.compile(pattern)
-
-            # 1.3. Apply the regex, single left to right pass
-            res = {section: [] for section in titles}  # Will contain all the parsed data
-            for m in re.finditer(pattern, text):  # All the magic happens here!
-                last_word = re.findall(r'\w+$', m.group())  # Used to backcalculate the section.
-
-                # Sanity checks
-                if len(last_word) > 1:
-                    print(last_word)
-                    raise ValueError('[ERROR] There should not be more than one set of numbers in the matched title.')
-                elif len(last_word) == 0:
-                    print(last_word)
-                    raise ValueError('[ERROR] This match could not be allocated')
-                
-                # Find the corresponding section
-                corresponding_section = 0
-                for k, v in titles.items():
-                    if v.split()[0] == last_word[0]:
-                        corresponding_section = k
-                        break
-                if corresponding_section == 0:
-                    print(last_word)
-                    raise ValueError("[ERROR] Could not find where |{}| goes".format(last_word[0]))
-                else:
-                    res[corresponding_section].append(m.span())
-            
-            # II. Now we get serious. Purge the ToC of it exists
-            # verbose=True
-            # print(res)
-            if verbose:
-                print("[INFO] Before removing the toc:", res)
-            original_res = copy.deepcopy(res)
-            res = {k: v for k, v in res.items() if len(v)}
-            # print(list(res.keys()))
-            # Extract the Table of Content, if any
-            # The gist is that if it exists, all the populated keys should follow each other in order
-            # print(all_sections_10q)
-            # Remove the sections that are empty so we can iterate over non-zero sections
-
-            # Hypothesis: 1a is not optional - financial statements should not be
-            # if I.1. has two entries and the second is after the 1st last entry -> toc!
-            # then rm all [0] entries, then re-delete all zero entries
-            # else no toc and do nothing
-            full_sect = list(res.keys())
-            
-            # Make sure you got something. If that is not the case, might just be a completely different template.
-            try:
-                assert len(full_sect)
-            except:
-                print("[ERROR] Here is full_sect: |{}|".format(full_sect))
-                print("[ERROR] Original res:", original_res)
-                raise
-            
-            if len(res[full_sect[0]]) >= 2:
-                if res[full_sect[-1]][0][1] < res[full_sect[0]][1][0]:
-                    # There is a toc!
-                    # print("[INFO] Found a ToC!")
-                    for v in res.values():
-                        del v[0]  # Remove all first sections
-                    res = {k: v for k, v in res.items() if len(v)}
-            else:
-                # print("[INFO] No ToC found")
-                pass
-            
-            # Extra step: make sure the first elements go in increasing order.
-            try:
-                res = clean_first_markers(res)
-            except Exception as e:
-                print('[ERROR] {} in parser.clean_first_markers (10-Q)'.format(e))
-                print("This is the res\n", res)
-                raise
-            
-            if verbose:
-                print("[INFO] After removing the toc:", res)
-
-            finds = [len(value) for value in res.values()]
-
-            # Shrink the list of sections to review
-            all_sections_10q = [k for k in all_sections_10q if k in res.keys()]
-            
-            # Extract the text for all the sections that we identified
-            previous_start = 0
-            for idx in range(len(all_sections_10q)-1):
-                if all_sections_10q[idx] in self.s['sections_to_parse_10q']:  # Did we request to parse this section?
-                    start = 0  # used for the data extraction
-                    stop = 0
-                    for span in res[all_sections_10q[idx]]:  # Go through all the titles found, in order
-                        if span[1] > previous_start:  # found a starting point
-                            start = span[1]
-                            for span_next in res[all_sections_10q[idx+1]]:  # Same
-                                if span_next[0] > start:
-                                    stop = span_next[0]
-                                    break  # Found a stopping point
-                                else:
-                                    del res[all_sections_10q[idx+1]][idx]
-                            break  # Found a starting point but not nessarily a stopping point!
-                            
-                    if start and stop:  # 
-                        assert stop > start
-                        parsed_report[all_sections_10q[idx]] = text[start:stop]
-                    else:
-                        raise ValueError('This start {} and stop {} combination is invalid for 10-Q section {}'
-                                         .format(start, stop, all_sections_10q[idx]))
-                    previous_start = stop
-            
-            # Backward pass: if there are some sections that were expected and did not get populated
-            # we populate them with a small statement.
-            for section in self.s['sections_to_parse_10q']:
-                try:
-                    assert len(parsed_report[section]) > 0
-                except KeyError:
-                    # print("[WARNING] Section {} was found to be empty.".format(section))
-                    parsed_report[section] = "Nothing found for this section."
-                except AssertionError:
-                    raise AssertionError("[ERROR] Why is that section filled with an empty text?")
-                except:
-                    raise
-            
-            # Delete the input we used and return the result
-            del parsed_report['input']
-            
-            # DEBUG
-            if 0:
-                with open('/home/alex/test_10-q_{}.txt'.format(np.random.randint(1000)), 'w') as f:
-                    for section in parsed_report.keys():
-                        if section != '0':
-                            f.write(section+'\n')
-                            f.write(parsed_report[section])
-                            f.write('\n================================================================\n')
-                            f.write('\n==========================NEW SECTION===========================\n')
-                            f.write('\n================================================================\n')
-                
-                    res = re.findall(regex, text)
-                    finds.append(len(res))
-            # print(finds)
-        elif parsed_report['0']['type'] == '10-K':
-            # 1. Setup the giant regex to use to parse all potential sections in the report
-            # 1.1. List of all possible titles
-            titles = {
-                '1': 'business',
-                '1a': 'risk factors',
-                '1b': 'unresolved staff comments',
-                '2': 'properties',
-                '3': 'legal proceedings',
-                '4': 'submission of matters to a vote of security holders',
-                '5': 'market for registrant s common equity, related stockholder matters and issuer purchases of equity securities',
-                '6': 'selected financial data',
-                '7': 'management s discussion and analysis of financial condition and results of operations',
-                '7a': 'quantitative and qualitative disclosures about market risk',
-                '8': 'financial statements and supplementary data',
-                '9': 'changes in and disagreements with accountants on accounting and financial disclosure',
-                '9a': 'controls and procedures',
-                '9b': 'other information',
-                '10': 'directors executive officers and corporate governance',
-                '11': 'executive compensation',
-                '12': 'security ownership of certain beneficial owners and management and related stockholder matters',
-                '13': 'certain relationships and related transactions, and director independence',
-                '14': 'principal account(ant|ing) fees and services',
-                '15': 'exhibits financial statement schedules'
-                     }
-            all_sections_10k = list(titles.keys())
-
-            # 1.2. Create the regex
-            pattern = []
-            for key in titles:
-                prefix = r'([\n\r] ?| {2,})'  # Is {3,} better?
-                suffix = r'(?![a-z0-9\[\]\(\)])[\.\- ][ \n]*'
-                regex = r'{}item {}{}{}'.format(prefix, key, suffix, titles[key].split()[0])
-                pattern.append(regex)
-            pattern = r'|'.join(pattern)
-            pattern = re.compile(pattern)
-
-            # 1.3. Apply the regex, single left to right pass
-            res = {section: [] for section in titles}
-            for m in re.finditer(pattern, text):  # All the magic happens here!
-                # section_number_found = re.findall(sections_pattern_10k, m.group())
-                last_word = re.findall(r'\w+$', m.group())  # Used to backcalculate the section.
-                
-                # Sanity checks
-                if len(last_word) > 1:
-                    print(last_word)
-                    raise ValueError('[ERROR] There should not be more than one set of numbers in the matched title.')
-                elif len(last_word) == 0:
-                    print(m.group())
-                    raise ValueError('[ERROR] This match: |{}| could not be allocated'.format(m.group()))
-            
-                # Find the corresponding section
-                corresponding_section = 0
-                for k, v in titles.items():
-                    if v.split()[0] == last_word[0]:
-                        corresponding_section = k
-                        break
-                if corresponding_section == 0:
-                    print(last_word)
-                    raise ValueError("[ERROR] Could not find where |{}| goes".format(last_word[0]))
+        # II. Now we get serious. Purge the ToC of it exists
+        if verbose:
+            print("[INFO] Before removing the toc:", res)
+        original_res = copy.deepcopy(res)
+        res = {k: v for k, v in res.items() if len(v)}
+        # Extract the Table of Content, if any
+        # The gist is that if it exists, all the populated keys should follow each other in order
+        # Remove the sections that are empty so we can iterate over non-zero sections
+
+        # Hypothesis: 1a is not optional - financial statements should not be
+        # if I.1. has two entries and the second is after the 1st last entry -> toc!
+        # then rm all [0] entries, then re-delete all zero entries
+        # else no toc and do nothing
+        full_sect = list(res.keys())
+        
+        # Make sure you got something. If that is not the case, might just be a completely different template.
+        try:
+            assert len(full_sect)
+        except:
+            print("[ERROR] Here is full_sect: |{}|".format(full_sect))
+            print("[ERROR] Original res:", original_res)
+            raise
+        
+        if len(res[full_sect[0]]) >= 2:
+            if res[full_sect[-1]][0][1] < res[full_sect[0]][1][0]:
+                # There is a toc!
+                # print("[INFO] Found a ToC!")
+                self.last_toc = True
+                for v in res.values():  # Iterate through all the sections
+                    del v[0]  # Remove all first titles found - they are the ToC
+                res = {k: v for k, v in res.items() if len(v)}
+        else:
+            # print("[INFO] No ToC found")
+            pass
+        
+        # Extra step: make sure the first elements go in increasing order.
+        try:
+            res = clean_first_markers(res)
+        except Exception as e:
+            print('[ERROR] {} in parser.clean_first_markers ({})'.format(e, report_type))
+            print("This is the res\n", res)
+            raise
+        
+        if verbose:
+            print("[INFO] After removing the toc:", res)
+
+        finds = [len(value) for value in res.values()]
+
+        # Shrink the list of sections to review
+        all_sections = [k for k in all_sections if k in res.keys()]
+        
+        # Find the start & stop of each section and extract the text for all the sections that we identified
+        sections_to_parse = self.s[grammar['sections_to_parse']]
+        previous_start = 0
+        for idx in range(len(all_sections)-1):
+            if all_sections[idx] in sections_to_parse:  # Did we request to parse this section?
+                start = 0  # used for the data extraction
+                stop = 0
+                for span in res[all_sections[idx]]:  # Go through all the titles found, in order
+                    if span[1] > previous_start:  # found a starting point
+                        start = span[1]
+                        for span_next in res[all_sections[idx+1]]:  # Same
+                            if span_next[0] > start:
+                                stop = span_next[0]
+                                break  # Found a stopping point
+                            elif grammar['drop_stale_stops']:  # Historical 10-Q behavior, kept for reproducibility
+                                del res[all_sections[idx+1]][idx]
+                        break  # Found a starting point but not nessarily a stopping point!
+                        
+                if start and stop:  # 
+                    assert stop > start
+                    parsed_report[all_sections[idx]] = section_view(text, start, stop) if binary else text[start:stop]
+                    self.last_spans[all_sections[idx]] = (start, stop)
                 else:
-                    res[corresponding_section].append(m.span())
-            
-            # II. Now we get serious. Purge the ToC of it exists
-            if verbose:
-                print("[INFO] Before removing the toc:", res)
-            original_res = copy.deepcopy(res)
-            res = {k: v for k, v in res.items() if len(v)}
-            # Extract the Table of Content, if any
-            # The gist is that if it exists, all the populated keys should follow each other in order
-            # print(all_sections_10q)
-            # Remove the sections that are empty so we can iterate over non-zero sections
-
-            # Hypothesis: 1a is not optional - financial statements should not be
-            # if I.1. has two entries and the second is after the 1st last entry -> toc!
-            # then rm all [0] entries, then re-delete all zero entries
-            # else no toc and do nothing
-            full_sect = list(res.keys())
-            # Make sure you got something. If that is not the case, might just be a completely different template.
+                    raise ValueError('This start {} and stop {} combination is invalid for {} section {}'
+                                     .format(start, stop, report_type, all_sections[idx]))
+                previous_start = stop
+        
+        # Backward pass: if there are some sections that were expected and did not get populated
+        # we populate them with a small statement.
+        for section in sections_to_parse:
             try:
-                assert len(full_sect)
+                assert len(parsed_report[section]) > 0
+            except KeyError:
+                # print("[WARNING] Section {} was found to be empty.".format(section))
+                parsed_report[section] = "Nothing found for this section."
+            except AssertionError:
+                raise AssertionError("[ERROR] Why is that section filled with an empty text?")
             except:
-                print("[ERROR] Here is full_sect: |{}|".format(full_sect))
-                print("[ERROR] Original res:", original_res)
                 raise
-            
-            if len(res[full_sect[0]]) >= 2:
-                if res[full_sect[-1]][0][1] < res[full_sect[0]][1][0]:
-                    # There is a toc!
-                    # print("[INFO] Found a ToC!")
-                    for v in res.values():  # Iterate through all the sections
-                        del v[0]  # Remove all first titles found - they are the ToC
-                    res = {k: v for k, v in res.items() if len(v)}
-            else:
-                # print("[INFO] No ToC found")
-                pass
-            
-            # Extra step: make sure the first elements go in increasing order.
-            
-            try:
-                res = clean_first_markers(res)
-            except Exception as e:
-                print('[ERROR] {} in parser.clean_first_markers (10-K)'.format(e))
-                print("This is the res\n", res)
-                raise
-            
-            if verbose:
-                print("[INFO] After removing the toc:", res)
-
-            finds = [len(value) for value in res.values()]
-            # print(finds)
-
-            # Remove the sections that are empty so we can iterate over non-zero sections
-            all_sections_10k = [k for k in all_sections_10k if k in res.keys()]
-            # print(res)
-            
-            # Find the start & stop of each section 
-            previous_start = 0
-            for idx in range(len(all_sections_10k)-1):
-                if all_sections_10k[idx] in self.s['sections_to_parse_10k']:  # Did we request to parse this section?
-                    start = 0  # used for the data extraction
-                    stop = 0
-                    for span in res[all_sections_10k[idx]]:  # Go through all the titles found, in order
-                        if span[1] > previous_start:  # found a starting point
-                            start = span[1]
-                            for span_next in res[all_sections_10k[idx+1]]:  # Same
-                                if span_next[0] > start:
-                                    stop = span_next[0]
-                                    break  # Found a stopping point
-                            break  # Found a starting point but not nessarily a stopping point!
-                            
-                    if start and stop:  # 
-                        assert stop > start
-                        parsed_report[all_sections_10k[idx]] = text[start:stop]
-                    else:
-                        raise ValueError('This start {} and stop {} combination is invalid for 10-K section {}'
-                                         .format(start, stop, all_sections_10k[idx]))
-                    previous_start = stop
-            
-            # Backward pass: if there are some 
-            for section in self.s['sections_to_parse_10k']:
-                try:
-                    assert len(parsed_report[section]) > 0
-                except KeyError:
-                    # print("[WARNING] Section {} was found to be empty.".format(section))
-                    parsed_report[section] = "Nothing found for this section."
-                except AssertionError:
-                    raise AssertionError("[ERROR] Why is that section filled with an empty text?")
-                except:
-                    raise
-            
-            # Delete the input we used and return the result
-            del parsed_report['input']
-            # print(parsed_report.keys())
-            # print(parsed_report)
-            
-            # DEBUG
-            if 0:
-                with open('/home/alex/test_10-k_{}.txt'.format(np.random.randint(1000)), 'w') as f:
-                    for section in parsed_report.keys():
-                        if section != '0':
-                            f.write(section+'\n')
-                            f.write(parsed_report[section])
-                            f.write('\n================================================================\n')
-                            f.write('\n==========================NEW SECTION===========================\n')
-                            f.write('\n================================================================\n')
-
-        else:
-            raise ValueError('[ERROR] No stage 2 parser for report type {}!'.format(parsed_report['0']['type']))
         
+        # Delete the input we used and return the result
+        del parsed_report['input']
+        
+        self.last_parse_time = time.perf_counter() - start_time
+        timing = self.timings.setdefault(report_type, [0, 0.])
+        timing[0] += 1
+        timing[1] += self.last_parse_time
         if verbose:
+            print("[INFO] Parsed the {} in {:.1f} ms".format(report_type, 1000*self.last_parse_time))
             if len(list(set(finds))) != 1 or list(set(finds))[0] != 2:
                 print("[WARNING] Issues parsing")
                 # raise  # Figure it out!
@@ -389,3 +311,126 @@ def clean_first_markers(res):
             del res[sections[idx+1]][0]
     return res
 
+
+def index_path(cik, s):
+    """
+    Path of the section index of a CIK.
+
+    :param cik: CIK
+    :param s: Settings dictionary
+    :return: str, or None if the index is disabled
+    """
+    if not s.get('path_section_index'):
+        return None
+    return os.path.join(s['path_section_index'], '{}.json'.format(cik))
+
+
+def load_index(cik, s):
+    """
+    Load the section index of a CIK: for each stage 1 file already parsed, where its sections are.
+
+    :param cik: CIK
+    :param s: Settings dictionary
+    :return: dict {path: entry}, see index_entry. Empty if nothing was stored yet.
+    """
+    path = index_path(cik, s)
+    if path is None or not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_index(cik, index, s):
+    """
+    Persist the section index of a CIK. The file is written next to its final location then moved, so that a crash
+    never leaves a half written index behind.
+
+    :param cik: CIK
+    :param index: dict {path: entry}
+    :param s: Settings dictionary
+    :return: void
+    """
+    path = index_path(cik, s)
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+
+
+def index_key(path, report_type, s):
+    """
+    Everything an index entry depends on: the file itself (size and modification time), the grammar, the parse mode
+    (str and bytes offsets differ) and the sections that were requested.
+
+    :param path: path to the stage 1 file
+    :param report_type: '10-K' or '10-Q'
+    :param s: Settings dictionary
+    :return: dict
+    """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'grammar': grammar_version,
+            'mode': s.get('parse_mode', 'text'),
+            'sections': sorted(s[grammars[report_type]['sections_to_parse']]) if report_type in grammars else []}
+
+
+def index_entry(path, report_type, stg2parser, s, status='ok'):
+    """
+    Create the index entry of a file that was just parsed.
+
+    :param path: path to the stage 1 file
+    :param report_type: '10-K' or '10-Q'
+    :param stg2parser: stage_2_parser that parsed the file
+    :param s: Settings dictionary
+    :param status: 'ok', or 'failed' if the parser raised an exception
+    :return: dict
+    """
+    entry = index_key(path, report_type, s)
+    entry['status'] = status
+    entry['toc'] = stg2parser.last_toc if status == 'ok' else None
+    entry['spans'] = stg2parser.last_spans if status == 'ok' else {}
+    return entry
+
+
+def lookup_index(index, path, report_type, s):
+    """
+    Find the entry of a file in the index, if it is still valid.
+
+    :param index: dict {path: entry}
+    :param path: path to the stage 1 file
+    :param report_type: '10-K' or '10-Q'
+    :param s: Settings dictionary
+    :return: entry, or None if the file is new or changed, or if the settings differ
+    """
+    entry = index.get(path)
+    if entry is None:
+        return None
+    key = index_key(path, report_type, s)
+    return entry if all(entry[k] == v for k, v in key.items()) else None
+
+
+def restore_report(parsed_report, path, entry, s):
+    """
+    Rebuild a parsed report from its index entry instead of parsing the file again. Same output as
+    stage_2_parser.parse.
+
+    :param parsed_report: dict containing the metadata in '0'
+    :param path: path to the stage 1 file
+    :param entry: valid index entry of the file, with a 'ok' status
+    :param s: Settings dictionary
+    :return: parsed report
+    """
+    if entry['mode'] == 'mmap':
+        buffer = map_file(path)
+        for section, (start, stop) in entry['spans'].items():
+            parsed_report[section] = section_view(buffer, start, stop)
+    else:
+        with open(path, errors='ignore') as f:
+            text = f.read().lower()
+        for section, (start, stop) in entry['spans'].items():
+            parsed_report[section] = text[start:stop]
+    for section in s[grammars[parsed_report['0']['type']]['sections_to_parse']]:
+        if section not in parsed_report:
+            parsed_report[section] = "Nothing found for this section."
+    return parsed_report
@@ -0,0 +1,238 @@
+"""
+Streaming version of the multiprocessing stage: discovery, processing and result writing are connected by bounded
+queues.
+
+A feeder thread pulls (cik, paths) from the discovery generator and puts them on the task queue, which blocks as soon
+as queue_size tasks are waiting: nothing is materialized ahead of the workers. Each worker asks for its next task
+through its own pipe and the parent hands it one from the queue, so the parent always knows which CIK every worker
+holds. The results come back through the same pipes and the caller consumes them as a generator - ex: to append them
+to the result journal as they arrive. If the caller falls behind, the pipes fill up and the workers block instead of
+buffering results.
+Parsing and metric computation stay together in process_cik: a CIK's parsed reports never leave its worker, shipping
+them to another process would cost more than it saves (see s['stream_reports'] to bound the memory of a worker).
+
+Workers also watch their own memory. After each CIK, a worker whose RSS went over s['worker_max_rss_mb'] or that
+processed s['worker_max_tasks'] CIKs exits and is replaced by a fresh one, which gives the fragmented memory back to
+the system. If a worker dies in the middle of a CIK (ex: killed by the OOM killer), the CIK is handed out again to
+the next worker that asks for one. A CIK that kills max_attempts workers is given up with the status code killed_code.
+"""
+
+import os
+import sys
+import queue
+import resource
+import threading
+import traceback
+import multiprocessing as mp
+import multiprocessing.connection
+from secScraper import processing
+from secScraper import scheduler
+
+
+killed_code = 6  # process_cik status code of the CIKs given up after killing their workers
+max_attempts = 2  # Number of workers a CIK can kill before it is given up
+
+
+def _memory():
+    """
+    Current and peak resident memory of the process, since the last _reset_peak.
+
+    :return: rss, peak_rss in bytes
+    """
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f)
+        return int(status['VmRSS'].split()[0])*1024, int(status['VmHWM'].split()[0])*1024
+    except (OSError, KeyError):  # No /proc. ru_maxrss is the peak since the start, in bytes on macOS, kB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+        return peak, peak
+
+
+def _reset_peak():
+    """
+    Reset the peak resident memory of the process (Linux only), so that it can be measured per CIK.
+
+    :return: void
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class pipeline_monitor():
+    """
+    Memory used by each CIK and life events of the workers, filled by run_pipeline.
+    """
+    def __init__(self):
+        self.memory = []  # (cik, pid, peak_rss in bytes)
+        self.nb_recycled = 0
+        self.nb_killed = 0
+        self.nb_requeued = 0
+
+    def print_report(self, top=10):
+        """
+        Print the worker events and the CIKs that needed the most memory.
+
+        :param top: number of CIKs to list
+        :return: void
+        """
+        print("[INFO] Workers: {} recycled | {} died unexpectedly | {} CIK re-queued"
+              .format(self.nb_recycled, self.nb_killed, self.nb_requeued))
+        for cik, pid, peak in sorted(self.memory, key=lambda x: -x[2])[:top]:
+            print("CIK {:>10} peaked at {:>8.1f} MB (worker {})".format(cik, peak/2**20, pid))
+
+
+def _worker(conn, s, lm_dictionary):
+    """
+    Ask the parent for tasks and process them until there are none left, or until the worker needs recycling.
+
+    :param conn: worker's end of its pipe. Tasks, (cik, paths) or None to stop, come in and the (kind, pid, payload)
+    messages go out. The parent records a task as in flight before sending it, so it knows which CIK the worker holds
+    even if the worker gets killed right after.
+    :param s: Settings dictionary
+    :param lm_dictionary: Sentiment analysis dictionary
+    :return: void
+    """
+    processing.init_worker(s, lm_dictionary)
+    max_rss = s.get('worker_max_rss_mb')
+    max_tasks = s.get('worker_max_tasks')
+    pid = os.getpid()
+    nb_tasks = 0
+    while True:
+        conn.send(('ready', pid, None))
+        data = conn.recv()
+        if data is None:
+            conn.send(('done', pid, None))
+            return
+        _reset_peak()
+        try:
+            payload = scheduler.timed_process_cik(data)
+        except Exception:
+            conn.send(('error', pid, (data[0], traceback.format_exc())))
+            continue
+        rss, peak = _memory()
+        conn.send(('result', pid, (payload, peak)))
+        nb_tasks += 1
+        if max_rss and rss > max_rss*2**20:
+            conn.send(('recycle', pid, "RSS {:.0f} MB after CIK {}".format(rss/2**20, data[0])))
+            return
+        if max_tasks and nb_tasks >= max_tasks:
+            conn.send(('recycle', pid, "{} CIK processed".format(nb_tasks)))
+            return
+
+
+def _feed(tasks, data_to_process):
+    """
+    Move the tasks from the discovery generator to the task queue, then mark the end of the stream with None.
+
+    :param tasks: task queue
+    :param data_to_process: iterable of (cik, paths)
+    :return: void
+    """
+    for data in data_to_process:
+        tasks.put(data)  # Blocks while the queue is full
+    tasks.put(None)
+
+
+def run_pipeline(data_to_process, s, lm_dictionary, nb_workers, queue_size=None, monitor=None):
+    """
+    Process a stream of CIKs with a set of worker processes.
+
+    :param data_to_process: iterable of (cik, paths), consumed lazily
+    :param s: Settings dictionary. A plain dict, the read only version cannot be pickled.
+    :param lm_dictionary: Sentiment analysis dictionary
+    :param nb_workers: number of worker processes
+    :param queue_size: maximum number of tasks discovered ahead of the workers. Defaults to 2 per worker.
+    :param monitor: (optional) pipeline_monitor that records the memory of each CIK and the worker events
+    :return: generator of (value returned by process_cik, (cik, pid, start, stop)), in order of completion
+    """
+    queue_size = queue_size if queue_size else 2*nb_workers
+    monitor = monitor if monitor is not None else pipeline_monitor()
+    max_rss = s.get('worker_max_rss_mb')
+    tasks = queue.Queue(queue_size)
+    requeued = []  # Tasks of the dead workers, handed out before the new ones
+    exhausted = False  # The feeder reached the end of data_to_process
+    workers = dict()  # conn -> process
+    in_flight = dict()  # pid -> task being processed
+    finished = set()  # pid of the workers that exited on their own
+    attempts = dict()  # cik -> number of workers that died processing it
+
+    def start_worker():
+        conn, child_conn = mp.Pipe()
+        worker = mp.Process(target=_worker, args=(child_conn, s, lm_dictionary), daemon=True)
+        worker.start()
+        child_conn.close()  # The worker holds the only end left: reading past its last message means it is gone
+        workers[conn] = worker
+
+    def next_task():
+        nonlocal exhausted
+        if requeued:
+            return requeued.pop(0)
+        if exhausted:
+            return None
+        data = tasks.get()  # Blocks until the feeder discovered the next CIK
+        exhausted = data is None
+        return data
+
+    for _ in range(nb_workers):
+        start_worker()
+    feeder = threading.Thread(target=_feed, args=(tasks, data_to_process), daemon=True)
+    feeder.start()
+
+    try:
+        while workers:
+            for conn in mp.connection.wait(list(workers)):
+                pid = workers[conn].pid
+                try:
+                    kind, _, payload = conn.recv()
+                except EOFError:  # The worker is gone
+                    workers.pop(conn).join()
+                    conn.close()
+                    if pid in finished:
+                        continue
+                    monitor.nb_killed += 1
+                    data = in_flight.pop(pid, None)
+                    if data is not None:  # Otherwise it died between two CIKs, nothing was lost
+                        attempts[data[0]] = attempts.get(data[0], 0) + 1
+                        if attempts[data[0]] < max_attempts:
+                            print("[WARNING] Worker {} died while processing CIK {}, re-queued".format(pid, data[0]))
+                            monitor.nb_requeued += 1
+                            requeued.append(data)
+                        else:
+                            print("[WARNING] CIK {} killed {} workers, giving up".format(data[0], attempts[data[0]]))
+                            yield (data[0], {}, killed_code, {}), (data[0], pid, 0., 0.)
+                    start_worker()
+                    continue
+
+                if kind == 'ready':
+                    data = next_task()
+                    if data is not None:
+                        in_flight[pid] = data  # Before sending: the worker can die as soon as it has it
+                    try:
+                        conn.send(data)
+                    except OSError:  # Already dead, the EOF will follow
+                        pass
+                elif kind == 'result':
+                    (value, record), peak = payload
+                    in_flight.pop(pid, None)
+                    monitor.memory.append((value[0], pid, peak))
+                    if max_rss and peak > max_rss*2**20:
+                        print("[WARNING] CIK {} peaked at {:.0f} MB".format(value[0], peak/2**20))
+                    yield value, record
+                elif kind == 'recycle':
+                    print("[INFO] Recycling worker {}: {}".format(pid, payload))
+                    monitor.nb_recycled += 1
+                    finished.add(pid)
+                    start_worker()
+                elif kind == 'done':
+                    finished.add(pid)
+                elif kind == 'error':
+                    raise RuntimeError('[ERROR] Worker {} failed on CIK {}:\n{}'.format(pid, *payload))
+    finally:
+        for conn, worker in workers.items():
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+            conn.close()
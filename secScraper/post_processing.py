@@ -1,6 +1,7 @@
 import pandas as pd
 from datetime import datetime
 from secScraper import qtrs
+from secScraper import prices
 import csv
 from tqdm import tqdm
 from scipy.stats.mstats import winsorize
@@ -100,14 +101,24 @@ def get_share_price(cik, qtr, lookup, stock_data, verbose=False):
     :param cik: CIK
     :param qtr: qtr
     :param lookup: lookup dict
-    :param stock_data: dict of the stock data
+    :param stock_data: dict of the stock data, prices.price_store or prices.entry_price_matrix
     :param verbose: self explanatory
     :return: share_price, market_cap, flag_price_found
     """
     ticker = lookup[cik]
+    if isinstance(stock_data, prices.entry_price_matrix):  # Precomputed for all the qtr
+        return stock_data.get(ticker, qtr)
     # print("cik/ticker", cik, ticker)
     qtr_start_date = "{}{}{}".format(str(qtr[0]), str((qtr[1]-1)*3+1).zfill(2), '01')
     qtr_start_date = datetime.strptime(qtr_start_date, '%Y%m%d').date()
+
+    if isinstance(stock_data, prices.price_store):  # Binary search of the first trading day of the next 7
+        row = stock_data.asof(ticker, qtr_start_date)
+        if row < 0:
+            return 1, 1, False
+        share_price, market_cap = stock_data.values[row].tolist()
+        # Market cap is a bigint in postgres, keep it integral (float64 is exact up to 2**53)
+        return share_price, int(market_cap), not (share_price == 1 and market_cap == 1)
     
     # Find the first trading day after the beginning of the quarter.
     # Sanity check: is there a price available?
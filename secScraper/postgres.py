@@ -3,6 +3,9 @@ from tqdm import tqdm
 import ast
 from datetime import datetime
 import csv
+import io
+import pandas as pd
+from secScraper import prices
 
 def delete_table(connector, name_table):
     cur = connector.cursor()
@@ -87,6 +90,49 @@ def cik_scores_to_postgres(connector, cik_scores, header, s):
                 except KeyError:  # There is no data for this qtr, CIK not listed/delisted
                     continue
 
+def next_idx(connector, table_name):
+    cur = connector.cursor()
+    cur.execute("SELECT COALESCE(MAX(IDX), -1) + 1 FROM {};".format(table_name))
+    return cur.fetchone()[0]
+
+
+def append_cik_scores_to_postgres(connector, cik_scores, qtr, s):
+    """
+    Append the scores of a single qtr to the existing cik_scores table. Used by the incremental update.
+    """
+    idx = next_idx(connector, 'cik_scores')
+    for cik in tqdm(cik_scores.keys()):
+        if qtr not in cik_scores[cik]:
+            continue
+        md = cik_scores[cik][qtr]['0']  # Metadata
+        for m in s['metrics']:
+            insert_row(connector, 'cik_scores',
+                       (idx, cik, qtr, m, cik_scores[cik][qtr]['total'][m], md['type'], md['published']))
+            idx += 1
+
+
+def append_csv_rows(connector, table_name, path, rows):
+    """
+    Append rows to both a csv dump and its postgres table, without re-creating the table. The IDX keeps counting from
+    the last row of the csv so that it stays unique and matches between the csv and the table. The rows are the same
+    as in a full rebuild but not their order: a full rebuild numbers them metric by metric across all the qtr.
+    """
+    with open(path) as f:
+        idx = sum(1 for _ in f) - 1  # Header row
+    buffer = io.StringIO()
+    out = csv.writer(buffer, delimiter=';')
+    for row in rows:
+        out.writerow([idx] + list(row))
+        idx += 1
+    with open(path, 'a') as f:
+        f.write(buffer.getvalue())
+    buffer.seek(0)
+    cur = connector.cursor()
+    cur.copy_from(buffer, table_name, sep=';')
+    connector.commit()
+    print("[INFO] Appended {:,} rows to {}".format(len(rows), table_name))
+
+
 def csv_to_postgres(connector, table_name, header, path):
     delete_table(connector, table_name)
     create_postgres_table(connector, table_name, header)
@@ -251,6 +297,28 @@ def retrieve_all_stock_data(connector, table_name):
         
     return stock_data
 
+
+
+def retrieve_price_store(connector, table_name):
+    """
+    Load the stock_data or index_data table into a prices.price_store. The table is streamed out with COPY and parsed
+    column by column, without building a Python object per row.
+
+    :param connector: postgres connector
+    :param table_name: 'stock_data' or 'index_data'
+    :return: prices.price_store
+    """
+    buffer = io.StringIO()
+    cur = connector.cursor()
+    cur.copy_expert("COPY (SELECT * FROM {}) TO STDOUT WITH CSV".format(table_name), buffer)
+    buffer.seek(0)
+    df = pd.read_csv(buffer, header=None, dtype={1: str}, keep_default_na=False)
+    store = prices.price_store(df[1].values, prices.to_days(df[2].values), df[df.columns[3:]].values)
+    print("[INFO] Loaded {:,} prices of {:,} tickers from {} ({:.1f} MB)"
+          .format(len(df), len(store), table_name, store.nbytes()/2**20))
+    return store
+
+
 def retrieve_stock_data(connector, ticker):
     sql_query = "SELECT * FROM stock_data WHERE ticker = '{}';".format(ticker)
     print(sql_query)
@@ -2,7 +2,12 @@ import csv
 from tqdm import tqdm
 from datetime import datetime
 import glob
+import numpy as np
 import multiprocessing as mp
+from collections import Counter
+from secScraper import crsp
+from secScraper import manifest
+from secScraper import prices
 
 class ReadOnlyDict(dict):
     """
@@ -73,11 +78,18 @@ def paths_to_cik_dict(file_list, unique_sec_cik):
 
 def load_cik_path(s):
     """
-    Find all the file paths and organize them by CIK.
+    Find all the file paths and organize them by CIK. With s['path_manifest'], they come from the filing manifest
+    instead of a walk of the whole stage 1 folder.
 
     :param s: Settings dictionary
     :return: Dictionary of paths with the keys being the CIK.
     """
+    if s.get('path_manifest'):
+        manifest.refresh_manifest(s)
+        cik_path = manifest.load_cik_path(s)
+        print("[INFO] cik_path contains data on {:,} CIK numbers ({:,} {})"
+              .format(len(cik_path), sum(len(paths) for paths in cik_path.values()), s['report_type']))
+        return cik_path
     file_list = glob.glob(s['path_stage_1_data']+'**/*.txt', recursive=True)
     print("[INFO] Loaded {:,} 10-X".format(len(file_list)))
     file_list = filter_cik_path(file_list, s)
@@ -149,10 +161,22 @@ def load_stock_data(s, penny_limit=0, verbose=True):
     Load all the stock data and pre-processes it.
     WARNING: Despite all (single process) efforts, this still takes a while. Using map seems to be the fastest
     way in python for that O(N) operation but it still takes ~ 60 s on my local machine (1/3rd reduction)
+    With s['path_stock_cache'], the csv is parsed in parallel once and later runs read its columnar cache instead,
+    see crsp.py. The prices are then returned as a prices.price_store rather than a dict of millions of tuples.
 
     :param s: Settings dictionary
-    :return: dict stock_data[ticker][time stamp] = (closing, market cap)
+    :return: dict stock_data[ticker][time stamp] = (closing, market cap), or price_store with the same two values
     """
+    if s.get('path_stock_cache'):
+        columns = crsp.load_crsp_cache(s['path_stock_database'], s['path_stock_cache'], verbose=verbose)
+        filtered, stats = crsp.filter_prices(columns, s['time_range'], penny_limit)
+        if verbose:
+            print("[INFO] stock_data load statistics:")
+            print("Incomplete lines: {:,}/{:,}".format(stats['nb_incomplete'], stats['nb_lines']))
+            print("Penny stocks found (at least one entry below threshold): {}/{}"
+                  .format(stats['nb_penny'], stats['nb_penny'] + stats['nb_tickers']))
+            print("Lines out of range: {:,}/{:,}".format(stats['nb_out_of_range'], stats['nb_lines']))
+        return prices.price_store.from_columns(filtered, columns['tickers'])
     with open(s['path_stock_database']) as f:
         header = next(f).split(',')
         header[-1] = header[-1].strip()
@@ -257,7 +281,7 @@ def intersection_lookup_stock(lookup, stock):
     external databases.
 
     :param lookup: lookup dictionary
-    :param stock: stock data, organized in a dictionary with tickers as keys.
+    :param stock: stock data, organized in a dictionary with tickers as keys, or prices.price_store
     :return: both dictionaries with only the intersection of CIKs left as keys.
     """
     # 1. Create unique lists to compare
@@ -270,11 +294,93 @@ def intersection_lookup_stock(lookup, stock):
     
     # 3. Return a new intersection dictionary
     inter_lookup = {k: v for k, v in lookup.items() if v in intersection_tickers}
-    inter_stock = {k: stock[k] for k in stock.keys() if k in intersection_tickers}
+    if isinstance(stock, prices.price_store):
+        inter_stock = stock.subset(sorted(intersection_tickers))
+    else:
+        inter_stock = {k: stock[k] for k in stock.keys() if k in intersection_tickers}
     
     return inter_lookup, inter_stock
 
 
+# Reason codes of review_publications
+review_codes = {
+    0: 'kept',
+    1: 'not more reports than the lag',
+    2: 'no report in the time range',
+    3: 'more than one report in a qtr',
+    4: '10-K outside of Q1 or 10-Q in Q1',
+    5: 'missing qtr before the last report'
+}
+
+
+def publication_matrix(cik_path, s):
+    """
+    Count the reports of each CIK in each qtr of s['list_qtr'], by type.
+
+    :param cik_path: dictionary {cik: list of paths}
+    :param s: Settings dictionary
+    :return: list of CIK (rows), and three arrays of shape (nb CIK, nb qtr): the number of 10-K, of 10-Q and of reports
+    of other types
+    """
+    filings = manifest.filing_metadata(s) if s.get('path_manifest') else {}  # Otherwise, read from the paths
+    qtr_idx = {qtr: idx for idx, qtr in enumerate(s['list_qtr'])}
+    type_idx = {'10-K': 0, '10-Q': 1}
+    ciks = list(cik_path.keys())
+    rows, cols, types = [], [], []
+    for row, cik in enumerate(ciks):
+        for path_report in cik_path[cik]:
+            if path_report in filings:
+                qtr, _, type_report = filings[path_report]
+            else:
+                split_path = path_report.split('/')
+                qtr = (int(split_path[-3]), int(split_path[-2][3]))  # Ex: (2016, 3)
+                type_report = split_path[-1].split('_')[1]
+            if qtr in qtr_idx and type_report in s['report_type']:
+                rows.append(row)
+                cols.append(qtr_idx[qtr])
+                types.append(type_idx.get(type_report, 2))
+    counts = np.zeros((3, len(ciks), len(s['list_qtr'])), dtype=np.int32)
+    np.add.at(counts, (np.array(types, dtype=np.intp), np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1)
+    return ciks, counts[0], counts[1], counts[2]
+
+
+def review_publications(cik_path, s):
+    """
+    Vectorized version of check_report_continuity over all the CIKs at once. Once listed, a CIK must have one and only
+    one report per qtr - a 10-K in Q1, a 10-Q in Q2, Q3 and Q4 - until it is permanently delisted.
+
+    :param cik_path: dictionary {cik: list of paths}
+    :param s: Settings dictionary
+    :return: dictionary {cik: reason code}, see review_codes. 0 means the CIK is kept.
+    """
+    ciks, nb_10k, nb_10q, nb_other = publication_matrix(cik_path, s)
+    nb_qtr = len(s['list_qtr'])
+    col = np.arange(nb_qtr)
+    counts = nb_10k + nb_10q + nb_other
+    is_q1 = np.array([qtr[1] == 1 for qtr in s['list_qtr']], dtype=bool)
+    right_type = np.where(is_q1, nb_10k == 1, nb_10q == 1)
+
+    listed = counts > 0
+    first_listed = listed.argmax(axis=1)
+    last_listed = nb_qtr - 1 - listed[:, ::-1].argmax(axis=1)
+    bad = (col >= first_listed[:, None]) & ((counts != 1) | ~right_type)
+    first_bad = bad.argmax(axis=1)
+    count_bad = counts[np.arange(len(ciks)), first_bad]
+
+    codes = np.zeros(len(ciks), dtype=np.int8)
+    has_bad = bad.any(axis=1)
+    codes[has_bad & (count_bad == 0) & (last_listed > first_bad)] = 5  # A gap. Trailing empty qtr are a delisting
+    codes[has_bad & (count_bad == 1)] = 4
+    codes[has_bad & (count_bad > 1)] = 3
+    codes[~listed.any(axis=1)] = 2
+    codes[np.array([len(cik_path[cik]) for cik in ciks]) <= s['lag']] = 1  # You need more reports than the lag
+
+    wrong_other = has_bad & (codes == 4) & (nb_other[np.arange(len(ciks)), first_bad] == 1)
+    if wrong_other.any():
+        raise ValueError('[ERROR] Only 10-K and 10-Q supported.')
+    return {cik: int(code) for cik, code in zip(ciks, codes)}
+
+
 def review_cik_publications(cik_path, s):
     """Filter the CIK based on how many publications there are per quarter
     This function reviews all the CIK to make sure there is only 1 publication per qtr
@@ -285,36 +391,12 @@ def review_cik_publications(cik_path, s):
     :param s: Settings dictionary
     :return: A filtered version of the cik_path dictionary - only has the keys that passed the test.
     """
-    cik_to_delete = []
-    for cik, paths in tqdm(cik_path.items()):
-        # Make sure there are enough reports to enable diff calculations
-        if not len(paths) > s['lag']:  # You need more reports than the lag
-            cik_to_delete.append(cik)
-            continue
-        
-        quarterly_submissions = {key: [] for key in s['list_qtr']}
-        for path_report in paths:  # For each report for that CIK
-            split_path = path_report.split('/')
-            qtr = (int(split_path[-3]), int(split_path[-2][3]))  # Ex: (2016, 3)
-            if qtr in quarterly_submissions.keys():
-                published = split_path[-1].split('_')[0]
-                published = datetime.strptime(published, '%Y%m%d').date()
-                type_report = split_path[-1].split('_')[1]
-                if type_report in s['report_type']:  # Add to the dict
-                    metadata = {'type': type_report, 'published': published, 'qtr': qtr}
-                    quarterly_submissions[qtr].append(metadata)
-
-        # Check for continuity of the reports
-        flag_continuity = check_report_continuity(quarterly_submissions, s)
-        if not flag_continuity:  # Will ignore that CIK
-            cik_to_delete.append(cik)
-            continue
-    
-    # Create a subset of cik_dict based on the cik not faulty
-    print()
-    print("[INFO] {} CIKs caused trouble".format(len(cik_to_delete)))
-    cik_dict = {k: v for k, v in cik_path.items() if k not in cik_to_delete}
-    
+    codes = review_publications(cik_path, s)
+    cik_dict = {k: v for k, v in cik_path.items() if codes[k] == 0}
+    print("[INFO] {} CIKs caused trouble".format(len(cik_path) - len(cik_dict)))
+    for code, count in sorted(Counter(codes.values()).items()):
+        if code:
+            print("{:>6,} CIK: {}".format(count, review_codes[code]))
     return cik_dict
 
 
@@ -0,0 +1,216 @@
+"""
+Array backed store of daily prices, for the stock data and the index data.
+
+All the (ticker, date) rows are kept in flat arrays sorted by ticker then date: the dates as int32 days since
+1970-01-01 and the values (ex: price and market cap) as float64 columns. The rows of a ticker are a contiguous slice,
+so the first trading day on or after a date is a binary search, and a batch of (ticker, date) is a single
+np.searchsorted over a (ticker, date) key.
+A ticker can still be read as the {date: [values]} dictionary of postgres.retrieve_all_stock_data, built on demand.
+"""
+
+import numpy as np
+from datetime import date
+
+
+max_days = 6  # A price is looked for up to 6 days after the requested date, ex: the 1st to the 7th of a month
+
+
+def to_days(dates):
+    """
+    Convert dates to days since 1970-01-01.
+
+    :param dates: a datetime.date, or an array like of datetime.date, datetime64 or 'YYYY-MM-DD' strings
+    :return: int, or int32 array
+    """
+    if isinstance(dates, date):
+        return (dates - date(1970, 1, 1)).days
+    return np.asarray(dates).astype('datetime64[D]').astype(np.int32)
+
+
+def yyyymmdd_to_days(dates):
+    """
+    Convert yyyymmdd integers (ex: the date column of the CRSP file) to days since 1970-01-01.
+
+    :param dates: int array, ex: 20160815
+    :return: int32 array
+    """
+    dates = np.asarray(dates)
+    months = 12*(dates // 10000 - 1970) + dates // 100 % 100 - 1
+    return (months.astype('datetime64[M]').astype('datetime64[D]') + (dates % 100 - 1)).astype(np.int32)
+
+
+class price_store():
+    """
+    Daily values of many tickers. Replaces the stock_data and index_data dictionaries.
+    """
+    def __init__(self, names, days, values):
+        """
+        :param names: ticker (or index name) of each row
+        :param days: days since 1970-01-01 of each row, see to_days
+        :param values: values of each row, array of shape (nb rows, nb values) or (nb rows,). Ex: price and market cap.
+        For duplicated (ticker, date), the last row wins.
+        """
+        names = np.asarray(names, dtype=str)
+        days = np.asarray(days, dtype=np.int32)
+        values = np.asarray(values, dtype=np.float64)
+        values = values.reshape(len(days), -1) if len(days) else values.reshape(0, 1)
+        self.tickers, codes = np.unique(names, return_inverse=True)
+        order = np.lexsort((days, codes))  # Stable: duplicates stay in their order
+        keys = codes[order].astype(np.int64)*2**32 + (days[order].astype(np.int64) + 2**31)
+        last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+        self.row_keys = keys[last]
+        self.days = days[order][last]
+        self.values = values[order][last]
+        self.offsets = np.searchsorted(self.row_keys >> 32, np.arange(len(self.tickers) + 1))
+        self._index = {ticker: idx for idx, ticker in enumerate(self.tickers.tolist())}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a store from a stock_data or index_data dictionary.
+
+        :param data: dict {ticker: {datetime.date: value or list of values}}
+        :return: price_store
+        """
+        names, days, values = [], [], []
+        for ticker, prices in data.items():
+            names.extend([ticker]*len(prices))
+            days.extend(prices.keys())
+            values.extend(prices.values())
+        return cls(names, to_days(days) if len(days) else np.zeros(0, dtype=np.int32), values)
+
+    @classmethod
+    def from_columns(cls, columns, tickers):
+        """
+        Build a store from the CRSP columns, see crsp.filter_prices.
+
+        :param columns: dict of arrays ticker, date, price, market_cap
+        :param tickers: table of the tickers (bytes), see crsp.load_crsp_cache
+        :return: price_store
+        """
+        names = np.char.decode(np.asarray(tickers))[columns['ticker']]
+        return cls(names, yyyymmdd_to_days(columns['date']),
+                   np.column_stack([columns['price'], columns['market_cap']]))
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def __getitem__(self, ticker):
+        """
+        Values of a ticker as a dictionary. Built on each call: use asof or batch_asof for lookups.
+
+        :param ticker: ticker
+        :return: dict {datetime.date: list of values}
+        """
+        idx = self._index[ticker]
+        start, stop = self.offsets[idx], self.offsets[idx+1]
+        dates = self.days[start:stop].astype('datetime64[D]').tolist()
+        return dict(zip(dates, self.values[start:stop].tolist()))
+
+    def subset(self, tickers):
+        """
+        Store restricted to some tickers.
+
+        :param tickers: iterable of tickers
+        :return: price_store
+        """
+        codes = [self._index[ticker] for ticker in tickers if ticker in self._index]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c+1]) for c in codes] + [np.zeros(0, dtype=int)])
+        return price_store(self.tickers[self.row_keys[rows] >> 32], self.days[rows], self.values[rows])
+
+    def nbytes(self):
+        """
+        :return: memory used by the arrays, in bytes
+        """
+        return self.row_keys.nbytes + self.days.nbytes + self.values.nbytes + self.offsets.nbytes
+
+    def asof(self, ticker, day, window=max_days):
+        """
+        Find the first trading day on or after a date.
+
+        :param ticker: ticker
+        :param day: datetime.date, or days since 1970-01-01
+        :param window: number of days after day that are still acceptable
+        :return: row index in self.values, -1 if there is no price in [day, day + window]
+        """
+        idx = self._index.get(ticker)
+        if idx is None:
+            return -1
+        day = to_days(day) if isinstance(day, date) else day
+        start, stop = self.offsets[idx], self.offsets[idx+1]
+        row = start + np.searchsorted(self.days[start:stop], day)
+        if row < stop and self.days[row] - day <= window:
+            return int(row)
+        return -1
+
+    def batch_asof(self, tickers, days, window=max_days):
+        """
+        Vectorized asof for arrays of (ticker, date).
+
+        :param tickers: array like of tickers
+        :param days: array like of dates, see to_days
+        :param window: number of days after each date that are still acceptable
+        :return: values of shape (nb queries, nb values), NaN where nothing was found, and the found mask
+        """
+        days = to_days(days) if not np.issubdtype(np.asarray(days).dtype, np.integer) else np.asarray(days)
+        unique_tickers, inverse = np.unique(np.asarray(tickers, dtype=str), return_inverse=True)
+        codes = np.array([self._index.get(ticker, -1) for ticker in unique_tickers.tolist()], dtype=np.int64)[inverse]
+        if len(self.row_keys) == 0:
+            return np.full((len(codes), self.values.shape[1]), np.nan), np.zeros(len(codes), dtype=bool)
+        queries = codes*2**32 + (days.astype(np.int64) + 2**31)
+        rows = np.minimum(np.searchsorted(self.row_keys, queries), len(self.row_keys) - 1)
+        # The first key >= the query is the first day on or after the date if it still belongs to the same ticker. The
+        # index is clipped, so past the last row the day can be before the date.
+        delta = self.days[rows].astype(np.int64) - days
+        found = (codes >= 0) & (self.row_keys[rows] >> 32 == codes) & (0 <= delta) & (delta <= window)
+        values = np.where(found[:, None], self.values[rows], np.nan)
+        return values, found
+
+
+class entry_price_matrix():
+    """
+    Price and market cap of every ticker on the first trading day of every qtr, computed once for a backtest. Can be
+    passed instead of stock_data to post_processing.get_share_price and to all the portfolio functions that call it.
+    """
+    def __init__(self, stock_data, tickers, list_qtr):
+        """
+        :param stock_data: price_store, or dict of the stock data
+        :param tickers: tickers of the backtest, ex: lookup.values()
+        :param list_qtr: qtr of the backtest, ex: s['list_qtr']
+        """
+        store = stock_data if isinstance(stock_data, price_store) else price_store.from_dict(stock_data)
+        self.tickers = sorted(set(tickers))
+        self.list_qtr = list(list_qtr)
+        self._ticker_idx = {ticker: idx for idx, ticker in enumerate(self.tickers)}
+        self._qtr_idx = {qtr: idx for idx, qtr in enumerate(self.list_qtr)}
+        days = np.array([to_days(date(qtr[0], (qtr[1]-1)*3 + 1, 1)) for qtr in self.list_qtr], dtype=np.int32)
+        shape = (len(self.tickers), len(self.list_qtr))
+        values, found = store.batch_asof(np.repeat(np.array(self.tickers, dtype=str), shape[1]),
+                                         np.tile(days, shape[0]))
+        self.price = values[:, 0].reshape(shape)
+        self.market_cap = values[:, 1].reshape(shape)
+        # Same rule as get_share_price: (1, 1) is the 'not found' value
+        self.found = found.reshape(shape) & ~((self.price == 1) & (self.market_cap == 1))
+
+    def get(self, ticker, qtr):
+        """
+        Entry price of a ticker for a qtr.
+
+        :param ticker: ticker
+        :param qtr: qtr, must be in list_qtr
+        :return: share_price, market_cap, flag_price_found. (1, 1, False) if there is no price.
+        """
+        idx = self._ticker_idx.get(ticker)
+        jdx = self._qtr_idx[qtr]
+        if idx is None or not self.found[idx, jdx]:
+            return 1, 1, False
+        return float(self.price[idx, jdx]), int(self.market_cap[idx, jdx]), True  # Market cap is a bigint
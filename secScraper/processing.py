@@ -1,6 +1,12 @@
 from datetime import datetime
+from collections import Counter
+import gc
+import time
+import numpy as np
 from secScraper import metrics
 from secScraper import parser
+from secScraper import sketches
+from secScraper import tokenization
 import nltk
 """
 nltk.download('stopwords')
@@ -9,13 +15,172 @@ nltk.download('wordnet')
 """
 
 from nltk.corpus import stopwords 
-from nltk.tokenize import word_tokenize, regexp_tokenize
 from nltk.stem import WordNetLemmatizer
 
 # Created just for use by the normalize_text function
 lemmatizer = WordNetLemmatizer()
 stop_words = set(stopwords.words('english'))
 
+# Metrics that can be calculated on a corpus-wide sparse representation
+sparse_metrics = {'diff_sk_cosine_tf': False, 'diff_sk_cosine_tf_idf': True}  # metric: use_idf
+
+
+# Settings and sentiment dictionary of the worker, see init_worker
+_worker_context = dict()
+
+# Representations that are derived from another one rather than from the text of the section
+_feature_sources = {'set': 'tokens', 'ids': 'tokens', 'sketch': 'tokens'}
+
+
+class feature_cache():
+    """
+    Representations of the sections of a CIK's reports, computed once per (qtr, section) and shared by all the pairs
+    and all the metrics. In quarterly mode each report is compared twice, once as current and once as previous, so
+    this halves the tokenization work. Entries are dropped with release() once a qtr cannot be part of a pair anymore.
+    The time spent building each representation and calculating each metric is accumulated in timings.
+    """
+
+    def __init__(self, s, lm_dictionary):
+        self.s = s
+        self.lm_dictionary = lm_dictionary
+        self.features = dict()  # features[qtr][section][name]
+        self.analyzer = None  # sklearn tokenizer, only built if a TF or TF-IDF metric needs it
+        self.timings = {'parsing': dict(), 'features': dict(), 'metrics': dict()}  # timings[kind][name] = [nb, seconds]
+
+    def get(self, qtr, section, text, name):
+        """
+        Return a representation of a section, computing it on the first request.
+
+        :param qtr: qtr of the report
+        :param section: section of the report
+        :param text: text of the section, only used on a cache miss
+        :param name: 'text', 'tokens', 'set', 'ids', 'sketch', 'counts' or 'sentiment'
+        :return: the representation
+        """
+        if name == 'text':  # Already in the parsed report, no need to keep a second reference
+            return text
+        cached = self.features.setdefault(qtr, {}).setdefault(section, {})
+        if name not in cached:
+            source = self.get(qtr, section, text, _feature_sources[name]) if name in _feature_sources else text
+            start = time.perf_counter()
+            cached[name] = self._compute(name, source)
+            self.add_timing('features', name, time.perf_counter() - start)
+        return cached[name]
+
+    def _compute(self, name, source):
+        """
+        Build a representation from the text of the section or from the representation it derives from.
+
+        :param name: name of the representation
+        :param source: text of the section, or the representation listed in _feature_sources
+        :return: the representation
+        """
+        if name == 'tokens':  # int32 ids of the shared vocabulary
+            return tokenization.tokenize(source, self.s.get('tokenizer', 'normal'), self.s['stop_words'],
+                                         self.s['lemmatize'])
+        elif name == 'set':
+            return set(source.tolist())
+        elif name == 'ids':  # Python ints are faster to compare one by one than numpy scalars
+            return source.tolist()
+        elif name == 'sketch':  # Hashed from the str so the signatures do not depend on the vocabulary
+            return sketches.minhash_signature(tokenization.shared_vocabulary.decode(np.unique(source)),
+                                              self.s.get('minhash_num_perm', 128))
+        elif name == 'counts':  # No lemmatization for TF and TF-IDF
+            if self.analyzer is None:
+                self.analyzer = metrics.sk_analyzer(list(stop_words) if self.s['stop_words'] else None)
+            return Counter(self.analyzer(source))
+        elif name == 'sentiment':
+            return metrics.sentiment_scores(source, self.lm_dictionary)
+        else:
+            raise ValueError('[ERROR] Feature {} is not implemented'.format(name))
+
+    def add_timing(self, kind, name, duration):
+        """
+        Accumulate the time spent on a representation or a metric.
+
+        :param kind: 'parsing', 'features' or 'metrics'
+        :param name: name of the representation or the metric
+        :param duration: seconds
+        :return: void
+        """
+        timing = self.timings[kind].setdefault(name, [0, 0.])
+        timing[0] += 1
+        timing[1] += duration
+
+    def release(self, qtr):
+        """
+        Forget everything computed for a qtr.
+
+        :param qtr: qtr of the report
+        :return: void
+        """
+        self.features.pop(qtr, None)
+
+
+def _edit_distance(current, previous, s):
+    sample_edit = s.get('edit_distance_sample')  # Optional cap on number of words. None uses the full sections.
+    return metrics.diff_edit_distance_ids(current('ids')[:sample_edit], previous('ids')[:sample_edit])
+
+
+def _sentiment(m):
+    return {'current': ['sentiment'], 'previous': [], 'bounds': (-1, 1),
+            'function': lambda current, previous, s: current('sentiment')[m]}  # All sing_* share a single scan
+
+
+# Every metric that can be requested in s['metrics']. Each one declares the representations of the current and
+# previous sections it needs (see feature_cache) and the bounds of its output. The function receives two accessors,
+# current(name) and previous(name), that return the representations of the sections. The optional complexity is the
+# exponent of the section size in the cost of the metric (1 if missing), used by the scheduler to plan the work.
+metric_registry = {
+    'diff_jaccard': {'current': ['set'], 'previous': ['set'], 'bounds': (0, 1),
+                     'function': lambda current, previous, s: metrics.set_jaccard(current('set'), previous('set'))},
+    'diff_minhash_jaccard': {'current': ['sketch'], 'previous': ['sketch'], 'bounds': (0, 1),
+                             'function': lambda current, previous, s: float(
+                                 sketches.jaccard_from_signatures(current('sketch'), previous('sketch')))},
+    'diff_sk_cosine_tf': {'current': ['counts'], 'previous': ['counts'], 'bounds': (0, 1),
+                          'function': lambda current, previous, s: metrics.counts_cosine(
+                              current('counts'), previous('counts'), False)},
+    'diff_sk_cosine_tf_idf': {'current': ['counts'], 'previous': ['counts'], 'bounds': (0, 1),
+                              'function': lambda current, previous, s: metrics.counts_cosine(
+                                  current('counts'), previous('counts'), True)},
+    'diff_gfg_editDistDP': {'current': ['ids'], 'previous': ['ids'], 'bounds': (0, 1), 'function': _edit_distance,
+                            'complexity': 2},
+    'diff_simple': {'current': ['text'], 'previous': ['text'], 'bounds': (0, 1), 'complexity': 0,  # Capped at 200 char
+                    'function': lambda current, previous, s: metrics.diff_simple(current('text')[:200],
+                                                                                 previous('text')[:200])},
+    'sing_LoughranMcDonald': _sentiment('sing_LoughranMcDonald'),
+    **{m: _sentiment(m) for m in metrics.sentiment_metrics}
+}
+
+
+def merge_timings(total, timings):
+    """
+    Add the timings of a CIK to a running total.
+
+    :param total: dictionary organized as total[kind][name] = [nb_calls, seconds]. Updated in place.
+    :param timings: timings of a feature_cache, organized the same way
+    :return: void
+    """
+    for kind in timings:
+        for name, (nb_calls, duration) in timings[kind].items():
+            timing = total.setdefault(kind, {}).setdefault(name, [0, 0.])
+            timing[0] += nb_calls
+            timing[1] += duration
+
+
+def print_timings(timings):
+    """
+    Print the time spent parsing each report type, on each representation and on each metric, most expensive first.
+
+    :param timings: dictionary organized as timings[kind][name] = [nb_calls, seconds]
+    :return: void
+    """
+    for kind in ['parsing', 'features', 'metrics']:
+        print("[INFO] Time spent on the {}:".format(kind))
+        for name, (nb_calls, duration) in sorted(timings.get(kind, {}).items(), key=lambda x: -x[1][1]):
+            print("{:<25} {:>10,} calls {:>12.2f} s {:>10.2f} ms/call"
+                  .format(name, nb_calls, duration, 1000*duration/max(nb_calls, 1)))
+
 
 def check_output(output, boundaries, s):
     assert boundaries[1] > boundaries[0]
@@ -28,60 +193,140 @@ def check_output(output, boundaries, s):
     return output
 
 
+def init_worker(s, lm_dictionary):
+    """
+    Pool initializer. Stores the settings and the sentiment dictionary once per worker, so that the tasks only carry
+    a CIK and its paths. Also turns the garbage collector back on, the parent disables it before forking.
+
+    :param s: Settings dictionary. A plain dict, the read only version cannot be pickled.
+    :param lm_dictionary: Sentiment analysis dictionary
+    :return: void
+    """
+    _worker_context['s'] = s
+    _worker_context['lm_dictionary'] = lm_dictionary
+    gc.enable()
+
+
+def report_metadata(path_report):
+    """
+    Read the qtr, publication date and type of a report from its path.
+
+    :param path_report: path to a stage 1 file, ex: .../2016/QTR3/20160815_10-Q_edgar_data_...txt
+    :return: qtr, published, type_report
+    """
+    split_path = path_report.split('/')
+    qtr = (int(split_path[-3]), int(split_path[-2][3]))  # Ex: (2016, 3)
+    published = datetime.strptime(split_path[-1].split('_')[0], '%Y%m%d').date()
+    type_report = split_path[-1].split('_')[1]
+    return qtr, published, type_report
+
+
+def load_report(cik, path_report, stg2parser, index, s, features):
+    """
+    Parse a report - or find where its sections are in the section index.
+
+    :param cik: CIK
+    :param path_report: path to the stage 1 file
+    :param stg2parser: stage_2_parser
+    :param index: section index of the CIK, updated in place
+    :param s: Settings dictionary
+    :param features: feature_cache of the CIK, used to record the parsing time
+    :return: parsed report (None if the parsing failed) and whether the index was updated
+    """
+    qtr, published, type_report = report_metadata(path_report)
+    parsed_report = dict()
+    parsed_report['0'] = {'type': type_report, 'published': published, 'qtr': qtr}
+    entry = parser.lookup_index(index, path_report, type_report, s)
+    if entry is not None:  # Parsed by a previous run, the file did not change since then
+        if entry['status'] != 'ok':
+            print("[WARNING] {} failed parsing".format(path_report))
+            return None, False
+        start = time.perf_counter()
+        parsed_report = parser.restore_report(parsed_report, path_report, entry, s)
+        features.add_timing('parsing', '{} (indexed)'.format(type_report), time.perf_counter() - start)
+        return parsed_report, False
+
+    if s.get('parse_mode', 'text') == 'mmap':  # Sections are only decoded when a metric needs them
+        text_report = parser.map_file(path_report)
+    else:
+        with open(path_report, errors='ignore') as f:
+            text_report = f.read()
+    parsed_report['input'] = text_report
+
+    """Attempt to parse the report"""
+    try:
+        parsed_report = stg2parser.parse(parsed_report)
+    except:  # There can be a lot of error types coming from down below...
+        # If it fails, we need to skip the whole CIK as it becomes a real mess otherwise.
+        print("[WARNING] {} failed parsing".format(path_report))
+        index[path_report] = parser.index_entry(path_report, type_report, stg2parser, s, 'failed')
+        parser.save_index(cik, index, s)
+        return None, False
+    features.add_timing('parsing', type_report, stg2parser.last_parse_time)
+    index[path_report] = parser.index_entry(path_report, type_report, stg2parser, s)
+    return parsed_report, True
+
+
 def process_cik(data, verbose=False):
     """
     Orchestrate the work to be done on a given CIK. There are a lot of intermediate steps, and this function will
     call a bunch of others from a variety of modules.
 
     :param data: Input parameters grouped in a list, just to avoid starmap calls, which I do not like.
-    :return: processed data for a CIK
+    Either (cik, paths) in a worker set up by init_worker, or (cik, paths, s, lm_dictionary).
+    :return: processed data for a CIK, status code and the time spent on each representation and metric
     """
     
     # 0. expand argument list
     cik = data[0]
     file_list = data[1]
-    s = data[2]
-    lm_dictionary = data[3]
+    if len(data) > 2:
+        s = data[2]
+        lm_dictionary = data[3]
+    else:
+        s = _worker_context['s']
+        lm_dictionary = _worker_context['lm_dictionary']
+    tokenization.shared_vocabulary.truncate()  # Only the seeded tokens are kept from the previous CIK
+    features = feature_cache(s, lm_dictionary)  # Each report is tokenized once, even if it takes part in two pairs
+    if s.get('stream_reports', False):  # Only lag + 1 reports in memory at once
+        quarterly_results = dict()
+        stream = stream_cik(cik, file_list, s, lm_dictionary, features, verbose)
+        while True:
+            try:
+                current_qtr, final_result = next(stream)
+            except StopIteration as status:
+                code = status.value
+                break
+            quarterly_results[current_qtr] = final_result
+        return cik, quarterly_results if code == 0 else {}, code, features.timings
     
-    # 1. Parse all reports
+    # 1. Parse all reports - or find where their sections are in the section index
     quarterly_submissions = {key: [] for key in s['list_qtr']}
+    qtr_paths = dict()  # Same organization, for the sketch store
     stg2parser = parser.stage_2_parser(s)
     file_list = sorted(file_list)
+    index = parser.load_index(cik, s)
+    index_updated = False
     
     for path_report in file_list:
         # print(path_report)
-        split_path = path_report.split('/')
-        qtr = (int(split_path[-3]), int(split_path[-2][3]))  # Ex: (2016, 3)
-
-        if qtr in quarterly_submissions.keys():
-            published = split_path[-1].split('_')[0]
-            published = datetime.strptime(published, '%Y%m%d').date()
-            type_report = split_path[-1].split('_')[1]
-            if type_report in s['report_type']:
-                with open(path_report, errors='ignore') as f:
-                    text_report = f.read()
-                parsed_report = dict()
-                parsed_report['0'] = {'type': type_report, 'published': published, 'qtr': qtr}
-                parsed_report['input'] = text_report
-                # print(path_report)
-                
-                """Attempt to parse the report"""
-                # parsed_report = stg2parser.parse(parsed_report)
-                try:
-                    parsed_report = stg2parser.parse(parsed_report)
-                except:  # There can be a lot of error types coming from down below...
-                    # If it fails, we need to skip the whole CIK as it becomes a real mess otherwise.
-                    print("[WARNING] {} failed parsing".format(path_report))
-                    return cik, {}, 1
-
-                quarterly_submissions[qtr].append(parsed_report)
+        qtr, _, type_report = report_metadata(path_report)
+        if qtr in quarterly_submissions.keys() and type_report in s['report_type']:
+            parsed_report, updated = load_report(cik, path_report, stg2parser, index, s, features)
+            if parsed_report is None:
+                return cik, {}, 1, features.timings
+            index_updated = index_updated or updated
+            quarterly_submissions[qtr].append(parsed_report)
+            qtr_paths.setdefault(qtr, []).append(path_report)
+    if index_updated:
+        parser.save_index(cik, index, s)
     
     
     #assert 0
     # Delete empty qtr - because not listed or delisted
     quarterly_submissions = {k: v for k, v in quarterly_submissions.items() if len(v) > 0}
     if len(quarterly_submissions) == 0:  # None of the reports were 10-Q or 10-K
-        return cik, {}, 2
+        return cik, {}, 2, features.timings
     idx_first_qtr = s['list_qtr'].index(sorted(list(quarterly_submissions.keys()))[0])
     idx_last_qtr = s['list_qtr'].index(sorted(list(quarterly_submissions.keys()))[-1])
 
@@ -98,10 +343,26 @@ def process_cik(data, verbose=False):
 
         print("[WARNING] Not enough valid reports for CIK {} in this time_range. Skipping.".format(cik))
         quarterly_results = {}  # This CIK will be easy to remove later on
-        return cik, {}, 3
+        return cik, {}, 3, features.timings
     
     quarterly_results = {key: 0 for key in s['list_qtr'][idx_first_qtr+s['lag']:idx_last_qtr+1]}  # Include last index
     assert idx_last_qtr >= idx_first_qtr+s['lag']
+
+    # Some metrics are calculated for all the pairs at once, before going through them one by one
+    pairs = []
+    for current_idx in range(idx_first_qtr+s['lag'], idx_last_qtr+1):
+        current_qtr = s['list_qtr'][current_idx]
+        previous_qtr = s['list_qtr'][current_idx - s['lag']]
+        if len(quarterly_submissions.get(current_qtr, [])) == 1 \
+                and len(quarterly_submissions.get(previous_qtr, [])) == 1:
+            pairs.append((current_qtr, previous_qtr))
+    precomputed = {current_qtr: {} for current_qtr, _ in pairs}
+    if s.get('tf_idf_scope', 'pair') == 'window' and set(sparse_metrics).intersection(s['metrics']):
+        # The TF/TF-IDF model is fitted once on the whole window of reports
+        merge_scores(precomputed, window_sparse_scores(quarterly_submissions, pairs, s))
+    if 'diff_minhash_jaccard' in s['metrics']:
+        merge_scores(precomputed, window_sketch_scores(cik, quarterly_submissions, qtr_paths, pairs, s)[0])
+
     for current_idx in range(idx_first_qtr+s['lag'], idx_last_qtr+1):
         previous_idx = current_idx - s['lag']
         current_qtr = s['list_qtr'][current_idx]
@@ -112,82 +373,271 @@ def process_cik(data, verbose=False):
             submissions_previous_qtr = quarterly_submissions[previous_qtr]
         except:
             print("This means that for a quarter, we only had an extra document not a real 10-X")
-            return cik, {}, 4
+            return cik, {}, 4, features.timings
         try:
             assert len(submissions_current_qtr) == 1
             assert len(submissions_previous_qtr) == 1
         except:
             print("Damn should not have crashed here...")
-            return cik, {}, 5
+            return cik, {}, 5, features.timings
         if verbose:
             print("[INFO] Comparing current qtr {} to qtr {} from {} quarter ago."
               .format(s['list_qtr'][current_idx], s['list_qtr'][previous_idx], s['lag']))
         
-        final_result = analyze_reports(submissions_current_qtr[0], submissions_previous_qtr[0], s, lm_dictionary)
+        final_result = analyze_reports(submissions_current_qtr[0], submissions_previous_qtr[0], s, lm_dictionary,
+                                       precomputed.get(current_qtr), features)
         quarterly_results[current_qtr] = final_result
-    return cik, quarterly_results, 0
+        features.release(previous_qtr)  # Was already compared as current, will not be needed again
+    return cik, quarterly_results, 0, features.timings
+
+
+def stream_cik(cik, file_list, s, lm_dictionary, features, verbose=False):
+    """
+    Walk the reports of a CIK in chronological order and compare each qtr to the one s['lag'] qtr before as soon as
+    both are parsed. Only the reports of the last lag + 1 qtr are kept, so the memory used does not depend on the
+    number of reports of the CIK. Same results and status codes as the batch mode of process_cik, except that the
+    window wide TF-IDF (s['tf_idf_scope'] == 'window') cannot be fitted: the IDF comes from each pair instead.
+
+    :param cik: CIK
+    :param file_list: paths to the stage 1 files of the CIK
+    :param s: Settings dictionary
+    :param lm_dictionary: Sentiment analysis dictionary
+    :param features: feature_cache of the CIK
+    :param verbose: print the pairs as they are compared
+    :return: generator of (current_qtr, result). Its return value (StopIteration.value) is the status code of
+    process_cik. The results yielded before a non zero code must be discarded, as the batch mode would.
+    """
+    # 1. Group the paths by qtr, without opening the files
+    qtr_paths = dict()
+    for path_report in sorted(file_list):
+        qtr, _, type_report = report_metadata(path_report)
+        if qtr in s['list_qtr'] and type_report in s['report_type']:
+            qtr_paths.setdefault(qtr, []).append(path_report)
+    if len(qtr_paths) == 0:  # None of the reports were 10-Q or 10-K
+        return 2
+    idx_first_qtr = s['list_qtr'].index(min(qtr_paths))
+    idx_last_qtr = s['list_qtr'].index(max(qtr_paths))
+
+    stg2parser = parser.stage_2_parser(s)
+    index = parser.load_index(cik, s)
+    index_updated = False
+    window = dict()  # qtr -> list of parsed reports, for the last lag + 1 qtr only
+    # The sketch store is read and written once per CIK, not once per pair
+    stored_sketches = sketches.load_sketches(cik, s) if 'diff_minhash_jaccard' in s['metrics'] else None
+    sketches_modified = False
+    code = 0
+    for current_idx in range(idx_first_qtr, idx_last_qtr+1):
+        # 2. Parse the reports of the qtr
+        current_qtr = s['list_qtr'][current_idx]
+        for path_report in qtr_paths.get(current_qtr, []):
+            parsed_report, updated = load_report(cik, path_report, stg2parser, index, s, features)
+            if parsed_report is None:
+                if sketches_modified:
+                    sketches.save_sketches(cik, stored_sketches, s)
+                return 1
+            index_updated = index_updated or updated
+            window.setdefault(current_qtr, []).append(parsed_report)
+        if len(window.get(current_qtr, [])) > 1:
+            print("[WARNING] {} reports were released in {}".format(len(window[current_qtr]), current_qtr))
+        if current_idx < idx_first_qtr + s['lag']:
+            continue  # Nothing to compare to yet
+
+        # 3. Compare it to the qtr lag before. If the CIK is already lost, its reports are still parsed for the index.
+        previous_qtr = s['list_qtr'][current_idx - s['lag']]
+        if code:
+            pass
+        elif current_qtr not in window or previous_qtr not in window:
+            print("This means that for a quarter, we only had an extra document not a real 10-X")
+            code = 4
+        elif len(window[current_qtr]) != 1 or len(window[previous_qtr]) != 1:
+            print("Damn should not have crashed here...")
+            code = 5
+        else:
+            if verbose:
+                print("[INFO] Comparing current qtr {} to qtr {} from {} quarter ago."
+                      .format(current_qtr, previous_qtr, s['lag']))
+            precomputed = dict()
+            if stored_sketches is not None:
+                scores, modified = window_sketch_scores(cik, window, qtr_paths, [(current_qtr, previous_qtr)], s,
+                                                        stored_sketches)
+                precomputed = scores[current_qtr]
+                sketches_modified = sketches_modified or modified
+            yield current_qtr, analyze_reports(window[current_qtr][0], window[previous_qtr][0], s, lm_dictionary,
+                                               precomputed, features)
+        window.pop(previous_qtr, None)  # Will not be needed again
+        features.release(previous_qtr)
+
+    if index_updated:
+        parser.save_index(cik, index, s)
+    if sketches_modified:
+        sketches.save_sketches(cik, stored_sketches, s)
+    if idx_last_qtr < idx_first_qtr + s['lag']:
+        print("[WARNING] Not enough valid reports for CIK {} in this time_range. Skipping.".format(cik))
+        return 3
+    return code
+
+
+def merge_scores(precomputed, scores):
+    """
+    Merge scores calculated for a whole window into the precomputed dictionary.
+
+    :param precomputed: dictionary organized as precomputed[current_qtr][section_current][metric] = score
+    :param scores: dictionary organized the same way
+    :return: void, precomputed is updated in place
+    """
+    for current_qtr in scores:
+        for section_current in scores[current_qtr]:
+            precomputed.setdefault(current_qtr, {}).setdefault(section_current, {}).update(
+                scores[current_qtr][section_current])
 
 
-def calculate_metrics(current_text, previous_text, s, lm_dictionary, verbose=False):
+def window_sketch_scores(cik, quarterly_submissions, qtr_paths, pairs, s, stored=None):
+    """
+    Estimate the Jaccard similarity of all the pairs of reports of a CIK with MinHash signatures. Each
+    (qtr, section) is tokenized and sketched once, or not at all if its signature was already in the sketch store and
+    the report did not change since then. The new signatures are persisted for the next runs.
+
+    :param cik: CIK
+    :param quarterly_submissions: dictionary of parsed reports, organized by qtr
+    :param qtr_paths: dictionary of the paths of these reports, organized by qtr
+    :param pairs: list of (current_qtr, previous_qtr) to compare
+    :param s: Settings dictionary
+    :param stored: sketch store of the CIK, see sketches.load_sketches. If given, it is updated in place and saving it
+    is left to the caller, ex: once per CIK in stream mode. Otherwise it is loaded and saved here.
+    :return: dictionary organized as result[current_qtr][section_current]['diff_minhash_jaccard'] = score, and
+    whether the store was modified
+    """
+    own_store = stored is None
+    if own_store:
+        stored = sketches.load_sketches(cik, s)
+    fingerprints = {qtr: sketches.report_fingerprint(qtr_paths[qtr][0], quarterly_submissions[qtr][0]['0']['type'], s)
+                    for qtr in set(q for pair in pairs for q in pair)}
+    modified = sketches.invalidate_sketches(stored, fingerprints)
+    sections = set()
+    for current_qtr, previous_qtr in pairs:
+        current = quarterly_submissions[current_qtr][0]
+        previous = quarterly_submissions[previous_qtr][0]
+        for section_current, section_previous in sections_to_compare(current, previous, s):
+            sections.add((section_current, section_previous))
+            for qtr, report, section in [(current_qtr, current, section_current),
+                                         (previous_qtr, previous, section_previous)]:
+                key = sketches.sketch_key(qtr, section)
+                if key not in stored:
+                    text = parser.section_text(report.get(section, "Nothing found for this section."))
+                    tokens = normalize_text(text, s.get('tokenizer', 'normal'), s['stop_words'], s['lemmatize'])
+                    stored[key] = sketches.minhash_signature(tokens, s.get('minhash_num_perm', 128))
+                    modified = True
+    if modified and own_store:
+        sketches.save_sketches(cik, stored, s)
+
+    # Only keep the pairs we were asked for - the store might know about more qtr
+    scores = sketches.lagged_scores(stored, sorted(sections), s)
+    result = {current_qtr: {} for current_qtr, _ in pairs}
+    for current_qtr, _ in pairs:
+        for section_current, score in scores.get(current_qtr, {}).items():
+            result[current_qtr][section_current] = {'diff_minhash_jaccard': score}
+    return result, modified
+
+
+def window_sparse_scores(quarterly_submissions, pairs, s):
     """
-    Calculate the metrics for a given pair of section text.
+    Calculate the sparse metrics (cosine TF and TF-IDF) for all the pairs of reports of a CIK at once. The vocabulary
+    and the IDF are fitted a single time on every section of the window, each section being kept as a sparse row.
+    The cosine of all the (current, previous) pairs then comes from one row-wise dot product.
+
+    :param quarterly_submissions: dictionary of parsed reports, organized by qtr
+    :param pairs: list of (current_qtr, previous_qtr) to compare
+    :param s: Settings dictionary
+    :return: dictionary organized as result[current_qtr][section_current][metric] = score
+    """
+    result = {current_qtr: {} for current_qtr, _ in pairs}
+    requested = [m for m in sparse_metrics if m in s['metrics']]
+    if len(pairs) == 0 or len(requested) == 0:
+        return result
+
+    # 1. Give each unique (qtr, section) a row in the corpus
+    corpus = []
+    rows = dict()
+    idx_current, idx_previous, destinations = [], [], []
+    for current_qtr, previous_qtr in pairs:
+        current = quarterly_submissions[current_qtr][0]
+        previous = quarterly_submissions[previous_qtr][0]
+        for section_current, section_previous in sections_to_compare(current, previous, s):
+            for key, report, section in [(current_qtr, current, section_current),
+                                         (previous_qtr, previous, section_previous)]:
+                if (key, section) not in rows:
+                    rows[(key, section)] = len(corpus)
+                    corpus.append(parser.section_text(report.get(section, "Nothing found for this section.")))
+            idx_current.append(rows[(current_qtr, section_current)])
+            idx_previous.append(rows[(previous_qtr, section_previous)])
+            destinations.append((current_qtr, section_current))
+            result[current_qtr][section_current] = dict()
+
+    # 2. Tokenize once, weight as many times as needed and compute all the cosines in a batch
+    sw = list(stop_words) if s['stop_words'] else None
+    counts = metrics.sk_count_matrix(corpus, sw)
+    for m in requested:
+        matrix = metrics.sk_weight_matrix(counts, sparse_metrics[m])
+        scores = metrics.batch_sk_cosine(matrix, idx_current, idx_previous)
+        for (current_qtr, section_current), score in zip(destinations, scores):
+            result[current_qtr][section_current][m] = float(score)
+    return result
+
+
+def calculate_metrics(current_text, previous_text, s, lm_dictionary, precomputed=None, verbose=False,
+                      features=None, keys=None):
+    """
+    Calculate the metrics for a given pair of section text. The representations needed by the metrics of
+    metric_registry are built first, each one a single time, then every metric runs on them.
 
     :param current_text: string of text (from the current qtr parsed report's section)
     :param previous_text: string of text (from the previous qtr parsed report's section)
     :param s: Settings dictionary
     :param lm_dictionary: Sentiment analysis dictionary
+    :param precomputed: (optional) dictionary of scores already calculated for this pair, by metric
+    :param features: (optional) feature_cache shared with the other pairs of the CIK
+    :param keys: (optional) ((current_qtr, section_current), (previous_qtr, section_previous)) under which the
+    sections are stored in features. Required if features is given.
     :return:
     """
     section_result = {m: 0 for m in s['metrics']}
-    sample = 200  # ARTIFICIAL cap on number of words
-
-    need_normalized_text = {'diff_jaccard', 'diff_gfg_editDistDP', 'diff_simple'}
-    need_raw_text = {'diff_sk_cosine_tf', 'diff_sk_cosine_tf_idf', 'sing_LoughranMcDonald'}
-    if need_normalized_text.intersection(s['metrics']):  # need_normalized_text specific stuff
-        p_current_text = normalize_text(current_text, rm_stop_words=s['stop_words'], lemmatize=s['lemmatize'])
-        p_previous_text = normalize_text(previous_text, rm_stop_words=s['stop_words'], lemmatize=s['lemmatize'])
-    if need_raw_text.intersection(s['metrics']):  # need_raw_text specific stuff
-        sw = stop_words if s['stop_words'] else None
-        # No lemmatization for TF and TF-IDF
-        
+    precomputed = precomputed if precomputed else {}
+    if features is None:  # Throwaway cache, only shared by the metrics of this pair
+        features = feature_cache(s, lm_dictionary)
+        keys = (('current', None), ('previous', None))
+
+    def current(name):
+        return features.get(*keys[0], current_text, name)
 
+    def previous(name):
+        return features.get(*keys[1], previous_text, name)
+
+    # 1. Build the representations of the sections once
     for m in s['metrics']:
-        # Should use a decorator here
-        if m in s['diff_metrics']:
-            if m == 'diff_jaccard':
-                section_result[m] = metrics.diff_jaccard(p_current_text, p_previous_text)
-            #elif m == 'diff_cosine_tf':
-                #section_result[m] = metrics.diff_cosine_tf(current_text, previous_text)
-            elif m == 'diff_sk_cosine_tf':
-                section_result[m] = metrics.diff_sk_cosine_tf(current_text, previous_text, sw)
-            elif m == 'diff_sk_cosine_tf_idf':
-                section_result[m] = metrics.diff_sk_cosine_tf_idf(current_text, previous_text, sw)
-            #elif m == 'diff_cosine_tf_idf':
-                #section_result[m] = metrics.diff_cosine_tf_idf(current_text, previous_text)
-            elif m == 'diff_gfg_editDistDP':
-                section_result[m] = metrics.diff_gfg_editDistDP(p_current_text[:sample], p_previous_text[:sample])
-                if sample < len(p_current_text) or sample < len(p_previous_text):
-                    if verbose:
-                        print("[WARNING] Text was cut. Current: {}/{} used | Previous: {}/{} used".format(sample, len(p_current_text), sample, len(p_previous_text)))
-            #elif m == 'diff_minEdit':
-                #section_result[m] = metrics.diff_minEdit(current_text[:sample], previous_text[:sample])
-            elif m == 'diff_simple':
-                section_result[m] = metrics.diff_simple(current_text[:sample], previous_text[:sample])
-            else:
-                raise ValueError('[ERROR] Requested diff method has not been implemented!')
-            
-            # Sanity check on the returned result.
-            section_result[m] = check_output(section_result[m], (0, 1), s)
-        elif m in s['sing_metrics']:
-            if m == 'sing_LoughranMcDonald':
-                section_result[m] = metrics.sing_sentiment(current_text, lm_dictionary)
-            else:
-                raise ValueError('[ERROR] Requested sing method has not been implemented!')
-            section_result[m] = check_output(section_result[m], (-1, 1), s)
+        if m not in metric_registry:
+            raise ValueError('[ERROR] Requested method {} has not been implemented!'.format(m))
+        if m not in precomputed:
+            for name in metric_registry[m]['current']:
+                current(name)
+            for name in metric_registry[m]['previous']:
+                previous(name)
+
+    # 2. Run the metrics on them
+    for m in s['metrics']:
+        if m in precomputed:
+            section_result[m] = precomputed[m]
         else:
-            raise ValueError('[ERROR] Method is not diff nor sing, what is it?')
-        
-        
+            start = time.perf_counter()
+            section_result[m] = metric_registry[m]['function'](current, previous, s)
+            features.add_timing('metrics', m, time.perf_counter() - start)
+        # Sanity check on the returned result.
+        section_result[m] = check_output(section_result[m], metric_registry[m]['bounds'], s)
+
+    if verbose and 'diff_gfg_editDistDP' in s['metrics'] and s.get('edit_distance_sample'):
+        sample_edit = s['edit_distance_sample']
+        if sample_edit < len(current('ids')) or sample_edit < len(previous('ids')):
+            print("[WARNING] Text was cut. Current: {}/{} used | Previous: {}/{} used"
+                  .format(sample_edit, len(current('ids')), sample_edit, len(previous('ids'))))
     return section_result
 
 
@@ -248,20 +698,16 @@ def average_report_scores(result, word_count, s):
     return final_result
 
 
-def analyze_reports(current, previous, s, lm_dictionary):
+def sections_to_compare(current, previous, s):
     """
-    Calculate the difference between the two reports.
+    List the pairs of sections to compare between two reports, based on their type and the differentiation mode.
 
     :param current: dictionary containing the parsed current report + metadata
     :param previous: dictionary containing the parsed previous report + metadata
     :param s: Settings dictionary
-    :param lm_dictionary: Sentiment analysis dictionary
-    :return: dictionary containing the metadata and the score for each metric required
+    :return: list of (section_current, section_previous)
     """
-
-    # We need to calculate the same things at the same time for comparison purposes. 
-    word_count = dict()  # Counts the number of words in each section
-    if s['differentiation_mode'] == 'quarterly':  # Reports could be the same or different    
+    if s['differentiation_mode'] == 'quarterly':  # Reports could be the same or different
         assert current['0']['type'] != '10-K' or previous['0']['type'] != '10-K'
         sections_current = s['common_quarterly_sections'][current['0']['type']]
         sections_previous = s['common_quarterly_sections'][previous['0']['type']]
@@ -271,10 +717,28 @@ def analyze_reports(current, previous, s, lm_dictionary):
         sections_previous = s['common_yearly_sections'][previous['0']['type']]
     else:
         raise ValueError('[ERROR] This differentiation mode is unknown!')
-        
-    sections_to_consider = zip(sections_current, sections_previous)
+    return list(zip(sections_current, sections_previous))
+
+
+def analyze_reports(current, previous, s, lm_dictionary, precomputed=None, features=None):
+    """
+    Calculate the difference between the two reports.
+
+    :param current: dictionary containing the parsed current report + metadata
+    :param previous: dictionary containing the parsed previous report + metadata
+    :param s: Settings dictionary
+    :param lm_dictionary: Sentiment analysis dictionary
+    :param precomputed: (optional) scores already calculated for this pair, organized by section then metric
+    :param features: (optional) feature_cache shared by all the pairs of the CIK
+    :return: dictionary containing the metadata and the score for each metric required
+    """
+
+    # We need to calculate the same things at the same time for comparison purposes. 
+    word_count = dict()  # Counts the number of words in each section
+    sections_to_consider = sections_to_compare(current, previous, s)
+    precomputed = precomputed if precomputed else {}
     
-    result = {section: {} for section in sections_current}  # current report notation
+    result = {section: {} for section, _ in sections_to_consider}  # current report notation
     
     #for idx in range(len(sections_to_consider)):            
     for section_current, section_previous in sections_to_consider:
@@ -288,10 +752,14 @@ def analyze_reports(current, previous, s, lm_dictionary):
             .format(section_previous, current['0']['type'], current['0']['published']))
             previous[section_previous] = "Nothing found for this section."
         
-        current_text, previous_text = current[section_current], previous[section_previous]
+        # Memory mapped reports are only decoded here, one pair of sections at a time
+        current_text = parser.section_text(current[section_current])
+        previous_text = parser.section_text(previous[section_previous])
         
         word_count[section_current] = [len(current_text.split()), len(previous_text.split())]
-        result[section_current] = calculate_metrics(current_text, previous_text, s, lm_dictionary)
+        keys = ((current['0']['qtr'], section_current), (previous['0']['qtr'], section_previous))
+        result[section_current] = calculate_metrics(current_text, previous_text, s, lm_dictionary,
+                                                    precomputed.get(section_current), features=features, keys=keys)
         """
         try:
             #current_text, previous_text = current[section], previous[section]
@@ -387,19 +855,14 @@ def normalize_text(text, tokenizer='normal', rm_stop_words=False, lemmatize=Fals
     - (optional) lemmatize
 
     :param text: long string of text coming from a report's section
+    :param tokenizer: see tokenization.split_text
     :param rm_stop_words: Activate stop words removal
     :param lemmatize: Activate lemmatization
     :return: list
     """
     
     # 1. Basic processing
-    if tokenizer == 'normal':
-        word_tokens = word_tokenize(text)
-    elif tokenizer == 'regex':
-        word_tokens = regexp_tokenize(text, "[\w']+")
-    else:
-        raise ValueError('[ERROR] Tokenizer type {} is not implemented'.format(tokenizer))
-    word_tokens = [word.lower() for word in word_tokens]
+    word_tokens = tokenization.split_text(text, tokenizer)
     
     # 2. Advanced filtration: steps are independants.
     if rm_stop_words:
@@ -0,0 +1,116 @@
+"""
+Plan the per CIK work and report how well the workers were used.
+
+The CIKs are dispatched longest processing time first: a few mega-filers started last would otherwise keep a single
+core busy long after all the others are idle. The cost of a CIK is estimated from the size of its stage 1 files and
+the complexity of the requested metrics (see processing.metric_registry).
+"""
+
+import os
+import time
+import numpy as np
+from secScraper import processing
+
+
+_reference_size = 2**20  # Bytes. Normalizes the cost of the metrics that are not linear in the size of the sections
+
+
+def estimate_cost(paths, s, sizes=None):
+    """
+    Estimate the relative cost of processing a CIK. Each file is read and parsed once, then compared by every metric.
+
+    :param paths: list of paths to the stage 1 files of the CIK
+    :param s: Settings dictionary
+    :param sizes: (optional) dictionary {path: size in bytes}, ex: from manifest.file_sizes. Other files are stat'ed.
+    :return: float, arbitrary unit
+    """
+    sizes = sizes if sizes is not None else {}
+    cost = 0
+    for path in paths:
+        try:
+            size = sizes[path] if path in sizes else os.path.getsize(path)
+        except OSError:  # Missing file, process_cik will deal with it
+            continue
+        cost += size  # Reading and parsing
+        for m in s['metrics']:
+            complexity = processing.metric_registry.get(m, {}).get('complexity', 1)
+            if m == 'diff_gfg_editDistDP' and s.get('edit_distance_sample'):
+                complexity = 1  # Capped number of words
+            cost += _reference_size * (size / _reference_size)**complexity
+    return cost
+
+
+def lpt_order(cik_path, s, sizes=None):
+    """
+    Sort the CIKs by decreasing estimated cost.
+
+    :param cik_path: dictionary {cik: list of paths}
+    :param s: Settings dictionary
+    :param sizes: (optional) dictionary {path: size in bytes}, see estimate_cost
+    :return: list of CIK, most expensive first, and dictionary {cik: cost}
+    """
+    costs = {cik: estimate_cost(paths, s, sizes) for cik, paths in cik_path.items()}
+    return sorted(costs, key=lambda cik: -costs[cik]), costs
+
+
+def timed_process_cik(data):
+    """
+    Run processing.process_cik and record when and where it ran. Meant to be mapped over by a pool.
+
+    :param data: see processing.process_cik
+    :return: value returned by process_cik and a record (cik, pid, start, stop). start and stop come from time.time()
+    so they can be compared across processes.
+    """
+    start = time.time()
+    value = processing.process_cik(data)
+    return value, (value[0], os.getpid(), start, time.time())
+
+
+def first_idle_time(records, nb_workers, start):
+    """
+    Find when the first worker ran out of work: the first task to finish after the last one was handed out. It does
+    not depend on the pid of the workers, which change when they are recycled or replaced.
+
+    :param records: list of (cik, pid, start, stop), see timed_process_cik
+    :param nb_workers: number of workers in the pool
+    :param start: time.time() when the pool started
+    :return: time.time() of the first idle worker. start if there were fewer tasks than workers.
+    """
+    if len(records) < nb_workers:
+        return start
+    last_start = max(record[2] for record in records)
+    return min((record[3] for record in records if record[3] > last_start), default=last_start)
+
+
+def print_schedule_report(records, nb_workers, start, stop):
+    """
+    Print the utilization of each worker and the latency of the tasks. The tail is the time between the first worker
+    running out of work and the end of the run: that is the time lost to the slowest CIKs.
+
+    :param records: list of (cik, pid, start, stop), see timed_process_cik
+    :param nb_workers: number of workers in the pool
+    :param start: time.time() when the pool started
+    :param stop: time.time() when the last result came back
+    :return: void
+    """
+    if len(records) == 0:
+        return
+    wall_clock = max(stop - start, 1e-9)
+    busy = dict()  # pid -> [nb tasks, busy seconds]
+    for cik, pid, task_start, task_stop in records:
+        worker = busy.setdefault(pid, [0, 0.])
+        worker[0] += 1
+        worker[1] += task_stop - task_start
+    durations = np.array([task_stop - task_start for _, _, task_start, task_stop in records])
+    first_idle = first_idle_time(records, nb_workers, start)
+
+    print("[INFO] {:,} CIK processed by {} workers in {:.1f} s".format(len(records), len(busy), wall_clock))
+    for pid, (nb_tasks, busy_time) in sorted(busy.items()):
+        print("Worker {:>7} {:>7,} CIK {:>10.1f} s busy {:>6.1%}".format(pid, nb_tasks, busy_time, busy_time/wall_clock))
+    print("[INFO] Overall utilization: {:.1%}".format(durations.sum()/(wall_clock*nb_workers)))
+    print("[INFO] Task latency: p50 {:.2f} s | p90 {:.2f} s | p99 {:.2f} s | max {:.2f} s"
+          .format(*np.percentile(durations, [50, 90, 99]), durations.max()))
+    print("[INFO] Tail: {:.1f} s ({:.1%} of the run) between the first idle worker and the end"
+          .format(stop - first_idle, (stop - first_idle)/wall_clock))
+    slowest = sorted(records, key=lambda record: record[2] - record[3])[:5]
+    print("[INFO] Slowest CIK:", ", ".join("{} ({:.1f} s)".format(r[0], r[3] - r[2]) for r in slowest))
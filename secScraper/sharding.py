@@ -0,0 +1,163 @@
+"""
+Split the processing stage over several machines without a cluster manager.
+
+Each machine runs main_new_scores.py with --shard i/N and the same stage 1 data. The CIKs are spread over the N
+shards by estimated cost, in an order that only depends on the CIKs and the size of their files, so every machine
+computes the same split. A shard writes its results (in the journal format, see journal.py) and a json manifest with
+the settings hash, its CIKs and their status codes. Once all the shard files are gathered in a folder:
+python -m secScraper.sharding <folder> <path_journal>
+validates them and merges them into the result journal of these settings, which main_new_scores.py --resume reloads.
+"""
+
+import os
+import json
+import argparse
+from secScraper import distributed
+from secScraper import journal
+
+
+def parse_shard(text):
+    """
+    Read a shard given on the command line.
+
+    :param text: str, ex: '2/4' for the second of four shards
+    :return: tuple (i, N), i starting at 1
+    """
+    i, n = (int(x) for x in text.split('/'))
+    if not 1 <= i <= n:
+        raise ValueError('[ERROR] Invalid shard {}, expected i/N with 1 <= i <= N'.format(text))
+    return i, n
+
+
+def shard_ciks(cik_path, s, shard):
+    """
+    Deterministic, cost balanced subset of the CIKs for a shard.
+
+    :param cik_path: dictionary {cik: list of paths}, as returned by pre_processing.load_cik_path
+    :param s: Settings dictionary
+    :param shard: (i, N)
+    :return: list of CIK, most expensive first
+    """
+    i, n = shard
+    ordered = {cik: sorted(cik_path[cik]) for cik in sorted(cik_path)}  # Ties are broken the same way on every machine
+    return distributed.partition_ciks(ordered, s, n)[i-1]
+
+
+def shard_name(shard):
+    """
+    Base name of the result file and manifest of a shard.
+
+    :param shard: (i, N)
+    :return: str
+    """
+    return 'shard-{:03d}-of-{:03d}'.format(*shard)
+
+
+def journal_settings(s, shard):
+    """
+    Settings under which a shard journals its results: each shard has its own journal, so that shards running on the
+    same machine or sharing s['path_journal'] do not overwrite each other's records.
+
+    :param s: Settings dictionary
+    :param shard: (i, N)
+    :return: dict
+    """
+    return {**s, 'path_journal': os.path.join(s['path_journal'], shard_name(shard))} if s.get('path_journal') else {**s}
+
+
+def write_shard(folder, s, shard, ciks, results):
+    """
+    Write the results of a shard and its manifest.
+
+    :param folder: output folder, shared by all the shards or not
+    :param s: Settings dictionary
+    :param shard: (i, N)
+    :param ciks: CIKs of the shard, see shard_ciks
+    :param results: dict {cik: (quarterly_results, status code)}, ex: as returned by journal.load_journal
+    :return: path to the manifest
+    """
+    os.makedirs(folder, exist_ok=True)
+    missing = [cik for cik in ciks if cik not in results]
+    path_results = os.path.join(folder, shard_name(shard) + '.bin')
+    with open(path_results, 'wb') as f:
+        journal.write_records(f, {cik: results[cik] for cik in ciks if cik in results})
+    manifest = {
+        'settings_hash': journal.settings_hash(s),
+        'shard': list(shard),
+        'status': {str(cik): results[cik][1] for cik in ciks if cik in results},
+        'missing': [str(cik) for cik in missing],
+        'results': os.path.basename(path_results)
+    }
+    path_manifest = os.path.join(folder, shard_name(shard) + '.json')
+    with open(path_manifest, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print("[INFO] Shard {}/{}: {:,} CIK written to {} ({:,} missing)"
+          .format(*shard, len(manifest['status']), path_results, len(missing)))
+    return path_manifest
+
+
+def merge_shards(folder):
+    """
+    Validate the shards found in a folder and combine their results.
+
+    :param folder: folder containing the manifests and result files of all the shards
+    :return: dict {cik: (quarterly_results, status code)} and the settings hash of the shards
+    """
+    manifests = []
+    for name in sorted(os.listdir(folder)):
+        if name.startswith('shard-') and name.endswith('.json'):
+            with open(os.path.join(folder, name)) as f:
+                manifests.append(json.load(f))
+    if len(manifests) == 0:
+        raise ValueError('[ERROR] No shard manifest found in {}'.format(folder))
+
+    hashes = {m['settings_hash'] for m in manifests}
+    if len(hashes) != 1:
+        raise ValueError('[ERROR] The shards were run with different settings: {}'.format(sorted(hashes)))
+    nb_shards = {m['shard'][1] for m in manifests}
+    found = sorted(m['shard'][0] for m in manifests)
+    if len(nb_shards) != 1 or found != list(range(1, nb_shards.pop() + 1)):
+        raise ValueError('[ERROR] Incomplete set of shards: {}'.format([m['shard'] for m in manifests]))
+
+    results = dict()
+    for m in manifests:
+        if len(m['missing']):
+            raise ValueError('[ERROR] Shard {}/{} did not process {} CIK'.format(*m['shard'], len(m['missing'])))
+        nb_records = 0
+        for cik, quarterly_results, status in journal.iter_records(os.path.join(folder, m['results'])):
+            if cik in results:
+                raise ValueError('[ERROR] CIK {} was processed by several shards'.format(cik))
+            if m['status'].get(str(cik)) != status:
+                raise ValueError('[ERROR] Shard {}/{} does not match its manifest for CIK {}'
+                                 .format(*m['shard'], cik))
+            results[cik] = (quarterly_results, status)
+            nb_records += 1
+        if nb_records != len(m['status']):
+            raise ValueError('[ERROR] Shard {}/{} is truncated: {}/{} CIK'
+                             .format(*m['shard'], nb_records, len(m['status'])))
+    print("[INFO] Merged {} shards: {:,} CIK".format(len(manifests), len(results)))
+    return results, hashes.pop()
+
+
+def cik_scores_from_results(results):
+    """
+    Build the cik_scores dictionary expected by post_processing.create_metric_scores. The CIKs without scores
+    are dropped, as main_new_scores.py does.
+
+    :param results: dict {cik: (quarterly_results, status code)}
+    :return: dict {cik: quarterly_results}
+    """
+    return {cik: quarterly_results for cik, (quarterly_results, _) in results.items() if quarterly_results != {}}
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Merge the shards of a processing run into its result journal.")
+    ap.add_argument("folder", help="Folder containing the manifests and result files of all the shards.")
+    ap.add_argument("path_journal", help="Journal folder of the run, ex: s['path_journal'].")
+    args = ap.parse_args()
+    merged, merged_hash = merge_shards(args.folder)
+    os.makedirs(args.path_journal, exist_ok=True)
+    path = journal.journal_path({'path_journal': args.path_journal}, merged_hash)
+    with open(path, 'wb') as f:
+        journal.write_records(f, merged)
+    print("[INFO] Merged results written to {}. Run main_new_scores.py --resume to post-process them.".format(path))
@@ -0,0 +1,236 @@
+"""
+MinHash sketches of the sections, used to estimate the Jaccard similarity without keeping the sets of tokens around.
+
+A signature is made of num_perm uint64 values: for each of the num_perm hash functions, the smallest hash found among
+the unique tokens of the section. Two sections have the same minimum for a given hash function with a probability
+equal to their Jaccard similarity J, so the fraction of equal values in two signatures is an unbiased estimator of J.
+Its standard error is sqrt(J*(1-J)/num_perm), which is at most 1/(2*sqrt(num_perm)):
+- num_perm = 64: +/- 0.063
+- num_perm = 128: +/- 0.044
+- num_perm = 256: +/- 0.031
+Signatures are computed once per (CIK, qtr, section) and persisted, so they can be compared for any lag (1 for the
+quarterly mode, 4 for the yearly mode) without going back to the text. Each qtr of the store also holds the fingerprint
+of the report its signatures come from, so they are recomputed when the file or the parser changes.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from secScraper import parser
+
+
+_max_uint64 = np.iinfo(np.uint64).max
+_chunk_size = 4096  # Number of tokens hashed at once, bounds the size of the (tokens x num_perm) temporary array
+
+
+def _token_hashes(tokens):
+    """
+    Hash the unique tokens to 64 bits. blake2b is used rather than hash() as the latter is salted differently in each
+    process, which would make the signatures impossible to share between workers and runs.
+
+    :param tokens: iterable of str
+    :return: numpy array of uint64, one per unique token
+    """
+    unique_tokens = set(tokens)
+    hashes = np.empty(len(unique_tokens), dtype=np.uint64)
+    for idx, token in enumerate(unique_tokens):
+        hashes[idx] = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+    return hashes
+
+
+def _seeds(num_perm, seed=1):
+    """
+    Generate the seeds of the num_perm hash functions. Deterministic for a given seed.
+
+    :param num_perm: number of hash functions
+    :param seed: seed of the random generator
+    :return: numpy array of uint64
+    """
+    return np.random.RandomState(seed).randint(0, 2**63 - 1, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+
+def _mix(x):
+    """
+    splitmix64 finalizer. It is a bijection on 64 bits, so each seed gives a different permutation of the hash space.
+
+    :param x: numpy array of uint64
+    :return: numpy array of uint64
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def minhash_signature(tokens, num_perm=128, seed=1):
+    """
+    Calculate the MinHash signature of a list of tokens.
+
+    :param tokens: list of str, most likely coming from processing.normalize_text
+    :param num_perm: number of hash functions, see the module docstring for the error bound
+    :param seed: seed used to generate the hash functions. Signatures are only comparable for the same seed.
+    :return: numpy array of num_perm uint64
+    """
+    hashes = _token_hashes(tokens)
+    seeds = _seeds(num_perm, seed)
+    signature = np.full(num_perm, _max_uint64, dtype=np.uint64)
+    with np.errstate(over='ignore'):  # Multiplications are meant to wrap around
+        for start in range(0, len(hashes), _chunk_size):
+            chunk = hashes[start:start+_chunk_size]
+            permuted = _mix(chunk[:, None] ^ seeds[None, :])
+            signature = np.minimum(signature, permuted.min(axis=0))
+    return signature
+
+
+def jaccard_from_signatures(signatures_current, signatures_previous):
+    """
+    Estimate the Jaccard similarity of many pairs of signatures at once.
+
+    :param signatures_current: numpy array (nb_pairs, num_perm) or a single signature
+    :param signatures_previous: numpy array of the same shape
+    :return: numpy array of floats in the [0, 1] interval, or a float for a single pair
+    """
+    signatures_current = np.asarray(signatures_current)
+    signatures_previous = np.asarray(signatures_previous)
+    assert signatures_current.shape == signatures_previous.shape
+    return (signatures_current == signatures_previous).mean(axis=-1)
+
+
+def sketch_key(qtr, section):
+    """
+    Name under which the signature of a section is stored.
+
+    :param qtr: qtr of the report
+    :param section: section of the report
+    :return: str
+    """
+    return '{}_{}_{}'.format(qtr[0], qtr[1], section)
+
+
+def fingerprint_key(qtr):
+    """
+    Name under which the fingerprint of the report of a qtr is stored.
+
+    :param qtr: qtr of the report
+    :return: str
+    """
+    return '{}_{}_fingerprint'.format(qtr[0], qtr[1])
+
+
+def report_fingerprint(path, report_type, s):
+    """
+    Fingerprint of everything the signatures of a report depend on, besides the normalization settings that are in
+    the name of the store: the file (size and modification time), parser.grammar_version and the sections that were
+    requested. The sections that are not found are sketched from a placeholder text, so a new grammar that finds them
+    must invalidate these signatures as well.
+
+    :param path: path to the stage 1 file
+    :param report_type: '10-K' or '10-Q'
+    :param s: Settings dictionary
+    :return: numpy array of uint8
+    """
+    key = json.dumps(parser.index_key(path, report_type, s), sort_keys=True)
+    return np.frombuffer(hashlib.blake2b(key.encode(), digest_size=16).digest(), dtype=np.uint8)
+
+
+def invalidate_sketches(sketches, fingerprints):
+    """
+    Drop the signatures of the qtr whose report changed since they were computed, and record the new fingerprints.
+
+    :param sketches: dict {sketch_key: signature}, as returned by load_sketches. Updated in place.
+    :param fingerprints: dict {qtr: fingerprint}, see report_fingerprint
+    :return: bool, True if the store was modified
+    """
+    modified = False
+    for qtr, fingerprint in fingerprints.items():
+        key = fingerprint_key(qtr)
+        if key in sketches and np.array_equal(sketches[key], fingerprint):
+            continue
+        prefix = '{}_{}_'.format(qtr[0], qtr[1])
+        for k in [k for k in sketches if k.startswith(prefix)]:
+            del sketches[k]
+        sketches[key] = fingerprint
+        modified = True
+    return modified
+
+
+def store_path(cik, s):
+    """
+    Path of the file holding all the signatures of a CIK. The normalization settings and the number of permutations are
+    part of the name as the signatures depend on them.
+
+    :param cik: CIK
+    :param s: Settings dictionary
+    :return: str, or None if the store is disabled
+    """
+    if not s.get('path_sketch_store'):
+        return None
+    name = '{}_perm-{}_tok-{}_sw-{}_lem-{}.npz'.format(cik, s.get('minhash_num_perm', 128), s.get('tokenizer', 'normal'),
+                                                       int(s['stop_words']), int(s['lemmatize']))
+    return os.path.join(s['path_sketch_store'], name)
+
+
+def load_sketches(cik, s):
+    """
+    Load all the signatures already computed for a CIK.
+
+    :param cik: CIK
+    :param s: Settings dictionary
+    :return: dict {sketch_key: signature}. Empty if nothing was stored yet.
+    """
+    path = store_path(cik, s)
+    if path is None or not os.path.isfile(path):
+        return {}
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def save_sketches(cik, sketches, s):
+    """
+    Persist the signatures of a CIK. The file is written next to its final location then moved, so that a crash
+    never leaves a half written store behind.
+
+    :param cik: CIK
+    :param sketches: dict {sketch_key: signature}
+    :param s: Settings dictionary
+    :return: void
+    """
+    path = store_path(cik, s)
+    if path is None or len(sketches) == 0:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    path_temp = path + '.tmp.npz'  # np.savez appends .npz if it is missing
+    np.savez(path_temp, **sketches)
+    os.replace(path_temp, path)
+
+
+def lagged_scores(sketches, sections, s):
+    """
+    Estimate the Jaccard similarity between each qtr and the qtr s['lag'] before, straight from stored signatures.
+    Useful to re-run the comparison with a different lag without touching the text again.
+
+    :param sketches: dict {sketch_key: signature}, as returned by load_sketches
+    :param sections: list of (section_current, section_previous) to compare. Pairs without signatures are skipped, so
+    the pairs of all the report types can be passed at once.
+    :param s: Settings dictionary
+    :return: dict result[current_qtr][section_current] = score, for the qtr where both signatures exist
+    """
+    keys_current, keys_previous, destinations = [], [], []
+    for idx in range(s['lag'], len(s['list_qtr'])):
+        current_qtr, previous_qtr = s['list_qtr'][idx], s['list_qtr'][idx - s['lag']]
+        for section_current, section_previous in sections:
+            key_current = sketch_key(current_qtr, section_current)
+            key_previous = sketch_key(previous_qtr, section_previous)
+            if key_current in sketches and key_previous in sketches:
+                keys_current.append(key_current)
+                keys_previous.append(key_previous)
+                destinations.append((current_qtr, section_current))
+
+    result = dict()
+    if len(destinations) == 0:
+        return result
+    scores = jaccard_from_signatures(np.stack([sketches[k] for k in keys_current]),
+                                     np.stack([sketches[k] for k in keys_previous]))
+    for (current_qtr, section_current), score in zip(destinations, scores):
+        result.setdefault(current_qtr, {})[section_current] = float(score)
+    return result
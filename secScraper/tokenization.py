@@ -0,0 +1,188 @@
+"""
+Tokenization engine used to build the representations of the sections. Tokens are interned in a vocabulary and
+handled as int32 ids from then on:
+- the lemma of each id is computed once and memoized in a table, instead of calling the lemmatizer on every token
+- the stop words are removed with a boolean mask over the ids
+- sets, edit distances and sketches work on the ids
+
+The vocabulary grows while a CIK is processed, so the id of a token never changes within a CIK. Seed it in the main
+process with seed_vocabulary before starting the pool: the forked workers inherit that part read-only (copy on write)
+and only add the tokens they have never seen. The tokens added for a CIK are dropped before the next one (see
+truncate): ids are never compared across CIKs and a worker would otherwise keep every token - ex: every number - of
+every CIK it ever processed.
+"""
+
+import re
+import numpy as np
+from nltk.corpus import stopwords
+from nltk.tokenize import word_tokenize
+from nltk.stem import WordNetLemmatizer
+
+
+lemmatizer = WordNetLemmatizer()
+stop_words = set(stopwords.words('english'))
+
+# Fast path, close to word_tokenize: numbers keep their separators, contractions are split the Treebank way
+# (isn't -> is n't, I'm -> i 'm) and every punctuation sign is a token.
+_fast_pattern = re.compile(r"\d+(?:[.,]\d+)+|\w+(?=n't\b)|n't\b|'\w+|\w+|[^\w\s]")
+
+
+def split_text(text, tokenizer='normal'):
+    """
+    Split a string of text in lower case tokens.
+
+    :param text: long string of text coming from a report's section
+    :param tokenizer: 'normal' for nltk word_tokenize, 'fast' for the precompiled regex, 'regex' for [\\w']+
+    :return: list of str
+    """
+    if tokenizer == 'normal':
+        return [word.lower() for word in word_tokenize(text)]
+    elif tokenizer == 'fast':
+        return _fast_pattern.findall(text.lower())
+    elif tokenizer == 'regex':
+        return [word.lower() for word in re.findall(r"[\w']+", text)]
+    else:
+        raise ValueError('[ERROR] Tokenizer type {} is not implemented'.format(tokenizer))
+
+
+class vocabulary():
+    """
+    Token <-> int32 id table, with the memoized lemma and the stop word flag of each id.
+    """
+
+    def __init__(self):
+        self.ids = dict()  # token -> id
+        self.words = []  # id -> token
+        self._lemmas = np.full(1024, -1, dtype=np.int32)  # id -> id of its lemma, -1 until it is needed
+        self._stop = np.zeros(1024, dtype=bool)  # id -> is a stop word
+        self.seeded_size = 0  # Tokens kept by truncate, see seed_vocabulary
+
+    def __len__(self):
+        return len(self.words)
+
+    def _add(self, token):
+        """
+        Give an id to a new token.
+
+        :param token: str
+        :return: int
+        """
+        idx = len(self.words)
+        if idx == len(self._stop):  # Double the capacity of the tables
+            self._lemmas = np.concatenate([self._lemmas, np.full(idx, -1, dtype=np.int32)])
+            self._stop = np.concatenate([self._stop, np.zeros(idx, dtype=bool)])
+        self.ids[token] = idx
+        self.words.append(token)
+        self._stop[idx] = token in stop_words
+        return idx
+
+    def truncate(self, size=None):
+        """
+        Forget the tokens added after the first size ones. Their ids are given again to new tokens, so any id obtained
+        before is invalid from then on.
+
+        :param size: number of tokens to keep, self.seeded_size by default
+        :return: void
+        """
+        size = self.seeded_size if size is None else size
+        if size >= len(self.words):
+            return
+        for token in self.words[size:]:
+            del self.ids[token]
+        del self.words[size:]
+        capacity = max(1024, size)
+        self._lemmas = self._lemmas[:capacity].copy()  # Copies: the memory of the larger tables is released
+        self._stop = self._stop[:capacity].copy()
+        self._lemmas[size:] = -1
+        self._lemmas[self._lemmas >= size] = -1  # Kept tokens whose lemma was dropped
+
+    def encode(self, tokens):
+        """
+        Transform a list of tokens into ids, adding the unknown tokens to the vocabulary.
+
+        :param tokens: list of str
+        :return: numpy array of int32
+        """
+        get = self.ids.get
+        ids = [get(token, -1) for token in tokens]
+        for idx, token_id in enumerate(ids):
+            if token_id < 0:  # Rare once the vocabulary is warm. The token might have been added a few lines above.
+                token = tokens[idx]
+                ids[idx] = self.ids[token] if token in self.ids else self._add(token)
+        return np.array(ids, dtype=np.int32)
+
+    def decode(self, ids):
+        """
+        Transform ids back into tokens.
+
+        :param ids: iterable of int
+        :return: list of str
+        """
+        return [self.words[idx] for idx in ids]
+
+    def stop_mask(self, ids):
+        """
+        Flag the stop words.
+
+        :param ids: numpy array of int32
+        :return: numpy array of bool, True for the stop words
+        """
+        return self._stop[ids]
+
+    def lemmatize(self, ids):
+        """
+        Replace each id by the id of its lemma. The lemmatizer only runs on ids that were never lemmatized before.
+
+        :param ids: numpy array of int32
+        :return: numpy array of int32
+        """
+        unique_ids = np.unique(ids)
+        for idx in unique_ids[self._lemmas[unique_ids] < 0]:
+            lemma = lemmatizer.lemmatize(self.words[idx])
+            self._lemmas[idx] = self.ids[lemma] if lemma in self.ids else self._add(lemma)
+        return self._lemmas[ids]
+
+
+# Vocabulary of the process, see the module docstring
+shared_vocabulary = vocabulary()
+
+
+def seed_vocabulary(words, lemmatize=False, vocab=None):
+    """
+    Add a list of words to the vocabulary, typically the Loughran-McDonald dictionary. Meant to be called before the
+    workers are started so they all share these ids and lemmas.
+
+    :param words: iterable of str. They are lower cased.
+    :param lemmatize: Also fill the lemma table for these words
+    :param vocab: (optional) vocabulary to seed, shared_vocabulary by default
+    :return: void
+    """
+    vocab = shared_vocabulary if vocab is None else vocab
+    ids = vocab.encode(sorted(set(word.lower() for word in words) | stop_words))
+    if lemmatize:
+        vocab.lemmatize(ids)
+    vocab.seeded_size = len(vocab)
+    print("[INFO] Vocabulary seeded with {:,} tokens".format(len(vocab)))
+
+
+def tokenize(text, tokenizer='normal', rm_stop_words=False, lemmatize=False, vocab=None):
+    """
+    Transform a string of text into token ids. Same steps as processing.normalize_text:
+    - tokenization
+    - (optional) remove stop words
+    - (optional) lemmatize
+
+    :param text: long string of text coming from a report's section
+    :param tokenizer: see split_text
+    :param rm_stop_words: Activate stop words removal
+    :param lemmatize: Activate lemmatization
+    :param vocab: (optional) vocabulary to use, shared_vocabulary by default
+    :return: numpy array of int32
+    """
+    vocab = shared_vocabulary if vocab is None else vocab
+    ids = vocab.encode(split_text(text, tokenizer))
+    if rm_stop_words:
+        ids = ids[~vocab.stop_mask(ids)]
+    if lemmatize:
+        ids = vocab.lemmatize(ids)
+    return ids
@@ -0,0 +1,60 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from secScraper import crsp
+from secScraper import pre_processing
+
+
+class TestCrsp(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.s = {'path_stock_database': os.path.join(self.folder.name, 'crsp.csv'),
+                  'path_stock_cache': os.path.join(self.folder.name, 'cache/'),
+                  'time_range': [(2012, 1), (2012, 4)]}
+        lines = ['PERMNO,date,TICKER,ASK,SHROUT,RET']
+        for ticker, shares in [('AAA', 1000), ('NA', 2000), ('PNY', 1)]:
+            for day in ['20111230', '20120103', '20120104', '20120601', '20121130', '20121231']:
+                lines.append('1,{},{},{},{},0.01'.format(day, ticker, 10.5, shares))
+        lines.append('1,20120105,AAA,,1000,0.01')  # Incomplete
+        lines.append('1,20120105,,10,1000,0.01')  # Incomplete
+        lines.append('1,20121231,,10,1000,0.01')  # Incomplete, but out of range first
+        lines.append('1,20120104,AAA,11.0,1000,0.01')  # Duplicate, the last one wins
+        lines.append('1,20120601,BBB,1.25,3000,0.01')
+        with open(self.s['path_stock_database'], 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_line_chunks(self):
+        _, header_size = crsp.read_header(self.s['path_stock_database'])
+        chunks = crsp.line_chunks(self.s['path_stock_database'], 7, header_size)
+        with open(self.s['path_stock_database'], 'rb') as f:
+            data = f.read()
+        self.assertEqual(chunks[0][0], header_size)
+        self.assertEqual(chunks[-1][1], len(data))
+        for (_, stop), (start, _) in zip(chunks[:-1], chunks[1:]):
+            self.assertEqual(stop, start)
+            self.assertEqual(data[stop-1:stop], b'\n')
+
+    def test_same_as_csv(self):
+        expected = pre_processing.load_stock_data({**self.s, 'path_stock_cache': None}, penny_limit=1e5, verbose=False)
+        crsp.convert_crsp(self.s['path_stock_database'], self.s['path_stock_cache'], 2)
+        store = pre_processing.load_stock_data(self.s, penny_limit=1e5, verbose=False)
+        self.assertEqual(sorted(store.keys()), sorted(expected))
+        for ticker in expected:
+            self.assertEqual(store[ticker], {d: list(v) for d, v in expected[ticker].items()})
+        self.assertEqual(sorted(expected), ['AAA', 'BBB', 'NA'])
+        self.assertEqual(len(expected['AAA']), 4)  # 2011 and December (qtr 5 for load_stock_data) are out of range
+
+        columns = crsp.load_crsp_cache(self.s['path_stock_database'], self.s['path_stock_cache'], verbose=False)
+        self.assertIsInstance(columns['date'], np.memmap)
+        self.assertEqual(columns['stats'].tolist(), [23, 3])
+        _, stats = crsp.filter_prices(columns, self.s['time_range'], 1e5)
+        # Same counts as the csv loader: 7 lines out of range, then 2 incomplete ones
+        self.assertEqual((stats['nb_incomplete'], stats['nb_out_of_range'], stats['nb_penny']), (2, 7, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from secScraper import distributed
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cik_path = dict()
+        for cik, size in [(1, 1000), (2, 600), (3, 500), (4, 100)]:
+            path = os.path.join(self.folder.name, '{}.txt'.format(cik))
+            with open(path, 'w') as f:
+                f.write('a'*size)
+            self.cik_path[cik] = [path]
+        self.s = {'metrics': ['diff_jaccard'], 'list_qtr': [(2016, 1), (2016, 2)], 'report_type': ['10-K', '10-Q'],
+                  'path_partitioned_scores': os.path.join(self.folder.name, 'scores')}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_partition_ciks(self):
+        self.assertEqual(distributed.partition_ciks(self.cik_path, self.s, 2), [[1, 4], [2, 3]])
+
+    def test_process_partition(self):
+        os.makedirs(distributed.output_folder(self.s))
+        records = [(1, []), (2, [])]  # Nothing to parse
+        summary = list(distributed.process_partition(3, records, SimpleNamespace(value=self.s),
+                                                     SimpleNamespace(value=None)))
+        self.assertEqual([(cik, code) for cik, code, _ in summary], [(1, 2), (2, 2)])
+        self.assertEqual(list(distributed.iter_results(self.s)), [(1, {}, 2), (2, {}, 2)])
+
+    @unittest.skipUnless(shutil.which('java'), "Spark needs a java runtime")
+    def test_run_spark(self):
+        import pyspark
+        sc = pyspark.SparkContext('local[2]', 'test_distributed')
+        try:
+            cik_path = {cik: [] for cik in self.cik_path}
+            summary = distributed.run_spark(sc, cik_path, self.s, None, nb_partitions=2)
+        finally:
+            sc.stop()
+        self.assertEqual(sorted(cik for cik, _, _ in summary), [1, 2, 3, 4])
+        self.assertEqual(sorted(cik for cik, _, _ in distributed.iter_results(self.s)), [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from secScraper import incremental
+
+
+class TestIncremental(unittest.TestCase):
+    def test_qtr(self):
+        self.assertEqual(incremental.parse_qtr('2019q1'), (2019, 1))
+        self.assertEqual(incremental.lagged_qtr((2019, 1), 1), (2018, 4))
+        self.assertEqual(incremental.lagged_qtr((2019, 3), 4), (2018, 3))
+        with self.assertRaises(ValueError):
+            incremental.parse_qtr('2019Q5')
+
+    def test_new_filings(self):
+        s = {'lag': 1}
+        cik_path = {
+            1: ['data/2018/QTR3/20180815_10-Q_1.txt', 'data/2018/QTR4/20181115_10-Q_1.txt',
+                'data/2019/QTR1/20190215_10-K_1.txt'],
+            2: ['data/2018/QTR3/20180815_10-Q_2.txt', 'data/2018/QTR4/20181115_10-Q_2.txt']
+        }
+        self.assertEqual(incremental.new_filings(cik_path, (2019, 1), s),
+                         {1: ['data/2018/QTR4/20181115_10-Q_1.txt', 'data/2019/QTR1/20190215_10-K_1.txt']})
+
+    def test_merge_new_scores(self):
+        previous = {1: ({(2018, 4): 'a'}, 0), 2: ({}, 1), 3: ({}, 3)}
+        new = {1: ({(2019, 1): 'b'}, 0), 2: ({(2019, 1): 'c'}, 0), 3: ({(2019, 1): 'd'}, 0), 4: ({}, 3)}
+        merged = incremental.merge_new_scores(previous, new, (2019, 1))
+        self.assertEqual(merged[1], ({(2018, 4): 'a', (2019, 1): 'b'}, 0))
+        self.assertEqual(merged[2], ({}, 1))  # Discarded by the previous run
+        self.assertEqual(merged[3], ({(2019, 1): 'd'}, 0))  # First pair of that CIK
+        self.assertEqual(merged[4], ({}, 3))
+
+    def test_merge_new_failure(self):
+        previous = {1: ({(2018, 4): 'a'}, 0), 2: ({(2018, 4): 'b'}, 0), 3: ({(2018, 4): 'c'}, 0)}
+        new = {1: ({}, 5), 2: ({}, 6)}
+        merged = incremental.merge_new_scores(previous, new, (2019, 1), reviewed_ciks=[1, 2])
+        self.assertEqual(merged, {1: ({}, 5), 2: ({}, 6)})  # 3 was rejected by the review
+        self.assertEqual(incremental.dropped_ciks(previous, merged, (2019, 1)), [1, 2, 3])
+        previous[4] = ({}, 3)  # Never scored, nothing to remove from the earlier qtr
+        self.assertEqual(incremental.dropped_ciks(previous, {**merged, 3: previous[3]}, (2019, 1)), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
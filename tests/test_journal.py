@@ -0,0 +1,68 @@
+import unittest
+import os
+import tempfile
+from secScraper import journal, parser
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.s = {'path_journal': self.folder.name, 'metrics': ['diff_jaccard'], 'lag': 1, 'stop_words': False,
+                  'lemmatize': False}
+        self.results = [(1000, {(2012, 1): {'diff_jaccard': 0.5}}, 0, {}),
+                        (2000, {}, 1, {})]
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_append_and_resume(self):
+        f, previous = journal.open_journal(self.s)
+        self.assertEqual(previous, {})
+        for value in self.results:
+            journal.append_result(f, value)
+        f.close()
+
+        f, previous = journal.open_journal(self.s, resume=True)
+        f.close()
+        self.assertEqual(previous, {1000: ({(2012, 1): {'diff_jaccard': 0.5}}, 0), 2000: ({}, 1)})
+
+        # Other settings, other journal
+        self.s['lag'] = 4
+        self.assertEqual(journal.load_journal(self.s)[0], {})
+
+    def test_truncated_record(self):
+        f, _ = journal.open_journal(self.s)
+        for value in self.results:
+            journal.append_result(f, value)
+        f.close()
+        path = journal.journal_path(self.s)
+        os.truncate(path, os.path.getsize(path) - 3)  # The run died while writing the last record
+
+        f, previous = journal.open_journal(self.s, resume=True)
+        self.assertEqual(list(previous.keys()), [1000])
+        journal.append_result(f, self.results[1])
+        f.close()
+        self.assertEqual(list(journal.load_journal(self.s)[0].keys()), [1000, 2000])
+
+    def test_settings_hash(self):
+        path = os.path.join(self.folder.name, 'master_dictionary.csv')
+        with open(path, 'w') as f:
+            f.write('Word,Negative\nLOSS,2009\n')
+        s = {**self.s, 'path_master_dictionary': path}
+        reference = journal.settings_hash(s)
+        self.assertEqual(journal.settings_hash({**s, 'path_journal': 'elsewhere'}), reference)
+        with open(path, 'a') as f:
+            f.write('GAIN,0\n')
+        self.assertNotEqual(journal.settings_hash(s), reference)
+
+        reference = journal.settings_hash(s)
+        grammar_version = parser.grammar_version
+        parser.grammar_version += 1
+        try:
+            self.assertNotEqual(journal.settings_hash(s), reference)
+        finally:
+            parser.grammar_version = grammar_version
+
+
+if __name__ == '__main__':
+    unittest.main()
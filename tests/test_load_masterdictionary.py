@@ -0,0 +1,61 @@
+import unittest
+import os
+import pickle
+import tempfile
+import numpy as np
+from secScraper import Load_MasterDictionary, metrics
+
+
+class TestLoadMasterDictionary(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path_csv = os.path.join(self.folder.name, 'master_dictionary.csv')
+        self.path_cache = os.path.join(self.folder.name, 'cache')
+        with open(self.path_csv, 'w') as f:
+            f.write('Word,Sequence Number,Word Count,Word Proportion,Average Proportion,Std Dev,Doc Count,Negative,'
+                    'Positive,Uncertainty,Litigious,Constraining,Superfluous,Interesting,Modal,Irr_Verb,Harvard_IV,'
+                    'Syllables,Source\n')
+            f.write('A,1,100,0.01,0.02,0.03,10,0,0,0,0,0,0,0,0,0,0,1,12of12inf\n')
+            f.write('COULD,2,200,0.001,0.002,0.003,20,0,0,2009,0,0,0,0,3,0,0,1,12of12inf\n')
+            f.write('GAIN,3,300,0.0001,0.0002,0.0003,30,0,2009,0,0,0,0,0,0,0,0,1,12of12inf\n')
+            f.write('LOSS,4,400,1.5e-05,2.5e-05,3.5e-05,40,-2012,0,0,0,0,0,0,0,0,0,1,12of12inf\n')
+            f.write('WE,5,500,0.5,0.4,0.3,50,0,0,0,0,0,0,0,0,0,0,1,12of12inf\n')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_cache_same_lookup_api(self):
+        lm_dictionary = Load_MasterDictionary.load_masterdictionary(self.path_csv)
+        cache = Load_MasterDictionary.load_masterdictionary_cache(self.path_csv, self.path_cache)
+        self.assertEqual(len(cache), len(lm_dictionary))
+        self.assertEqual(set(cache.keys()), set(lm_dictionary.keys()))
+        for word in lm_dictionary:
+            self.assertEqual(vars(cache[word]), vars(lm_dictionary[word]))
+        self.assertNotIn('PROFIT', cache)
+
+    def test_cache_pickles_path_only(self):
+        cache = Load_MasterDictionary.load_masterdictionary_cache(self.path_csv, self.path_cache)
+        unpickled = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(unpickled.path_cache, self.path_cache)
+        self.assertEqual(vars(unpickled['LOSS']), vars(cache['LOSS']))
+
+    def test_cache_sentiment(self):
+        lm_dictionary = Load_MasterDictionary.load_masterdictionary(self.path_csv)
+        cache = Load_MasterDictionary.load_masterdictionary_cache(self.path_csv, self.path_cache)
+        text = "We could see a loss, we could see a gain."
+        self.assertEqual(metrics.sentiment_scores(text, cache), metrics.sentiment_scores(text, lm_dictionary))
+
+    def test_cache_rebuilt_if_incomplete(self):
+        Load_MasterDictionary.load_masterdictionary_cache(self.path_csv, self.path_cache)
+        os.remove(os.path.join(self.path_cache, 'negative.npy'))  # Ex: interrupted conversion
+        cache = Load_MasterDictionary.load_masterdictionary_cache(self.path_csv, self.path_cache)
+        self.assertEqual(cache['LOSS'].negative, -2012)
+
+    def test_sentiment_table_lengths(self):
+        words = sorted(['CAFÉ'.encode(), b'LOSS'])
+        table = Load_MasterDictionary.SentimentTable(np.array(words), [0, 0], [2, 1])
+        self.assertEqual(table.lengths.tolist(), [4, 4])  # Characters, not utf-8 bytes
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import os
+import tempfile
+from secScraper import manifest
+from secScraper import pre_processing
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.s = {'path_stage_1_data': os.path.join(self.folder.name, 'data/'),
+                  'path_manifest': os.path.join(self.folder.name, 'manifest.sqlite'),
+                  'report_type': ['10-K', '10-Q'], 'manifest_threads': 2}
+        self.add_filing(2012, 1, '20120215_10-K_edgar_data_1000_0000001000-12-000001.txt')
+        self.add_filing(2012, 1, '20120216_10-K_edgar_data_2000_0000002000-12-000001.txt')
+        self.add_filing(2012, 2, '20120515_10-Q_edgar_data_1000_0000001000-12-000002.txt')
+        self.add_filing(2012, 2, '20120515_8-K_edgar_data_1000_0000001000-12-000003.txt')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def add_filing(self, year, qtr, name, content='abc'):
+        folder = os.path.join(self.s['path_stage_1_data'], str(year), 'QTR{}'.format(qtr))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, name), 'w') as f:
+            f.write(content)
+        return os.path.join(folder, name)
+
+    def glob_cik_path(self):
+        s = {**self.s, 'path_manifest': None}
+        return {cik: sorted(paths) for cik, paths in pre_processing.load_cik_path(s).items()}
+
+    def test_same_as_glob(self):
+        cik_path = pre_processing.load_cik_path(self.s)
+        self.assertEqual(cik_path, self.glob_cik_path())
+        self.assertEqual(sorted(cik_path), [1000, 2000])
+
+        path = cik_path[1000][1]
+        self.assertEqual(manifest.file_sizes(self.s)[path], 3)
+        qtr, published, type_report = manifest.filing_metadata(self.s)[path]
+        self.assertEqual((qtr, published.isoformat(), type_report), ((2012, 2), '2012-05-15', '10-Q'))
+
+    def test_incremental_refresh(self):
+        manifest.refresh_manifest(self.s)
+        new_path = self.add_filing(2012, 2, '20120516_10-Q_edgar_data_2000_0000002000-12-000002.txt')
+        os.utime(os.path.dirname(new_path), ns=(0, 1))  # mtime_ns can be coarse, make sure it moves
+        scanned = []
+        scan_folder = manifest._scan_folder
+        manifest._scan_folder = lambda folder: scanned.append(folder) or scan_folder(folder)
+        try:
+            cik_path = pre_processing.load_cik_path(self.s)
+        finally:
+            manifest._scan_folder = scan_folder
+        self.assertEqual(scanned, [os.path.dirname(new_path)])  # QTR1 did not change
+        self.assertIn(new_path, cik_path[2000])
+        self.assertEqual(cik_path, self.glob_cik_path())
+
+    def test_removed_folder(self):
+        manifest.refresh_manifest(self.s)
+        folder = os.path.join(self.s['path_stage_1_data'], '2012', 'QTR2')
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+        self.assertEqual(pre_processing.load_cik_path(self.s), self.glob_cik_path())
+
+
+if __name__ == '__main__':
+    unittest.main()
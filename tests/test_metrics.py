@@ -1,5 +1,6 @@
 import unittest
-from secScraper import metrics, processing
+from collections import Counter
+from secScraper import metrics, processing, Load_MasterDictionary
 
 
 class TestMetrics(unittest.TestCase):
@@ -52,6 +53,68 @@ class TestMetrics(unittest.TestCase):
         test = metrics.diff_cosine_tf(da, dc)
         self.assertEqual(round(test, 2), 0.40)
 
+    def test_batch_sk_cosine_tf(self):
+        """
+        Test that the batched cosine TF matches the per pair version.
+
+        :return: bool
+        """
+        da = "We expect demand to increase."
+        db = "We expect worldwide demand to increase."
+        dc = "We expect weakness in sales."
+        counts = metrics.sk_count_matrix([da, db, dc], None)
+        matrix = metrics.sk_weight_matrix(counts, use_idf=False)
+        test = metrics.batch_sk_cosine(matrix, [0, 0], [1, 2])
+        self.assertAlmostEqual(test[0], metrics.diff_sk_cosine_tf(da, db, None))
+        self.assertAlmostEqual(test[1], metrics.diff_sk_cosine_tf(da, dc, None))
+
+    def test_counts_cosine(self):
+        """
+        Test that the cosines calculated from the term counts match sklearn.
+
+        :return: bool
+        """
+        da = "We expect demand to increase. Demand is strong."
+        db = "We expect worldwide demand to increase."
+        analyzer = metrics.sk_analyzer(None)
+        ca, cb = Counter(analyzer(da)), Counter(analyzer(db))
+        self.assertAlmostEqual(metrics.counts_cosine(ca, cb, False), metrics.diff_sk_cosine_tf(da, db, None))
+        self.assertAlmostEqual(metrics.counts_cosine(ca, cb, True), metrics.diff_sk_cosine_tf_idf(da, db, None))
+
+    def test_diff_gfg_editDistDP_high(self):
+        """
+        Test for the diff_gfg_editDistDP function.
+
+        :return: bool
+        """
+        da = processing.normalize_text("We expect demand to increase.")
+        db = processing.normalize_text("We expect worldwide demand to increase.")
+        test = metrics.diff_gfg_editDistDP(da, db)
+        self.assertEqual(round(test, 2), 0.92)
+
+    def test_diff_gfg_editDistDP_low(self):
+        """
+        Test for the diff_gfg_editDistDP function.
+
+        :return: bool
+        """
+        da = processing.normalize_text("We expect demand to increase.")
+        dc = processing.normalize_text("We expect weakness in sales.")
+        test = metrics.diff_gfg_editDistDP(da, dc)
+        self.assertEqual(round(test, 2), 0.75)
+
+    def test_edit_distance_ids(self):
+        """
+        Test for the bit-parallel edit distance engine, including a pattern longer than a machine word.
+
+        :return: bool
+        """
+        self.assertEqual(metrics.edit_distance_ids([1, 2, 3, 4], [1, 3, 4, 5]), 2)
+        self.assertEqual(metrics.edit_distance_ids([], [1, 2]), 2)
+        long_ids = list(range(100))
+        self.assertEqual(metrics.edit_distance_ids(long_ids, long_ids[:50] + [-1] + long_ids[51:]), 1)
+        self.assertGreater(metrics.edit_distance_ids(long_ids, list(range(100, 200)), max_distance=10), 10)
+
     def test_diff_minEdit_high(self):
         """
         Test for the diff_minEdit function.
@@ -98,6 +161,25 @@ class TestMetrics(unittest.TestCase):
 
 
 
+    def test_sentiment_scores(self):
+        """
+        Test that a single scan gives the composite index and every category.
+
+        :return: bool
+        """
+        columns = ['0'] * 19
+        lm_dictionary = dict()
+        for word, negative, positive, modal in [('EXPECT', 0, 0, 0), ('LOSS', 2009, 0, 0), ('GAIN', 0, 2009, 0),
+                                                ('COULD', 0, 0, 3)]:
+            columns[0], columns[7], columns[8], columns[14], columns[17] = word, str(negative), str(positive), str(modal), '1'
+            lm_dictionary[word] = Load_MasterDictionary.MasterDictionary(columns, [])
+        test = metrics.sentiment_scores("We expect a loss, we could expect a gain in 2019.", lm_dictionary)
+        self.assertAlmostEqual(test['sing_negative'], 1/5)
+        self.assertAlmostEqual(test['sing_positive'], 1/5)
+        self.assertAlmostEqual(test['sing_modal_weak'], 1/5)
+        self.assertEqual(test['sing_uncertainty'], 0)
+        self.assertEqual(test['sing_LoughranMcDonald'], 0)
+        self.assertEqual(metrics.sing_sentiment("We expect a loss.", lm_dictionary), -25)
 
 
 if __name__ == '__main__':
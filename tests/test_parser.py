@@ -1,4 +1,6 @@
 import unittest
+import os
+import tempfile
 from secScraper import parser
 
 
@@ -34,6 +36,64 @@ class TestParser(unittest.TestCase):
         test = parser.clean_first_markers(self.first_markers_dirty)
         self.assertEqual(test, self.first_markers_clean)
 
+    def test_grammar_pattern(self):
+        pattern, group_names = parser.grammar_pattern('10-Q')
+        self.assertIs(parser.grammar_pattern('10-Q')[0], pattern)  # Compiled once
+        text = "header\nitem 1a. risk factors blah\n item 1. legal proceedings   item 2- management s"
+        sections = [group_names[m.lastgroup] for m in pattern.finditer(text)]
+        self.assertEqual(sections, ['ii_1a', 'ii_1', '_i_2'])
+
+    def test_parse_10k(self):
+        s = {'sections_to_parse_10k': ['1a', '7']}
+        text = ("Header\nItem 1. Business\nItem 1A. Risk Factors\nItem 7. Management s\nItem 8. Financial\n"
+                "\nItem 1. Business we sell\nItem 1A. Risk Factors we may lose\nItem 7. Management s we did well"
+                "\nItem 8. Financial see below")
+        stg2parser = parser.stage_2_parser(s)
+        test = stg2parser.parse({'0': {'type': '10-K'}, 'input': text})
+        self.assertEqual(test['1a'], ' factors we may lose')  # The first word of the title is part of the match
+        self.assertEqual(test['7'], ' s we did well')
+        self.assertNotIn('input', test)
+        self.assertEqual(stg2parser.timings['10-K'][0], 1)
+
+    def test_parse_10k_mmap(self):
+        s = {'sections_to_parse_10k': ['1a', '7']}
+        text = ("Header\r\nItem 1. Business\r\nItem 1A. Risk Factors\r\nItem 7. Management s\r\nItem 8. Financial"
+                "\r\n\r\nItem 1. Business we sell\r\nItem 1A. Risk Factors WE MAY\r\nLOSE\r\nItem 7. Management s"
+                " we did well\r\nItem 8. Financial see below")
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'report.txt')
+            with open(path, 'w', newline='') as f:
+                f.write(text)
+            with open(path, errors='ignore') as f:
+                expected = parser.stage_2_parser(s).parse({'0': {'type': '10-K'}, 'input': f.read()})
+            test = parser.stage_2_parser(s).parse({'0': {'type': '10-K'}, 'input': parser.map_file(path)})
+            self.assertIsInstance(test['1a'], parser.section_view)
+            self.assertEqual(parser.section_text(test['1a']), ' factors we may\nlose')
+            self.assertEqual(parser.section_text(test['1a']), expected['1a'])
+            self.assertEqual(parser.section_text(test['7']), expected['7'])
+
+    def test_section_index(self):
+        text = ("Header\nItem 1. Business\nItem 1A. Risk Factors\nItem 7. Management s\nItem 8. Financial\n"
+                "\nItem 1. Business we sell\nItem 1A. Risk Factors we may lose\nItem 7. Management s we did well"
+                "\nItem 8. Financial see below")
+        with tempfile.TemporaryDirectory() as folder:
+            s = {'sections_to_parse_10k': ['1a', '3', '7'], 'path_section_index': os.path.join(folder, 'index')}
+            path = os.path.join(folder, 'report.txt')
+            with open(path, 'w') as f:
+                f.write(text)
+            stg2parser = parser.stage_2_parser(s)
+            expected = stg2parser.parse({'0': {'type': '10-K'}, 'input': text})
+            self.assertTrue(stg2parser.last_toc)
+            parser.save_index('1000', {path: parser.index_entry(path, '10-K', stg2parser, s)}, s)
+
+            index = parser.load_index('1000', s)
+            entry = parser.lookup_index(index, path, '10-K', s)
+            self.assertEqual(parser.restore_report({'0': {'type': '10-K'}}, path, entry, s), expected)
+            self.assertIsNone(parser.lookup_index(index, path, '10-K', {**s, 'sections_to_parse_10k': ['1a']}))
+            with open(path, 'a') as f:
+                f.write('\nItem 9. Changes')
+            self.assertIsNone(parser.lookup_index(index, path, '10-K', s))  # The file changed
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import tempfile
+from secScraper import pipeline, processing
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.s = {'list_qtr': [(2016, 1), (2016, 2)], 'report_type': ['10-K', '10-Q']}
+
+    def test_run_pipeline(self):
+        data_to_process = ((cik, []) for cik in range(20))  # Nothing to parse
+        results = list(pipeline.run_pipeline(data_to_process, self.s, None, 2, queue_size=1))
+        self.assertEqual(sorted(value[:3] for value, _ in results), [(cik, {}, 2) for cik in range(20)])
+        self.assertEqual(sorted(record[0] for _, record in results), list(range(20)))
+
+    def test_run_pipeline_error(self):
+        with self.assertRaises(RuntimeError):
+            list(pipeline.run_pipeline(iter([(1, None)]), self.s, None, 2))
+
+    def test_recycling(self):
+        monitor = pipeline.pipeline_monitor()
+        s = {**self.s, 'worker_max_tasks': 2}
+        results = list(pipeline.run_pipeline(((cik, []) for cik in range(6)), s, None, 2, monitor=monitor))
+        self.assertEqual(len(results), 6)
+        self.assertGreaterEqual(monitor.nb_recycled, 2)
+        self.assertEqual(sorted(cik for cik, _, _ in monitor.memory), list(range(6)))
+        self.assertTrue(all(peak > 0 for _, _, peak in monitor.memory))
+
+    def test_killed_worker(self):
+        process_cik = processing.process_cik
+        with tempfile.TemporaryDirectory() as folder:
+            def fragile_process_cik(data, verbose=False):
+                marker = os.path.join(folder, str(data[0]))
+                if data[0] == 2 or (data[0] == 1 and not os.path.exists(marker)):
+                    open(marker, 'w').close()
+                    os._exit(1)  # Killed in the middle of the CIK
+                return process_cik(data, verbose)
+            processing.process_cik = fragile_process_cik  # Inherited by the forked workers
+            try:
+                monitor = pipeline.pipeline_monitor()
+                results = list(pipeline.run_pipeline(((cik, []) for cik in range(4)), self.s, None, 2,
+                                                     monitor=monitor))
+            finally:
+                processing.process_cik = process_cik
+        codes = {value[0]: value[2] for value, _ in results}
+        self.assertEqual(codes, {0: 2, 1: 2, 2: pipeline.killed_code, 3: 2})  # 1 was re-queued, 2 given up
+        self.assertEqual(monitor.nb_requeued, 2)
+        self.assertEqual(monitor.nb_killed, 3)
+
+    def test_worker_died_idle(self):
+        init_worker = processing.init_worker
+        with tempfile.TemporaryDirectory() as folder:
+            def fragile_init_worker(s, lm_dictionary):
+                try:  # Only the first worker to get there, atomically
+                    os.close(os.open(os.path.join(folder, 'marker'), os.O_CREAT | os.O_EXCL))
+                except FileExistsError:
+                    return init_worker(s, lm_dictionary)
+                os._exit(1)  # Killed before it asked for a task
+            processing.init_worker = fragile_init_worker
+            try:
+                monitor = pipeline.pipeline_monitor()
+                results = list(pipeline.run_pipeline(((cik, []) for cik in range(4)), self.s, None, 2,
+                                                     monitor=monitor))
+            finally:
+                processing.init_worker = init_worker
+        self.assertEqual(sorted(value[:3] for value, _ in results), [(cik, {}, 2) for cik in range(4)])
+        self.assertEqual((monitor.nb_killed, monitor.nb_requeued), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
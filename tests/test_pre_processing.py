@@ -136,6 +136,18 @@ class TestPreprocessing(unittest.TestCase):
         test = pre_processing.check_report_continuity(self.list_qs[5][0], self.s)
         self.assertFalse(test, self.list_qs[5][1])
 
+    def test_review_publications(self):
+        qs7 = {**self.qs1, (2011, 2): [{'type': '10-K', 'published': (2011, 5, 6), 'qtr': (2011, 2)}]}
+        cik_path = dict()
+        for cik, qs in enumerate([qs for qs, _ in self.list_qs] + [qs7]):
+            cik_path[cik] = ['data/{}/QTR{}/{}{:02d}{:02d}_{}_edgar_data_{}_{}.txt'
+                             .format(*qtr, *report['published'], report['type'], cik, idx)
+                             for qtr in qs for idx, report in enumerate(qs[qtr])]
+        s = {**self.s, 'lag': 1, 'report_type': ['10-K', '10-Q']}
+        codes = pre_processing.review_publications(cik_path, s)
+        self.assertEqual(codes, {0: 0, 1: 0, 2: 0, 3: 5, 4: 3, 5: 1, 6: 4})
+        self.assertEqual(list(pre_processing.review_cik_publications(cik_path, s).keys()), [0, 1, 2])
+
 
 if __name__ == '__main__':
     unittest.main()
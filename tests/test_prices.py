@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from datetime import date, timedelta
+from secScraper import prices
+from secScraper import post_processing
+from secScraper import pre_processing
+
+
+class TestPrices(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        days = [date(2011, 12, 20) + timedelta(days=int(d)) for d in range(400)]
+        self.stock_data = dict()
+        for ticker in ['AAA', 'BBB', 'CCC']:
+            trading_days = [d for d in days if rng.rand() < 0.6]
+            self.stock_data[ticker] = {d: (float(rng.rand()*100), int(rng.rand()*1e12)) for d in trading_days}
+        self.stock_data['DDD'] = {date(2012, 4, 9): (10., 100000000)}  # 8 days after the start of the qtr
+        self.lookup = {1000: 'AAA', 2000: 'BBB', 3000: 'CCC', 4000: 'DDD', 5000: 'EEE'}
+        self.store = prices.price_store.from_dict(self.stock_data)
+
+    def test_get_share_price(self):
+        for cik in self.lookup:
+            for qtr in [(2012, 1), (2012, 2), (2012, 3), (2012, 4), (2013, 1)]:
+                result = post_processing.get_share_price(cik, qtr, self.lookup, self.store)
+                self.assertEqual(result, post_processing.get_share_price(cik, qtr, self.lookup, self.stock_data))
+                self.assertIsInstance(result[1], int)  # Copied to a bigint column
+
+    def test_entry_price_matrix(self):
+        list_qtr = [(2011, 4), (2012, 1), (2012, 2), (2012, 3), (2012, 4), (2013, 1)]
+        for stock_data in [self.stock_data, self.store]:
+            matrix = prices.entry_price_matrix(stock_data, self.lookup.values(), list_qtr)
+            for cik in self.lookup:
+                for qtr in list_qtr:
+                    result = post_processing.get_share_price(cik, qtr, self.lookup, matrix)
+                    expected = post_processing.get_share_price(cik, qtr, self.lookup, self.stock_data)
+                    self.assertEqual(result, expected)
+                    self.assertEqual([type(e) for e in result], [type(e) for e in expected])
+        self.assertEqual(matrix.found.shape, (5, 6))
+        self.assertFalse(matrix.found[matrix.tickers.index('DDD')].any())
+
+    def test_batch_asof(self):
+        tickers = np.array(['AAA', 'BBB', 'CCC', 'DDD', 'EEE']*50)
+        days = prices.to_days([date(2011, 12, 1) + timedelta(days=d) for d in range(len(tickers))])
+        values, found = self.store.batch_asof(tickers, days)
+        for ticker, day, value, flag in zip(tickers, days, values, found):
+            row = self.store.asof(ticker, day)
+            self.assertEqual(flag, row >= 0)
+            if flag:
+                self.assertEqual(value.tolist(), self.store.values[row].tolist())
+            else:
+                self.assertTrue(np.isnan(value).all())
+
+    def test_dict_interface(self):
+        self.assertEqual(sorted(self.store.keys()), sorted(self.stock_data))
+        self.assertEqual(self.store['AAA'], {d: list(v) for d, v in self.stock_data['AAA'].items()})
+        self.assertEqual(prices.yyyymmdd_to_days(np.array([20160815, 19691231])).tolist(),
+                         [prices.to_days(date(2016, 8, 15)), -1])
+
+        lookup, store = pre_processing.intersection_lookup_stock({1: 'AAA', 2: 'CCC', 3: 'ZZZ'}, self.store)
+        self.assertEqual(sorted(store.keys()), ['AAA', 'CCC'])
+        self.assertEqual(store['CCC'], self.store['CCC'])
+
+
+if __name__ == '__main__':
+    unittest.main()
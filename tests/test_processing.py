@@ -1,5 +1,7 @@
 import unittest
-from secScraper import processing
+import os
+import tempfile
+from secScraper import processing, sketches, tokenization
 
 
 class TestProcessing(unittest.TestCase):
@@ -21,6 +23,81 @@ class TestProcessing(unittest.TestCase):
                            'and', 'you', '?', 'that', 'is', "n't", 'clear', '.']
         self.assertEqual(test, expected_result)
 
+    def test_feature_cache(self):
+        features = processing.feature_cache({'stop_words': False, 'lemmatize': False}, None)
+        tokens = features.get((2016, 1), '7', self.input_text, 'tokens')
+        self.assertIs(features.get((2016, 1), '7', "Ignored on a hit", 'tokens'), tokens)
+        self.assertEqual(features.get((2016, 1), '7', self.input_text, 'set'), set(tokens.tolist()))
+        ids = features.get((2016, 2), '7', "Sir, how are you?", 'ids')
+        self.assertEqual(tokenization.shared_vocabulary.decode(ids), ['sir', ',', 'how', 'are', 'you', '?'])
+        features.release((2016, 1))
+        self.assertNotIn((2016, 1), features.features)
+
+    def test_calculate_metrics_registry(self):
+        s = {'metrics': ['diff_jaccard', 'diff_gfg_editDistDP'], 'stop_words': False, 'lemmatize': False,
+             'epsilon': 0.0001}
+        features = processing.feature_cache(s, None)
+        keys = (((2016, 2), '7'), ((2016, 1), '7'))
+        test = processing.calculate_metrics("We expect demand to increase.", "We expect demand to fall.", s, None,
+                                            features=features, keys=keys)
+        self.assertAlmostEqual(test['diff_jaccard'], 5/7)
+        self.assertAlmostEqual(test['diff_gfg_editDistDP'], 1 - 1/12)
+        self.assertEqual(features.timings['features']['tokens'][0], 2)  # Shared by both metrics
+        self.assertEqual(set(features.timings['metrics']), set(s['metrics']))
+        with self.assertRaises(ValueError):
+            processing.calculate_metrics("a", "b", {**s, 'metrics': ['diff_unknown']}, None)
+
+    def test_process_cik_worker_context(self):
+        s = {'list_qtr': [(2016, 1), (2016, 2)], 'report_type': ['10-K', '10-Q']}
+        processing.init_worker(s, None)
+        self.assertEqual(processing.process_cik(('1000', []))[:3], ('1000', {}, 2))  # Nothing to parse
+
+    def test_process_cik_stream(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = []
+            for qtr in [1, 2]:
+                os.makedirs(os.path.join(folder, '2016', 'QTR{}'.format(qtr)))
+                paths.append(os.path.join(folder, '2016', 'QTR{}'.format(qtr), '20160{}15_10-Q_1000.txt'.format(qtr*3)))
+                with open(paths[-1], 'w') as f:
+                    f.write("Not much of a 10-Q")
+            s = {'list_qtr': [(2016, 1), (2016, 2)], 'report_type': ['10-K', '10-Q'], 'lag': 1,
+                 'metrics': ['diff_jaccard'], 'stop_words': False, 'lemmatize': False, 'epsilon': 0.0001,
+                 'sections_to_parse_10k': [], 'sections_to_parse_10q': []}
+            for file_list in [paths, paths[:1]]:
+                batch = processing.process_cik(('1000', file_list, s, None))
+                stream = processing.process_cik(('1000', file_list, {**s, 'stream_reports': True}, None))
+                self.assertEqual(stream[:3], batch[:3])
+
+    def test_process_cik_stream_scores(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = []
+            for qtr, words in [(1, 'revenue increased'), (2, 'revenue decreased'), (3, 'litigation risk')]:
+                os.makedirs(os.path.join(folder, '2016', 'QTR{}'.format(qtr)))
+                paths.append(os.path.join(folder, '2016', 'QTR{}'.format(qtr), '20160{}15_10-Q_1000.txt'.format(qtr*3)))
+                with open(paths[-1], 'w') as f:
+                    f.write("part i\nitem 2. management discussion\nthe {0} this quarter as {0}.\n"
+                            "part ii\nitem 1a. risk factors\nno change since the {0}.\n".format(words))
+            s = {'list_qtr': [(2016, 1), (2016, 2), (2016, 3)], 'report_type': ['10-K', '10-Q'], 'lag': 1,
+                 'metrics': ['diff_jaccard', 'diff_minhash_jaccard'], 'stop_words': False, 'lemmatize': False,
+                 'epsilon': 0.0001, 'differentiation_mode': 'quarterly', 'sections_to_parse_10k': [],
+                 'sections_to_parse_10q': ['_i_2', 'ii_1a'], 'common_quarterly_sections': {'10-Q': ['_i_2', 'ii_1a']},
+                 'path_sketch_store': os.path.join(folder, 'sketches')}
+            batch = processing.process_cik(('1000', paths, s, None))
+            self.assertEqual(batch[2], 0)
+            self.assertEqual(sorted(batch[1]), [(2016, 2), (2016, 3)])
+            self.assertIn('diff_minhash_jaccard', batch[1][(2016, 3)]['_i_2'])
+
+            loaded = []
+            load_sketches = sketches.load_sketches
+            sketches.load_sketches = lambda cik, s: loaded.append(cik) or load_sketches(cik, s)
+            try:
+                for store in [None, os.path.join(folder, 'sketches_stream')]:
+                    stream = processing.process_cik(('1000', paths, {**s, 'stream_reports': True,
+                                                                     'path_sketch_store': store}, None))
+                    self.assertEqual(stream[:3], batch[:3])
+            finally:
+                sketches.load_sketches = load_sketches
+            self.assertEqual(loaded, ['1000', '1000'])  # Once per CIK, not once per pair
 
     def test_average_report_scores_10k(self):
         report_type = '10-K'
@@ -0,0 +1,42 @@
+import unittest
+import os
+import tempfile
+from secScraper import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cik_path = dict()
+        for cik, sizes in [('1', [10, 10]), ('2', [1000]), ('3', [100, 100, 100])]:
+            self.cik_path[cik] = []
+            for idx, size in enumerate(sizes):
+                path = os.path.join(self.folder.name, '{}_{}.txt'.format(cik, idx))
+                with open(path, 'w') as f:
+                    f.write('a'*size)
+                self.cik_path[cik].append(path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_lpt_order(self):
+        s = {'metrics': ['diff_jaccard']}
+        order, costs = scheduler.lpt_order(self.cik_path, s)
+        self.assertEqual(order, ['2', '3', '1'])
+        self.assertEqual(costs['1'], 2*(10 + 10))  # Parsing + one linear metric
+
+    def test_estimate_cost_quadratic(self):
+        s = {'metrics': ['diff_gfg_editDistDP']}
+        self.assertAlmostEqual(scheduler.estimate_cost(self.cik_path['2'], s), 1000 + 1000**2/2**20)
+        s['edit_distance_sample'] = 1000
+        self.assertEqual(scheduler.estimate_cost(self.cik_path['2'], s), 2000)
+
+    def test_first_idle_time(self):
+        # 2 workers, the first one is recycled after its second CIK and replaced by pid 3
+        records = [(1, 1, 0., 1.), (2, 2, 0., 4.), (3, 1, 1., 2.), (4, 3, 2., 3.), (5, 3, 3., 6.)]
+        self.assertEqual(scheduler.first_idle_time(records, 2, 0.), 4.)
+        self.assertEqual(scheduler.first_idle_time(records[:1], 2, 0.), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import os
+import tempfile
+from secScraper import journal, sharding
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cik_path = dict()
+        for cik, size in [(1, 1000), (2, 600), (3, 500), (4, 100), (5, 100)]:
+            path = os.path.join(self.folder.name, '{}.txt'.format(cik))
+            with open(path, 'w') as f:
+                f.write('a'*size)
+            self.cik_path[cik] = [path]
+        self.s = {'metrics': ['diff_jaccard'], 'lag': 1}
+        self.results = {cik: ({(2016, 2): cik}, 0) for cik in self.cik_path}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_shard_ciks(self):
+        self.assertEqual(sharding.parse_shard('2/3'), (2, 3))
+        shards = [sharding.shard_ciks(self.cik_path, self.s, (i, 2)) for i in [1, 2]]
+        self.assertEqual(sorted(shards[0] + shards[1]), [1, 2, 3, 4, 5])
+        reversed_cik_path = dict(reversed(list(self.cik_path.items())))  # Listed in another order on another machine
+        self.assertEqual(sharding.shard_ciks(reversed_cik_path, self.s, (1, 2)), shards[0])
+
+    def test_journal_settings(self):
+        s = {**self.s, 'path_journal': os.path.join(self.folder.name, 'journal')}
+        files = []
+        for i in [1, 2]:  # Two shards on the same machine
+            f, _ = journal.open_journal(sharding.journal_settings(s, (i, 2)))
+            journal.append_result(f, (i, {(2016, 2): i}, 0))
+            files.append(f)
+        for f in files:
+            f.close()
+        for i in [1, 2]:
+            self.assertEqual(journal.load_journal(sharding.journal_settings(s, (i, 2)))[0], {i: ({(2016, 2): i}, 0)})
+
+    def test_merge_shards(self):
+        output = os.path.join(self.folder.name, 'shards')
+        for i in [1, 2]:
+            ciks = sharding.shard_ciks(self.cik_path, self.s, (i, 2))
+            sharding.write_shard(output, self.s, (i, 2), ciks, self.results)
+        merged, _ = sharding.merge_shards(output)
+        self.assertEqual(merged, self.results)
+        self.assertEqual(sharding.cik_scores_from_results(merged)[3], {(2016, 2): 3})
+
+        # A shard run with other settings
+        sharding.write_shard(output, {**self.s, 'lag': 4}, (2, 2), [], self.results)
+        with self.assertRaises(ValueError):
+            sharding.merge_shards(output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from secScraper import parser
+from secScraper import sketches
+
+
+class TestSketches(unittest.TestCase):
+    def setUp(self):
+        self.tokens_a = ['word{}'.format(idx) for idx in range(0, 600)]
+        self.tokens_b = ['word{}'.format(idx) for idx in range(200, 800)]  # Jaccard of 400/800 = 0.5
+
+    def test_minhash_signature_deterministic(self):
+        test = sketches.minhash_signature(self.tokens_a, num_perm=64)
+        self.assertEqual(test.dtype, np.uint64)
+        self.assertEqual(len(test), 64)
+        self.assertTrue(np.array_equal(test, sketches.minhash_signature(list(reversed(self.tokens_a)), num_perm=64)))
+
+    def test_jaccard_from_signatures_bounds(self):
+        sig_a = sketches.minhash_signature(self.tokens_a)
+        sig_c = sketches.minhash_signature(['other{}'.format(idx) for idx in range(100)])
+        self.assertEqual(sketches.jaccard_from_signatures(sig_a, sig_a), 1)
+        self.assertEqual(sketches.jaccard_from_signatures(sig_a, sig_c), 0)
+
+    def test_jaccard_from_signatures_error_bound(self):
+        num_perm = 256
+        test = sketches.jaccard_from_signatures(sketches.minhash_signature(self.tokens_a, num_perm),
+                                                sketches.minhash_signature(self.tokens_b, num_perm))
+        # 3 standard errors of the documented 1/(2*sqrt(num_perm)) bound
+        self.assertAlmostEqual(test, 0.5, delta=3/(2*np.sqrt(num_perm)))
+
+    def test_lagged_scores(self):
+        s = {'lag': 1, 'list_qtr': [(2012, 1), (2012, 2), (2012, 3)]}
+        stored = {
+            sketches.sketch_key((2012, 1), '7'): sketches.minhash_signature(self.tokens_a),
+            sketches.sketch_key((2012, 2), '_i_2'): sketches.minhash_signature(self.tokens_a),
+            sketches.sketch_key((2012, 3), '_i_2'): sketches.minhash_signature(self.tokens_b)
+        }
+        test = sketches.lagged_scores(stored, [('_i_2', '7'), ('_i_2', '_i_2')], s)
+        self.assertEqual(test[(2012, 2)]['_i_2'], 1)
+        self.assertLess(test[(2012, 3)]['_i_2'], 1)
+
+    def test_invalidate_sketches(self):
+        s = {'sections_to_parse_10k': ['1a', '7']}
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, '20120215_10-K_edgar_data_1000_0000001000-12-000001.txt')
+            with open(path, 'w') as f:
+                f.write('item 1a. risk factors')
+            fingerprint = sketches.report_fingerprint(path, '10-K', s)
+            stored = {sketches.sketch_key((2012, 1), '7'): sketches.minhash_signature(self.tokens_a)}
+            self.assertTrue(sketches.invalidate_sketches(stored, {(2012, 1): fingerprint}))
+            self.assertEqual(len(stored), 1)  # Stored without a fingerprint: recomputed
+            stored[sketches.sketch_key((2012, 1), '7')] = sketches.minhash_signature(self.tokens_a)
+            stored[sketches.sketch_key((2012, 2), '7')] = sketches.minhash_signature(self.tokens_b)
+            self.assertFalse(sketches.invalidate_sketches(stored, {(2012, 1): fingerprint}))
+            self.assertEqual(len(stored), 3)
+
+            grammar_version = parser.grammar_version
+            parser.grammar_version += 1
+            try:
+                self.assertFalse(np.array_equal(sketches.report_fingerprint(path, '10-K', s), fingerprint))
+            finally:
+                parser.grammar_version = grammar_version
+            self.assertFalse(np.array_equal(sketches.report_fingerprint(path, '10-K', {'sections_to_parse_10k': ['7']}),
+                                            fingerprint))
+            with open(path, 'a') as f:
+                f.write(' item 7. management discussion')
+            new_fingerprint = sketches.report_fingerprint(path, '10-K', s)
+            self.assertFalse(np.array_equal(new_fingerprint, fingerprint))
+            self.assertTrue(sketches.invalidate_sketches(stored, {(2012, 1): new_fingerprint}))
+            self.assertEqual(sorted(stored), [sketches.fingerprint_key((2012, 1)), sketches.sketch_key((2012, 2), '7')])
+
+
+if __name__ == '__main__':
+    unittest.main()
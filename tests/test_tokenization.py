@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+from secScraper import tokenization
+
+
+class TestTokenization(unittest.TestCase):
+    def setUp(self):
+        self.input_text = "Hello       Sir. How are you?\r\n I'm good, \t and you? That isn't clear."
+
+    def test_split_text_fast(self):
+        test = tokenization.split_text(self.input_text, 'fast')
+        expected_result = ['hello', 'sir', '.', 'how', 'are', 'you', '?', 'i', "'m", 'good', ',',
+                           'and', 'you', '?', 'that', 'is', "n't", 'clear', '.']
+        self.assertEqual(test, expected_result)
+
+    def test_vocabulary_encode(self):
+        vocab = tokenization.vocabulary()
+        ids = vocab.encode(['b', 'a', 'b', 'c'])
+        self.assertEqual(ids.dtype, np.int32)
+        self.assertEqual(ids.tolist(), [0, 1, 0, 2])
+        self.assertEqual(vocab.encode(['c', 'a']).tolist(), [2, 1])  # Ids never change
+        self.assertEqual(vocab.decode(ids), ['b', 'a', 'b', 'c'])
+
+    def test_vocabulary_grows(self):
+        vocab = tokenization.vocabulary()
+        tokens = ['token{}'.format(idx) for idx in range(3000)]  # More than the initial capacity
+        self.assertEqual(vocab.encode(tokens).tolist(), list(range(3000)))
+        self.assertEqual(len(vocab), 3000)
+
+    def test_vocabulary_truncate(self):
+        vocab = tokenization.vocabulary()
+        tokenization.seed_vocabulary(['Loss', 'losses'], lemmatize=False, vocab=vocab)
+        seeded = vocab.words[:]
+        loss, losses = vocab.encode(['loss', 'losses']).tolist()
+        vocab.encode(['{:,}'.format(idx*1000) for idx in range(3000)])  # Ex: numbers of a CIK
+        lemmatizer = tokenization.lemmatizer
+        tokenization.lemmatizer = type('stub', (), {'lemmatize': staticmethod(lambda word: word[:3])})
+        try:
+            self.assertGreaterEqual(vocab.lemmatize(np.array([losses]))[0], len(seeded))  # 'los' is not seeded
+            vocab.truncate()
+            self.assertEqual(vocab.words, seeded)
+            self.assertEqual(len(vocab.ids), len(seeded))
+            self.assertEqual(vocab.encode(['1,000', 'loss']).tolist(), [len(seeded), loss])
+            self.assertEqual(vocab.decode(vocab.lemmatize(np.array([losses]))), ['los'])
+        finally:
+            tokenization.lemmatizer = lemmatizer
+
+    def test_tokenize_stop_words(self):
+        vocab = tokenization.vocabulary()
+        ids = tokenization.tokenize(self.input_text, 'fast', rm_stop_words=True, vocab=vocab)
+        self.assertEqual(vocab.decode(ids), ['hello', 'sir', '.', '?', "'m", 'good', ',', '?', "n't", 'clear', '.'])
+
+
+if __name__ == '__main__':
+    unittest.main()